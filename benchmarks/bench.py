@@ -0,0 +1,135 @@
+"""Times loading, every derived metric and every curve on synthetic portfolios
+(see pola.synthetic) of growing size, with the peak memory each step adds.
+
+    python benchmarks/bench.py
+    python benchmarks/bench.py --sizes 1000 10000 --storage long --csv results.csv
+
+Each size runs in a fresh process, so that sizes do not share memory.
+"""
+
+import argparse
+import csv
+import functools
+import json
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from pola import synthetic  # noqa: E402
+from pola.curves import CDR, CPR, RecoveryCurve, build_all  # noqa: E402
+from pola.dataset import PortfolioOfOutstandingLoans  # noqa: E402
+from pola.metrics import METRICS, in_dependency_order  # noqa: E402
+from pola.profiling import PeakMemory  # noqa: E402
+
+CURVES = {CPR: "Seasoning", CDR: "Seasoning", RecoveryCurve: "Time Since Default"}
+FIELDS = ["n_loans", "storage", "step", "seconds", "peak_mb"]
+
+
+def run_size(n_loans: int, n_months: int, storage: str, excel_max: int):
+    """Benchmarks one portfolio size, printing a JSON line per step"""
+
+    def step(name, fn):
+        with PeakMemory() as memory:
+            start = time.perf_counter()
+            res = fn()
+            seconds = time.perf_counter() - start
+        # what the step allocates, rather than everything loaded before it
+        peak_mb = memory.peak - memory.start
+        row = dict(zip(FIELDS, [n_loans, storage, name, seconds, peak_mb]))
+        print(json.dumps(row), flush=True)
+        return res
+
+    static_df, tabs = synthetic.generate(n_loans, n_months)
+    if n_loans <= excel_max:
+        with tempfile.TemporaryDirectory() as directory:
+            path = Path(directory) / "portfolio.xlsx"
+            synthetic.to_excel(path, static_df, tabs)
+            del static_df, tabs
+            portfolio = step(
+                "from_excel",
+                lambda: PortfolioOfOutstandingLoans.from_excel(
+                    path,
+                    synthetic.STATIC_TAB,
+                    data_tabs=synthetic.DATA_TABS,
+                    storage=storage,
+                ),
+            )
+    else:
+        portfolio = step("load", lambda: synthetic.portfolio(static_df, tabs, storage))
+        del static_df, tabs
+
+    # each metric after its inputs, so that a step only times its own method, and
+    # through compute as require does: add_* methods also return the wide data_df,
+    # a conversion of the whole panel with the long and compact storages
+    for metric in in_dependency_order(list(dict.fromkeys(METRICS.values()))):
+        compute = getattr(type(portfolio), metric.method).compute
+        step(metric.method, functools.partial(compute, portfolio))
+
+    for curve, index in CURVES.items():
+        step(curve.__name__, lambda: curve(portfolio, index=index))
+    step("build_all", lambda: build_all(portfolio, indexes=["Seasoning"]))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument(
+        "--sizes", type=int, nargs="+", default=[1_000, 10_000, 100_000, 1_000_000]
+    )
+    parser.add_argument("--months", type=int, default=84)
+    parser.add_argument("--storage", default="wide")
+    parser.add_argument(
+        "--excel-max",
+        type=int,
+        default=10_000,
+        help="time from_excel up to this many loans, bigger portfolios are built "
+        "from the generated frames (writing the workbook takes far longer than reading it)",
+    )
+    parser.add_argument("--csv", help="also append the results to this file")
+    parser.add_argument("--single", type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.single is not None:
+        run_size(args.single, args.months, args.storage, args.excel_max)
+        return
+
+    rows = []
+    for n_loans in args.sizes:
+        cmd = [
+            sys.executable,
+            __file__,
+            "--single",
+            str(n_loans),
+            "--months",
+            str(args.months),
+            "--storage",
+            args.storage,
+            "--excel-max",
+            str(args.excel_max),
+        ]
+        with subprocess.Popen(cmd, stdout=subprocess.PIPE, text=True) as proc:
+            for line in proc.stdout:
+                row = json.loads(line)
+                rows.append(row)
+                print(
+                    f"{row['n_loans']:>9} {row['storage']:>7} {row['step']:<40}"
+                    f" {row['seconds']:>9.3f}s {row['peak_mb']:>9.0f}MB",
+                    flush=True,
+                )
+        if proc.returncode:
+            print(f"{n_loans} loans failed with exit code {proc.returncode}")
+
+    if args.csv:
+        new = not Path(args.csv).exists()
+        with open(args.csv, "a", newline="") as f:
+            writer = csv.DictWriter(f, FIELDS)
+            if new:
+                writer.writeheader()
+            writer.writerows(rows)
+
+
+if __name__ == "__main__":
+    main()
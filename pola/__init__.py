@@ -1,9 +1,15 @@
+from .chunked import ChunkedPortfolio
+from .cube import CurveCube
 from .curves import CPR, CDR
 from .dataset import LoanDataTabInfo, PortfolioOfOutstandingLoans, StaticTabInfo
+from .metrics import derived_metric
+from .projection import Projection
+from .scenarios import ScenarioGrid
 from .tabs import MonthEndBalanceTabInfo, PaymentDueTabInfo, PaymentMadeTabInfo
 
 __all__ = [
     "PortfolioOfOutstandingLoans",
+    "ChunkedPortfolio",
     "MonthEndBalanceTabInfo",
     "PaymentMadeTabInfo",
     "PaymentDueTabInfo",
@@ -11,4 +17,8 @@ __all__ = [
     "StaticTabInfo",
     "CPR",
     "CDR",
+    "derived_metric",
+    "Projection",
+    "ScenarioGrid",
+    "CurveCube",
 ]
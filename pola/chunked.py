@@ -0,0 +1,74 @@
+from typing import Callable, Iterator
+
+import numpy as np
+
+from . import io, profiling
+from .dataset import PortfolioOfOutstandingLoans
+from .tabs import LoanDataTabInfo
+
+
+class ChunkedPortfolio:
+    """A portfolio saved with PortfolioOfOutstandingLoans.to_files, processed
+        chunk_size loans at a time, for books which do not fit in memory.
+
+        Loans are split in ranges of key, each range is read, enriched and dropped in turn,
+        so only one chunk is ever in memory. Files written by to_files with the same
+        chunk_size are read a chunk at a time. CSV files are parsed in full for every
+        chunk (a block at a time, so memory stays bounded), which takes chunks x file time:
+        prefer parquet or ipc for big books. Curves accept a ChunkedPortfolio in place of
+        a PortfolioOfOutstandingLoans: they add up the numerator/denominator sums of the chunks.
+
+    Args:
+        directory (str): see PortfolioOfOutstandingLoans.from_files
+        fmt (str, optional): see PortfolioOfOutstandingLoans.from_files. Defaults to "parquet".
+        chunk_size (int, optional): loans per chunk. Defaults to 100_000.
+        prepare (Callable, optional): applied to each chunk before use, to compute metrics with
+            non default arguments, eg lambda chunk: chunk.add_default_month(n_missed=4).
+            Defaults to None.
+    """
+
+    def __init__(
+        self,
+        directory: str,
+        fmt: str = "parquet",
+        chunk_size: int = 100_000,
+        static_name: str = "static",
+        key="loan_id",
+        data_tabs: list[LoanDataTabInfo] | None = None,
+        storage: str = "wide",
+        prepare: Callable[[PortfolioOfOutstandingLoans], object] | None = None,
+    ):
+        self.directory = directory
+        self.fmt = fmt
+        self.chunk_size = chunk_size
+        self.static_name = static_name
+        self.key = key
+        self.data_tabs = data_tabs
+        self.storage = storage
+        self.prepare = prepare
+        # stages of curves built from it, see pola.profiling
+        self.profile = profiling.Profile()
+
+    def loan_ranges(self) -> list[tuple]:
+        """(first, end) key ranges of chunk_size loans, the last end is None"""
+        static_file = io.file_path(self.directory, self.static_name, self.fmt)
+        keys = io.read_frame(static_file, self.fmt, columns=[self.key])[self.key]
+        firsts = np.sort(keys.unique())[:: self.chunk_size].tolist()
+        return list(zip(firsts, [*firsts[1:], None]))
+
+    def chunks(self, *metrics: str) -> Iterator[PortfolioOfOutstandingLoans]:
+        """Each chunk as a portfolio, with metrics computed"""
+        for loan_range in self.loan_ranges():
+            chunk = PortfolioOfOutstandingLoans.from_files(
+                self.directory,
+                self.fmt,
+                static_name=self.static_name,
+                key=self.key,
+                data_tabs=self.data_tabs,
+                storage=self.storage,
+                loan_range=loan_range,
+            )
+            if self.prepare is not None:
+                self.prepare(chunk)
+            chunk.require(*metrics)
+            yield chunk
@@ -0,0 +1,278 @@
+import importlib
+import json
+
+import pandas as pd
+import polars as pl
+import pyarrow.parquet as pq
+
+from . import profiling
+from .chunked import ChunkedPortfolio
+from .curves import (
+    CDR,
+    CPR,
+    DENOMINATOR,
+    NUMERATOR,
+    ROWS,
+    Curve,
+    RecoveryCurve,
+    add_sums,
+    curve_components,
+    curves_from_sums,
+)
+from .dataset import PortfolioOfOutstandingLoans
+
+# Extendable!
+# Dimensions of a cube are static columns or any of DIMENSIONS: a polars expression over
+# static columns, eg the origination vintage. Add your own, eg
+#   DIMENSIONS["balance_band"] = (pl.col("original_balance") // 50_000) * 50_000
+
+DIMENSIONS: dict[str, pl.Expr] = {
+    "vintage_year": pl.col("origination_date").dt.year(),
+    "vintage_quarter": pl.concat_str(
+        pl.col("origination_date").dt.year(),
+        pl.lit("Q"),
+        pl.col("origination_date").dt.quarter(),
+    ),
+    "reversion_year": pl.col("reversion_date").dt.year(),
+    # fixed rate period, in months
+    "fixed_months": (
+        (pl.col("reversion_date") - pl.col("origination_date")).dt.total_days() / 30
+    )
+    .round()
+    .cast(pl.Int16),
+}
+
+# columns of CurveCube.cube besides the dimensions and the sums
+INDEX = "index"
+INDEX_VALUE = "index_value"
+
+
+class CurveCube:
+    """NUMERATOR and DENOMINATOR sums of several curves per combination of dimensions
+    (eg vintage and product) and index value, built in a single pass over the loans
+
+    Curves of any roll-up (fewer dimensions) or drill-down (some values of a dimension)
+    are then aggregations of the cube, the loans are not read again.
+
+    Attributes:
+        cube (pl.DataFrame): dimensions, INDEX (name), INDEX_VALUE, "<alias> numerator"
+            and "<alias> denominator" of each curve and ROWS (loan months summed)
+        dimensions (list[str]): see DIMENSIONS
+        curve_types (list[type[Curve]]): curves summed
+
+    eg
+        cube = CurveCube.build(portfolio, ["vintage_year", "product"])
+        cube.curves(CPR, by=["vintage_year"])
+        cube.curves(CDR, by=["product"], where={"vintage_year": [2017, 2018]})
+    """
+
+    def __init__(
+        self, cube: pl.DataFrame, dimensions: list[str], curves: list[type[Curve]]
+    ):
+        self.cube = cube
+        self.dimensions = list(dimensions)
+        self.curve_types = list(curves)
+
+    @classmethod
+    def build(
+        cls,
+        portfolio: PortfolioOfOutstandingLoans,
+        dimensions: list[str] = ["vintage_year", "product"],
+        curves: list[type[Curve]] = [CPR, CDR, RecoveryCurve],
+        indexes: list[str] = ["Seasoning"],
+    ) -> "CurveCube":
+        """Sums of curves per dimensions and value of each of indexes
+
+        Args:
+            portfolio (PortfolioOfOutstandingLoans): also accepts a ChunkedPortfolio
+            dimensions (list[str], optional): static columns and/or DIMENSIONS.
+                Defaults to ["vintage_year", "product"].
+            curves (list[type[Curve]], optional): Defaults to [CPR, CDR, RecoveryCurve].
+            indexes (list[str], optional): x axes. Defaults to ["Seasoning"].
+        """
+        with portfolio.profile.stage("CurveCube", portfolio):
+            return cls(
+                _cube(portfolio, list(dimensions), list(curves), list(indexes)),
+                dimensions,
+                curves,
+            )
+
+    def sums(
+        self,
+        curve: type[Curve],
+        index: str = "Seasoning",
+        by: list[str] = [],
+        where: dict[str, list] | None = None,
+    ) -> pl.DataFrame:
+        """Curve.sums of curve pivoted by by, of the loans whose dimensions are in where
+
+        Args:
+            by (list[str], optional): dimensions to pivot by. Defaults to [].
+            where (dict[str, list], optional): dimension -> values to keep. Defaults to
+                None, all loans.
+        """
+        if curve not in self.curve_types:
+            raise ValueError(f"{curve.__name__} is not in the cube")
+        unknown = [
+            name for name in [*by, *(where or {})] if name not in self.dimensions
+        ]
+        if unknown:
+            raise ValueError(f"{unknown} are not dimensions of {self.dimensions}")
+        if index not in self.cube[INDEX].cast(pl.String).unique().to_list():
+            raise ValueError(f"{index} is not an index of the cube")
+
+        cube = self.cube.filter(pl.col(INDEX) == index)
+        for name, values in (where or {}).items():
+            cube = cube.filter(pl.col(name).is_in(list(values)))
+        sums = cube.select(
+            *by,
+            pl.col(INDEX_VALUE).alias(index),
+            pl.col(f"{curve.alias} {NUMERATOR}").alias(NUMERATOR),
+            pl.col(f"{curve.alias} {DENOMINATOR}").alias(DENOMINATOR),
+        )
+        return add_sums([sums], index, by)
+
+    def curves(
+        self,
+        curve: type[Curve],
+        index: str = "Seasoning",
+        by: list[str] = [],
+        where: dict[str, list] | None = None,
+        filter_gt_0: bool = True,
+    ) -> pd.DataFrame:
+        """Same as curve(portfolio, index, pivots=by).curves, of the loans in where
+        (see sums)
+        """
+        return curves_from_sums(
+            self.sums(curve, index, by, where), index, by, curve.alias, filter_gt_0
+        )
+
+    def nbytes(self) -> int:
+        return int(self.cube.estimated_size())
+
+    def save(self, path: str):
+        """Writes the cube to a parquet file, see load"""
+        settings = {
+            "dimensions": self.dimensions,
+            "curves": [f"{c.__module__}.{c.__qualname__}" for c in self.curve_types],
+        }
+        table = self.cube.to_arrow()
+        table = table.replace_schema_metadata(
+            {**(table.schema.metadata or {}), b"pola": json.dumps(settings).encode()}
+        )
+        pq.write_table(table, path)
+
+    @classmethod
+    def load(cls, path: str) -> "CurveCube":
+        table = pq.read_table(path)
+        settings = json.loads(table.schema.metadata[b"pola"])
+        curves = []
+        for name in settings["curves"]:
+            module, name = name.rsplit(".", 1)
+            curves.append(getattr(importlib.import_module(module), name))
+        return cls(pl.from_arrow(table), settings["dimensions"], curves)
+
+
+def _cube(
+    portfolio: PortfolioOfOutstandingLoans,
+    dimensions: list[str],
+    curves: list[type[Curve]],
+    indexes: list[str],
+) -> pl.DataFrame:
+    """CurveCube.cube of portfolio"""
+    names = list(
+        dict.fromkeys([*indexes, *(name for curve in curves for name in curve.metrics)])
+    )
+    if isinstance(portfolio, ChunkedPortfolio):
+        parts = [
+            _cube(chunk, dimensions, curves, indexes)
+            for chunk in portfolio.chunks(*names)
+        ]
+        keys = [*dimensions, INDEX, INDEX_VALUE]
+        sums = [col for col in parts[0].columns if col not in keys]
+        return _sorted(
+            pl.concat(parts).group_by(keys).agg(pl.col(sums).sum()), dimensions
+        )
+
+    portfolio.require(*names)
+    panel = portfolio.long_data(names)
+    panel = panel.join(
+        _dimensions(portfolio, dimensions),
+        on=portfolio.key,
+        how="left",
+        maintain_order="left",
+    )
+
+    sums = [
+        name
+        for curve in curves
+        for name in (f"{curve.alias} {NUMERATOR}", f"{curve.alias} {DENOMINATOR}")
+    ]
+
+    parts = []
+    for index in indexes:
+        columns = [
+            panel.select(*dimensions, pl.col(index).cast(pl.Float64).alias(INDEX_VALUE))
+        ]
+        for curve in curves:
+            columns.append(
+                curve_components(curve, panel, index).select(
+                    pl.col(NUMERATOR)
+                    .cast(pl.Float64)
+                    .alias(f"{curve.alias} {NUMERATOR}"),
+                    pl.col(DENOMINATOR)
+                    .cast(pl.Float64)
+                    .alias(f"{curve.alias} {DENOMINATOR}"),
+                )
+            )
+        parts.append(
+            pl.concat(columns, how="horizontal")
+            .group_by([*dimensions, INDEX_VALUE])
+            .agg(pl.col(sums).sum(), pl.len().cast(pl.Int64).alias(ROWS))
+            .select(
+                *dimensions,
+                pl.lit(index).cast(pl.Categorical).alias(INDEX),
+                INDEX_VALUE,
+                *sums,
+                ROWS,
+            )
+        )
+    return _sorted(pl.concat(parts), dimensions)
+
+
+def _sorted(cube: pl.DataFrame, dimensions: list[str]) -> pl.DataFrame:
+    return cube.sort([*dimensions, INDEX, INDEX_VALUE], nulls_last=True)
+
+
+def _dimensions(
+    portfolio: PortfolioOfOutstandingLoans, dimensions: list[str]
+) -> pl.DataFrame:
+    """Key and dimensions of each loan, text as categories"""
+    static_df = portfolio.static_df
+    unknown = [
+        name
+        for name in dimensions
+        if name not in DIMENSIONS and name not in static_df.columns
+    ]
+    if unknown:
+        raise ValueError(f"{unknown} are neither static columns nor DIMENSIONS")
+
+    needed = [
+        column
+        for name in dimensions
+        for column in (
+            DIMENSIONS[name].meta.root_names()
+            if name not in static_df.columns
+            else [name]
+        )
+    ]
+    profiling.count_conversion()
+    static = pl.from_pandas(static_df[list(dict.fromkeys([portfolio.key, *needed]))])
+    res = static.select(
+        portfolio.key,
+        *(
+            pl.col(name) if name in static_df.columns else DIMENSIONS[name].alias(name)
+            for name in dimensions
+        ),
+    )
+    return res.with_columns(pl.col(pl.String).cast(pl.Categorical))
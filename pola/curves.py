@@ -1,11 +1,37 @@
-from abc import ABC, abstractmethod
+import datetime
+import importlib
+import json
+import warnings
+from abc import ABC
 
+import numpy as np
 import pandas as pd
 import polars as pl
+import pyarrow.parquet as pq
 import matplotlib.pyplot as plt
 
+from . import profiling
+from .chunked import ChunkedPortfolio
 from .dataset import PortfolioOfOutstandingLoans
 
+# column names of Curve.components
+NUMERATOR = "numerator"
+DENOMINATOR = "denominator"
+# number of loan months summed, see CurveAccumulator
+ROWS = "rows"
+# column of Curve.curves of each pivot group, see curves_from_sums
+CURVE_NAME = "curve name"
+
+
+def _calls_python(expr: pl.Expr) -> bool:
+    """Does expr run a Python function (map_elements, map_batches...) anywhere"""
+    try:
+        plan = expr.meta.serialize(format="json")
+    except pl.exceptions.ComputeError:
+        # only Python functions fail to serialize
+        return True
+    return '"AnonymousFunction"' in plan
+
 
 class Curve(ABC):
     """This curve originates from PortfolioOfOutstandingLoans
@@ -14,6 +40,59 @@ class Curve(ABC):
 
     # TODO abstract property
     alias = None
+    # Extendable!
+    # A curve is sum(numerator) / sum(denominator) per index value. Declare both as polars
+    # expressions over "Data" labels (eg pl.col("Month End Balance")), they are evaluated
+    # on the long panel of the portfolio, so that curves never run Python per loan month.
+    # Curves which need more than two expressions override components instead, and then
+    # declare their metrics. Curves which only implement build_from_portfolio (deprecated)
+    # are still built by it, one pivot group at a time.
+    numerator: pl.Expr = None
+    denominator: pl.Expr = None
+    # "Data" labels the curve is built from (besides the index),
+    # by default the columns of numerator and denominator
+    metrics = []
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        for expr in (cls.numerator, cls.denominator):
+            if expr is not None and _calls_python(expr):
+                raise ValueError(
+                    f"{cls.__name__}: {expr} calls Python, use native polars expressions"
+                )
+        if "build_from_portfolio" in cls.__dict__:
+            warnings.warn(
+                f"{cls.__name__}.build_from_portfolio is deprecated, declare numerator "
+                "and denominator as polars expressions, or override components",
+                DeprecationWarning,
+                # the class statement, past ABCMeta.__new__
+                stacklevel=3,
+            )
+        # abstract bases might declare neither, or only one of them
+        if (
+            "metrics" not in cls.__dict__
+            and not cls._overrides_components()
+            and cls.numerator is not None
+            and cls.denominator is not None
+        ):
+            cls.metrics = list(
+                dict.fromkeys(
+                    cls.numerator.meta.root_names() + cls.denominator.meta.root_names()
+                )
+            )
+
+    @classmethod
+    def _overrides_components(cls) -> bool:
+        return cls.components.__func__ is not Curve.components.__func__
+
+    @classmethod
+    def _is_legacy(cls) -> bool:
+        """Built by build_from_portfolio, having neither expressions nor components"""
+        return (
+            hasattr(cls, "build_from_portfolio")
+            and not cls._overrides_components()
+            and (cls.numerator is None or cls.denominator is None)
+        )
 
     def __init__(
         self,
@@ -22,13 +101,28 @@ class Curve(ABC):
         pivots=[],
         filter_gt_0: bool = True,
     ):
-        self.curves = self.build_curves_with_pivot(
-            portfolio, index, pivots, filter_gt_0
-        )
+        with portfolio.profile.stage(type(self).__name__, portfolio):
+            self.curves = self.build_curves_with_pivot(
+                portfolio, index, pivots, filter_gt_0
+            )
 
-    @abstractmethod
-    def build_from_portfolio(self, *args, **kwargs):
-        pass
+    @classmethod
+    def components(cls, panel: pl.DataFrame, index="Seasoning") -> pl.DataFrame:
+        """Long frame of the index, NUMERATOR and DENOMINATOR of the curve,
+        one row per loan per month of panel (see PortfolioOfOutstandingLoans.long_data)
+
+        Overrides are checked on every call, see curve_components
+        """
+        if cls.numerator is None or cls.denominator is None:
+            raise TypeError(
+                f"{cls.__name__} must declare numerator and denominator as polars "
+                "expressions, or override components"
+            )
+        return panel.select(
+            pl.col(index),
+            cls.numerator.alias(NUMERATOR),
+            cls.denominator.alias(DENOMINATOR),
+        )
 
     def build_curves_with_pivot(
         self,
@@ -37,48 +131,66 @@ class Curve(ABC):
         pivots=[],
         filter_gt_0: bool = True,
     ) -> pd.DataFrame:
-        """Distributes pivots into single calculations
+        """One curve per pivot group
 
         Args:
-            portfolio (PortfolioOfOutstandingLoans): 
+            portfolio (PortfolioOfOutstandingLoans): also accepts a ChunkedPortfolio
             index (str, optional):. Defaults to "Seasoning".
             pivots (list, optional): . Defaults to [].
             filter_gt_0 (bool, optional): . Defaults to True.
 
         Returns:
-            pd.DataFrame: _description_
+            pd.DataFrame: one curve per column
         """
+        if self._is_legacy():
+            return self._build_legacy(portfolio, index, pivots, filter_gt_0)
+        sums = self.sums(portfolio, index, pivots)
+        return curves_from_sums(sums, index, pivots, self.alias, filter_gt_0)
+
+    def _build_legacy(
+        self,
+        portfolio: PortfolioOfOutstandingLoans,
+        index="Seasoning",
+        pivots=[],
+        filter_gt_0: bool = True,
+    ) -> pd.DataFrame:
+        """One build_from_portfolio call per pivot group, on the wide data_df"""
+        if isinstance(portfolio, ChunkedPortfolio):
+            raise TypeError(
+                f"{type(self).__name__} only implements build_from_portfolio, "
+                "which needs the whole portfolio in memory"
+            )
+        portfolio.require(*self.metrics)
         cashflow_columns = portfolio.get_date_cols()
+        if not pivots:
+            curve = self.build_from_portfolio(
+                portfolio.data_df, cashflow_columns, index, filter_gt_0
+            )
+            return pd.concat([curve], axis=1)
 
         curves = []
-
-        if pivots:
-            # split by pivot
-            for gr_name, group in portfolio.all_data().groupby(
-                by=pivots, as_index=False
-            ):
-                gr_name_str = [
-                    piv_name + "_" + str(piv_val)
-                    for (piv_name, piv_val) in zip(pivots, gr_name)
-                ]
-                name = "_".join(gr_name_str)
-
-                # compute curve for each group
-                curves.append(
-                    self.build_from_portfolio(
-                        group, cashflow_columns, index, filter_gt_0
-                    ).rename(name + " " + f"{self.alias} per {index}")
-                )
-
-        else:
+        for gr_name, group in portfolio.all_data().groupby(by=pivots, as_index=False):
+            name = "_".join(
+                piv_name + "_" + str(piv_val)
+                for (piv_name, piv_val) in zip(pivots, gr_name)
+            )
             curves.append(
                 self.build_from_portfolio(
-                    portfolio.data_df, cashflow_columns, index, filter_gt_0
-                )
+                    group, cashflow_columns, index, filter_gt_0
+                ).rename(name + " " + f"{self.alias} per {index}")
             )
-
         return pd.concat(curves, axis=1)
 
+    @classmethod
+    def sums(
+        cls, portfolio: PortfolioOfOutstandingLoans, index="Seasoning", pivots=[]
+    ) -> pl.DataFrame:
+        """NUMERATOR and DENOMINATOR sums for each pivot group and index value
+
+        Sums add up, so sums of parts of a portfolio can be combined with add_sums
+        """
+        return build_all_sums(portfolio, [cls], [index], pivots)[(cls.alias, index)]
+
     def show(self):
         # Create a single plot
         plt.figure(figsize=(10, 6))
@@ -129,45 +241,9 @@ class CPR(Curve):
     """
 
     alias = "CPR"
-
-    def build_from_portfolio(
-        self, data_df, cashflow_columns, index="Seasoning", filter_gt_0: bool = True
-    ) -> pd.Series:
-        loan_data = pl.from_pandas(data_df)
-
-        cashflow_columns_polars = [dt.strftime("%Y-%m-%d") for dt in cashflow_columns]
-
-        # Put all Seasonings, Month End Balance, Is Recovery Payment, Payment Made vs Due into one long Series each
-        seasonings = loan_data.filter(pl.col("Data").eq(index))  # select Seasoning
-        seasonings_only_cashflows = seasonings.select(
-            [pl.col(column) for column in cashflow_columns_polars]
-        )  # Drop Data and Loan Id
-        combined_seasonings = pl.concat(seasonings_only_cashflows.get_columns()).rename(
-            index
-        )  # concat into one
-
-        meb = loan_data.filter(pl.col("Data").eq("Month End Balance"))
-        meb_only_cashflows = meb.select(
-            [pl.col(column) for column in cashflow_columns_polars]
-        )
-        combined_meb = pl.concat(meb_only_cashflows.get_columns()).rename("MEB")
-
-        pmvpd = loan_data.filter(pl.col("Data").eq("Payment Made vs Due"))
-        pmvpd_only_cashflows = pmvpd.select(
-            [pl.col(column) for column in cashflow_columns_polars]
-        )
-        combined_pmvpd = pl.concat(pmvpd_only_cashflows.get_columns()).rename("PMVPD")
-
-        # Assume Where Payment Made > Payment Due is a prepayment
-        prepayment_ammount = combined_pmvpd.map_elements(
-            lambda x: 0 if x < 0 else x, return_dtype=pl.Float64
-        ).rename("PPA")  # TODO don't use apply, it's slow
-
-        df = pl.DataFrame([combined_seasonings, combined_meb, prepayment_ammount])
-
-        # For each unique seasoning:
-        # sum Recovery Payment Ammounts / sum month end balance
-        return groupby_and_ratio(df, index, "PPA", "MEB", self.alias, filter_gt_0)
+    # Assume Where Payment Made > Payment Due is a prepayment
+    numerator = pl.col("Payment Made vs Due").clip(lower_bound=0)
+    denominator = pl.col("Month End Balance")
 
 
 class CDR(Curve):
@@ -183,42 +259,11 @@ class CDR(Curve):
     """
 
     alias = "CDR"
+    numerator = pl.col("Is Default Month")
+    denominator = pl.col("Is Active")
 
-    def build_from_portfolio(
-        self, data_df, cashflow_columns, index="Seasoning", filter_gt_0: bool = True
-    ) -> pd.Series:
-        loan_data = pl.from_pandas(data_df)
-
-        cashflow_columns_polars = [dt.strftime("%Y-%m-%d") for dt in cashflow_columns]
-
-        # Put all Seasonings, Month End Balance, Is Recovery Payment, Payment Made vs Due into one long Series each
-        seasonings = loan_data.filter(pl.col("Data").eq(index))  # select Seasoning
-        seasonings_only_cashflows = seasonings.select(
-            [pl.col(column) for column in cashflow_columns_polars]
-        )  # Drop Data and Loan Id
-        combined_seasonings = pl.concat(seasonings_only_cashflows.get_columns()).rename(
-            index
-        )  # concat into one
-
-        idm = loan_data.filter(pl.col("Data").eq("Is Default Month"))
-        idm_only_cashflows = idm.select(
-            [pl.col(column) for column in cashflow_columns_polars]
-        )
-        combined_idm = pl.concat(idm_only_cashflows.get_columns()).rename("IDM")
-
-        ia = loan_data.filter(pl.col("Data").eq("Is Active"))
-        ia_only_cashflows = ia.select(
-            [pl.col(column) for column in cashflow_columns_polars]
-        )
-        combined_ia = pl.concat(ia_only_cashflows.get_columns()).rename("IA")
-
-        df = pl.DataFrame([combined_seasonings, combined_idm, combined_ia])
-
-        return groupby_and_ratio(df, index, "IDM", "IA", self.alias, filter_gt_0)
 
 class RecoveryCurve(Curve):
-    alias = "Recovery Curve"
-
     """
         For each Time to Default - cumulative sum recovery payments and divide by BalanceAtDefault
         
@@ -230,41 +275,232 @@ class RecoveryCurve(Curve):
             a dataframe with each column being the CPR for that unique value of pivot. Defaults to [].
     """
 
-    def build_from_portfolio(
-        self, data_df, cashflow_columns, index="Time Since Default", filter_gt_0: bool = True
-    ) -> pd.Series:
-        
-        loan_data = pl.from_pandas(data_df)
-        
-        cashflow_columns_polars = [dt.strftime("%Y-%m-%d") for dt in cashflow_columns]
-
-        # Put all Seasonings, Month End Balance, Is Recovery Payment, Payment Made vs Due into one long Series each
-        seasonings = loan_data.filter(pl.col("Data").eq(index))  # select Seasoning
-        seasonings_only_cashflows = seasonings.select(
-            [pl.col(column) for column in cashflow_columns_polars]
-        )  # Drop Data and Loan Id
-        combined_indexes = pl.concat(seasonings_only_cashflows.get_columns()).rename(
-            index
-        )  # concat into one
-
-        cr = loan_data.filter(pl.col("Data").eq("Cummulative Recovery"))
-        cr_only_cashflows = cr.select(
-            [pl.col(column) for column in cashflow_columns_polars]
+    alias = "Recovery Curve"
+    numerator = pl.col("Cummulative Recovery")
+    denominator = pl.col("BalanceAtDefault")
+
+
+def build_all(
+    portfolio: PortfolioOfOutstandingLoans,
+    curves: list[type[Curve]] = [CPR, CDR, RecoveryCurve],
+    indexes: list[str] = ["Seasoning"],
+    pivots: list[str] = [],
+    filter_gt_0: bool = True,
+) -> dict[tuple[str, str], pd.DataFrame]:
+    """Every curve per every index, from a single reshape of the portfolio
+
+    Args:
+        portfolio (PortfolioOfOutstandingLoans): also accepts a ChunkedPortfolio
+        curves (list[type[Curve]], optional): Defaults to [CPR, CDR, RecoveryCurve].
+        indexes (list[str], optional): x axes. Defaults to ["Seasoning"].
+        pivots (list[str], optional): static columns, see Curve. Defaults to [].
+        filter_gt_0 (bool, optional): Defaults to True.
+
+    Returns:
+        dict: (curve alias, index) -> curves, as Curve.curves
+    """
+    with portfolio.profile.stage("build_all", portfolio):
+        return {
+            (alias, index): curves_from_sums(sums, index, pivots, alias, filter_gt_0)
+            for (alias, index), sums in build_all_sums(
+                portfolio, curves, indexes, pivots
+            ).items()
+        }
+
+
+def build_all_sums(
+    portfolio: PortfolioOfOutstandingLoans,
+    curves: list[type[Curve]],
+    indexes: list[str],
+    pivots: list[str] = [],
+) -> dict[tuple[str, str], pl.DataFrame]:
+    """Curve.sums of every curve per every index, keyed by (curve alias, index)"""
+    names = list(
+        dict.fromkeys([*indexes, *(name for curve in curves for name in curve.metrics)])
+    )
+    if isinstance(portfolio, ChunkedPortfolio):
+        parts = [
+            build_all_sums(chunk, curves, indexes, pivots)
+            for chunk in portfolio.chunks(*names)
+        ]
+        return {
+            (alias, index): add_sums([part[(alias, index)] for part in parts], index, pivots)
+            for (alias, index) in parts[0]
+        }
+
+    # compute whatever is missing
+    portfolio.require(*names)
+
+    # reshape once, then for each index all curves in a single group_by
+    panel = portfolio.long_data(names, pivots)
+    res = {}
+    for index in indexes:
+        columns = [panel.select(*pivots, index)]
+        for curve in curves:
+            columns.append(
+                curve_components(curve, panel, index).select(
+                    pl.col(NUMERATOR).alias(f"{curve.alias} {NUMERATOR}"),
+                    pl.col(DENOMINATOR).alias(f"{curve.alias} {DENOMINATOR}"),
+                )
+            )
+        sums = pl.concat(columns, how="horizontal").group_by(pivots + [index]).sum()
+        for curve in curves:
+            res[(curve.alias, index)] = sums.select(
+                *pivots,
+                index,
+                pl.col(f"{curve.alias} {NUMERATOR}").alias(NUMERATOR),
+                pl.col(f"{curve.alias} {DENOMINATOR}").alias(DENOMINATOR),
+            )
+    return res
+
+
+class CurveAccumulator:
+    """NUMERATOR and DENOMINATOR sums of a curve per pivot group and index value,
+    kept up to date as loans and months come and go, rather than rebuilt
+
+    Args:
+        curve (type[Curve]): eg CPR
+        index (str, optional): x axis. Defaults to "Seasoning".
+        pivots (list, optional): static columns, see Curve. Defaults to [].
+        filter_gt_0 (bool, optional): Defaults to True.
+
+    eg
+        acc = CurveAccumulator(CPR, pivots=["product"])
+        acc.add(portfolio)
+        rewritten = portfolio.append_month(data)
+        acc.add_month(portfolio, rewritten)
+        acc.curves
+    """
+
+    def __init__(
+        self,
+        curve: type[Curve],
+        index="Seasoning",
+        pivots=[],
+        filter_gt_0: bool = True,
+    ):
+        self.curve = curve
+        self.index = index
+        self.pivots = list(pivots)
+        self.filter_gt_0 = filter_gt_0
+        self.sums: pl.DataFrame | None = None
+
+    @property
+    def curves(self) -> pd.DataFrame:
+        """Same as Curve.curves"""
+        return curves_from_sums(
+            self.sums, self.index, self.pivots, self.curve.alias, self.filter_gt_0
+        )
+
+    def add(
+        self,
+        portfolio: PortfolioOfOutstandingLoans,
+        months: list[datetime.date] | None = None,
+    ):
+        """Adds the loan months of portfolio (also accepts a ChunkedPortfolio)
+
+        Args:
+            months (list[datetime.date], optional): only these. Defaults to all.
+        """
+        self._combine(self._sums(portfolio, months), 1)
+
+    def remove(
+        self,
+        portfolio: PortfolioOfOutstandingLoans,
+        months: list[datetime.date] | None = None,
+    ):
+        """Takes out the loan months of portfolio, which must have been added"""
+        self._combine(self._sums(portfolio, months), -1)
+
+    def add_month(
+        self, portfolio: PortfolioOfOutstandingLoans, rewritten: np.ndarray = []
+    ):
+        """Takes in the last month of portfolio, once added with append_month
+
+        Args:
+            rewritten (np.ndarray, optional): loans whose previous months changed,
+                as returned by append_month. Defaults to [].
+        """
+        months = portfolio.get_date_cols()
+        self.add(portfolio, months[-1:])
+        if len(rewritten):
+            # what they were is what they are recomputed without the new month
+            self.remove(portfolio.without_metrics(rewritten, months[:-1]))
+            self.add(portfolio.subset(rewritten), months[:-1])
+
+    def _sums(
+        self,
+        portfolio: PortfolioOfOutstandingLoans,
+        months: list[datetime.date] | None,
+    ) -> pl.DataFrame:
+        names = list(dict.fromkeys([self.index, *self.curve.metrics]))
+        if isinstance(portfolio, ChunkedPortfolio):
+            parts = [self._sums(chunk, months) for chunk in portfolio.chunks(*names)]
+            return pl.concat(parts).group_by(self.pivots + [self.index]).sum()
+
+        portfolio.require(*names)
+        panel = portfolio.long_data(names, self.pivots, months)
+        df = pl.concat(
+            [panel.select(self.pivots), curve_components(self.curve, panel, self.index)],
+            how="horizontal",
+        )
+        return df.group_by(self.pivots + [self.index]).agg(
+            pl.col(NUMERATOR).sum(),
+            pl.col(DENOMINATOR).sum(),
+            pl.len().cast(pl.Int64).alias(ROWS),
         )
-        combined_cr = pl.concat(cr_only_cashflows.get_columns()).rename("CR") # combine as one long series
 
-        bad = loan_data.filter(pl.col("Data").eq("BalanceAtDefault"))
-        bad_only_cashflows = bad.select(
-            [pl.col(column) for column in cashflow_columns_polars]
+    def _combine(self, sums: pl.DataFrame, sign: int):
+        sums = sums.with_columns(pl.col(NUMERATOR, DENOMINATOR, ROWS) * sign)
+        if self.sums is not None:
+            sums = pl.concat([self.sums, sums]).group_by(
+                self.pivots + [self.index], maintain_order=True
+            ).sum()
+        # groups whose loan months were all taken out
+        self.sums = sums.filter(pl.col(ROWS) > 0)
+
+    def save(self, path: str):
+        """Writes the sums to a parquet file, see load"""
+        settings = {
+            "curve": f"{self.curve.__module__}.{self.curve.__qualname__}",
+            "index": self.index,
+            "pivots": self.pivots,
+            "filter_gt_0": self.filter_gt_0,
+        }
+        table = self.sums.to_arrow()
+        table = table.replace_schema_metadata(
+            {**(table.schema.metadata or {}), b"pola": json.dumps(settings).encode()}
         )
+        pq.write_table(table, path)
 
-        combined_bad = pl.concat(bad_only_cashflows.get_columns()).rename("BD") # combine as one long series
+    @classmethod
+    def load(cls, path: str) -> "CurveAccumulator":
+        table = pq.read_table(path)
+        settings = json.loads(table.schema.metadata[b"pola"])
+        module, name = settings["curve"].rsplit(".", 1)
+        curve = getattr(importlib.import_module(module), name)
 
-        
-        df = pl.DataFrame([combined_indexes, combined_cr, combined_bad])
+        res = cls(curve, settings["index"], settings["pivots"], settings["filter_gt_0"])
+        res.sums = pl.from_arrow(table)
+        return res
 
-        # Almost finished
-        return groupby_and_ratio(df, index, "CR", "BD", self.alias, filter_gt_0)
+
+def curve_components(
+    curve: type[Curve], panel: pl.DataFrame, index: str
+) -> pl.DataFrame:
+    """curve.components, checked: index, NUMERATOR and DENOMINATOR, one row per row of
+    panel
+    """
+    res = curve.components(panel, index)
+    missing = [name for name in (index, NUMERATOR, DENOMINATOR) if name not in res.columns]
+    if missing:
+        raise ValueError(f"{curve.__name__}.components did not return {missing}")
+    if res.height != panel.height:
+        raise ValueError(
+            f"{curve.__name__}.components returned {res.height} rows, "
+            f"expected one per loan month ({panel.height})"
+        )
+    return res
 
 
 def groupby_and_ratio(
@@ -285,6 +521,71 @@ def groupby_and_ratio(
     if filter_gt_0:
         rpa_div_by_meb = rpa_div_by_meb.filter(pl.col(index) >= 0)
 
+    profiling.count_conversion()
     res = rpa_div_by_meb.to_pandas()
     res.set_index(index, inplace=True)
     return res[alias]
+
+
+def sum_by(df: pl.DataFrame, by: list[str]) -> pl.DataFrame:
+    """NUMERATOR and DENOMINATOR sums per group"""
+    return df.group_by(by).agg(pl.col(NUMERATOR).sum(), pl.col(DENOMINATOR).sum())
+
+
+def add_sums(sums: list[pl.DataFrame], index: str, pivots=[]) -> pl.DataFrame:
+    """Combines sums (see Curve.sums) of parts of a portfolio"""
+    return sum_by(pl.concat(sums), [*pivots, index])
+
+
+def curves_from_sums(
+    sums: pl.DataFrame,
+    index: str,
+    pivots: list[str],
+    alias: str,
+    filter_gt_0: bool = True,
+) -> pd.DataFrame:
+    """Curve.curves from Curve.sums: one column per pivot group
+
+    Ratios of every group are computed in one group_by and laid out as columns with a
+    single pivot, then converted to pandas once
+    """
+    if not pivots:
+        curve = groupby_and_ratio(
+            sums, index, NUMERATOR, DENOMINATOR, alias, filter_gt_0
+        )
+        return pd.concat([curve], axis=1)
+
+    ratios = (
+        sums.drop_nulls(pivots)
+        .group_by([*pivots, index])
+        .agg((pl.col(NUMERATOR).sum() / pl.col(DENOMINATOR).sum()).alias(alias))
+    )
+    if filter_gt_0:
+        ratios = ratios.filter(pl.col(index) >= 0)
+
+    # column of each group, in the order of the groups
+    groups = sums.select(pivots).drop_nulls().unique().sort(pivots)
+    names = [curve_name(pivots, values, alias, index) for values in groups.rows()]
+    ratios = ratios.join(
+        groups.with_columns(pl.Series(CURVE_NAME, names, dtype=pl.String)),
+        on=pivots,
+    )
+    wide = ratios.pivot(on=CURVE_NAME, index=index, values=alias).sort(index)
+    # groups without any index value left, eg all negative, are columns of NaN
+    wide = wide.with_columns(
+        pl.lit(None, pl.Float64).alias(name) for name in names if name not in wide.columns
+    ).select(index, *names)
+
+    profiling.count_conversion()
+    return wide.to_pandas().set_index(index)
+
+
+def curve_name(pivots: list[str], values: tuple, alias: str, index: str) -> str:
+    """Column of Curve.curves of the pivot group values (alias without pivots)"""
+    if not pivots:
+        return alias
+    gr_name_str = [
+        piv_name + "_" + str(piv_val) for (piv_name, piv_val) in zip(pivots, values)
+    ]
+    name = "_".join(gr_name_str)
+    return name + " " + f"{alias} per {index}"
@@ -1,403 +1,937 @@
+import copy
 import datetime
+import multiprocessing
+import pickle
+from concurrent.futures import Executor, ProcessPoolExecutor
+from itertools import repeat
+from pathlib import Path
 
 import numpy as np
 import pandas as pd
 import polars as pl
 
+from . import io, kernels, profiling
+from .metrics import (
+    FLAG,
+    METRICS,
+    MONTHS,
+    Metric,
+    dependents,
+    derived_metric,
+    in_dependency_order,
+)
+from .storage import (
+    STORAGES,
+    LongStorage,
+    MonthlyDataStorage,
+    make_storage,
+)
 from .tabs import LoanDataTabInfo, StaticTabInfo
 
 
 class PortfolioOfOutstandingLoans:
-    def __init__(self, data_df: pd.DataFrame, static_df: pd.DataFrame, key: str):
-        self.data_df = data_df
+    """Static (per loan) and monthly (per loan per month) data of a portfolio
+
+    Args:
+        data_df (pd.DataFrame): monthly data, one row per (loan, "Data" label) and
+            one datetime.date column per month
+        static_df (pd.DataFrame): one row per loan
+        key (str): loan identifier column, present in both frames
+        storage (str, optional): backing store of the monthly data.
+            "wide" keeps data_df as is. "long" keeps a polars table keyed by
+            (loan, month) with one column per metric, typed by its kind (see pola.metrics):
+            flags as booleans and month counts as int16, data_df is then built on demand.
+            "compact" is "long" with balances as float32 (about 7 significant digits),
+            see storage.FLOAT32_AMOUNTS.
+            Defaults to "wide".
+
+    Derived metrics (see pola.metrics) can be added with the add_* methods in any order,
+    or simply asked for with get_metric/require: missing inputs are computed once and stored.
+
+    Loans are the rows of static_df, in that order: monthly data is looked up by key through
+    loan_index, so loan ids need not be sorted nor consecutive.
+
+    With the polars backed storages ("long", "compact") monthly data stays in Arrow memory:
+    metrics are computed on numpy views of it (get_values) and stored straight from the
+    numpy results, curves group the long panel. pandas is only built when asked for:
+    data_df, to_pandas, get_data and what add_* methods return. Metrics computed
+    through require/get_metric build none of it.
+    """
+
+    def __init__(
+        self,
+        data_df: pd.DataFrame,
+        static_df: pd.DataFrame,
+        key: str,
+        storage: str = "wide",
+    ):
+        self.storage_type = storage
+        self.storage: MonthlyDataStorage = make_storage(storage, data_df, key)
         self.static_df = static_df
         self.key = key
+        self.loan_index = self._loan_index(static_df)
+        # arguments of the last call of each add_* method
+        self.metric_params: dict[str, tuple] = {}
+        # stages of the pipeline run on this portfolio, see profile_report
+        self.profile = profiling.Profile()
 
-    def add_balance_at_default(self):
-        months = self.get_date_cols()
-
-        res = []
-
-        for i, row in self.static_df.iterrows():
-            loan_id = i + 1
-            loan_is_active = []
-            loan_is_active.append(loan_id)
-            loan_is_active.append("Is Active")
-            defaultM = row["DefaultMonth"]
-
-            for month in months:
-                is_active = 0
-                originated = month >= row["origination_date"].date()
-                in_def = False
-                if defaultM:
-                    in_def = month <= defaultM
-                if originated and not in_def:
-                    is_active = 1
-                loan_is_active.append(is_active)
-
-            # self.data_df.loc[len(self.data_df)] = loan_is_active
-            res.append(loan_is_active)
+    @property
+    def data_df(self) -> pd.DataFrame:
+        """Monthly data in the wide layout"""
+        return self.storage.wide()
 
-        df = pd.DataFrame(res, columns=[self.key, "Data"] + months)
-
-        self.data_df = pd.concat([self.data_df, df], ignore_index=True)
-
-        self.data_df.sort_values(by=self.key, inplace=True)
-
-        return self.data_df
+    @data_df.setter
+    def data_df(self, data_df: pd.DataFrame):
+        self.storage = make_storage(self.storage_type, data_df, self.key)
 
+    def add_balance_at_default(self):
+        """Same as add_exposure_at_default"""
+        return self.add_exposure_at_default()
+
+    @derived_metric(
+        ["Is Active"],
+        requires=["origination_date", "DefaultMonth"],
+        append="_append_is_active",
+        kinds={"Is Active": FLAG},
+    )
     def add_is_active(self):
+        """Loan is active from origination, excluding months up to its DefaultMonth"""
         months = self.get_date_cols()
+        origination = self.static_df["origination_date"].to_numpy(
+            dtype="datetime64[D]"
+        )
+        default_idx = self.month_index(self.static_df["DefaultMonth"])
 
-        res = []
-
-        for i, row in self.static_df.iterrows():
-            loan_id = i + 1
-            loan_is_active = []
-            loan_is_active.append(loan_id)
-            loan_is_active.append("Is Active")
-            defaultM = row["DefaultMonth"]
-
-            for month in months:
-                is_active = 0
-                originated = month >= row["origination_date"].date()
-                in_def = False
-                if defaultM:
-                    in_def = month <= defaultM
-                if originated and not in_def:
-                    is_active = 1
-                loan_is_active.append(is_active)
+        is_active = kernels.is_active(
+            np.array(months, dtype="datetime64[D]"), origination, default_idx
+        )
 
-            # self.data_df.loc[len(self.data_df)] = loan_is_active
-            res.append(loan_is_active)
+        self._add_values("Is Active", is_active.astype(float))
 
-        df = pd.DataFrame(res, columns=[self.key, "Data"] + months)
+    def _append_is_active(self, month: datetime.date, columns: dict):
+        origination = self.static_df["origination_date"].to_numpy(
+            dtype="datetime64[D]"
+        )
+        # months up to the default month are not active, for new defaults all of them
+        new_defaults = self._defaulted_in(month)
+        columns["Is Active"] = (
+            (np.datetime64(month, "D") >= origination) & ~new_defaults
+        ).astype(float)
 
-        self.data_df = pd.concat([self.data_df, df], ignore_index=True)
+        months = self.get_date_cols()
+        self._rewrite_history(
+            "Is Active", np.zeros((new_defaults.sum(), len(months))), new_defaults
+        )
 
-        self.data_df.sort_values(by=self.key, inplace=True)
+    @derived_metric(
+        ["PrepaymentDate", "Is Prepayment Month"],
+        requires=["Month End Balance"],
+        append="_append_prepayment_date",
+        kinds={"Is Prepayment Month": FLAG},
+        requires_if={"exclude_defaulted": ["DefaultMonth"]},
+    )
+    def add_prepayment_date(
+        self,
+        threshold: float = 0.00001,
+        n_zero_months: int = 1,
+        exclude_defaulted: bool = False,
+    ):
+        """Assuming Loan repays when we first hit Month End Balance == 0
+
+        Args:
+            threshold (float, optional): a balance below it is 0. Defaults to 0.00001.
+            n_zero_months (int, optional): months in a row the balance must stay 0,
+                the loan repays in the first of them. Defaults to 1.
+            exclude_defaulted (bool, optional): a balance of 0 from the DefaultMonth
+                onwards (eg written off) is not a repayment. Defaults to False.
+        """
+        if n_zero_months < 1:
+            raise ValueError(f"n_zero_months must be at least 1, got {n_zero_months}")
+        balance = self.get_values("Month End Balance")
+        months = self.get_date_cols()
+        default_idx = (
+            self.month_index(self.static_df["DefaultMonth"]) if exclude_defaulted else None
+        )
 
-        return self.data_df
+        prepayment_idx = kernels.prepayment_index(
+            balance, threshold, n_zero_months, default_idx
+        )
+        self.static_df["PrepaymentDate"] = [
+            months[i] if i >= 0 else None for i in prepayment_idx
+        ]
+        # as monthly data too, eg for curves of full prepayments
+        self._add_values(
+            "Is Prepayment Month", kernels.one_hot(prepayment_idx, len(months))
+        )
 
-    def add_prepayment_date(self):
-        """Assuming Loan repays when we first hit Month End Balance == 0"""
-        balance = self.data_df[self.data_df["Data"] == "Month End Balance"].drop(
-            ["Data", "loan_id"], axis=1
+    def _append_prepayment_date(
+        self,
+        month: datetime.date,
+        columns: dict,
+        threshold: float = 0.00001,
+        n_zero_months: int = 1,
+        exclude_defaulted: bool = False,
+    ):
+        # the last n_zero_months - 1 months and this one are 0, for loans not repaid yet
+        previous = self._previous_months("Month End Balance", n_zero_months - 1)
+        zero_in_a_row = kernels.trailing_run(previous < threshold)
+        repaid = (
+            self.static_df["PrepaymentDate"].isna().to_numpy()
+            & (columns["Month End Balance"] < threshold)
+            & (zero_in_a_row + 1 >= n_zero_months)
         )
-        tenors = self.get_date_cols()
-        for loan_idx, (_, row) in enumerate(
-            balance.iterrows()
-        ):  # Again, assuming perfect order
-            for ix, cf in enumerate(row):
-                # note: for each row Balances are first NaN, then positive, then 0 if repaid
-                if cf < 0.00001:
-                    self.static_df.loc[loan_idx, "PrepaymentDate"] = tenors[ix]
-                    break
+        if exclude_defaulted:
+            # DefaultMonth is up to date, so any default is in or before the month
+            repaid &= self.static_df["DefaultMonth"].isna().to_numpy()
 
-        return self.static_df
+        # repaid in the first of the months at 0, a previous month unless n_zero_months is 1
+        months = self.get_date_cols()
+        first = len(months) + 1 - n_zero_months
+        columns["Is Prepayment Month"] = (repaid & (first == len(months))).astype(float)
+        if not repaid.any():
+            return
+        self._set_month("PrepaymentDate", repaid, [*months, month][first])
+        if first < len(months):
+            self._rewrite_history(
+                "Is Prepayment Month",
+                kernels.one_hot(np.full(repaid.sum(), first), len(months)),
+                repaid,
+            )
 
+    @derived_metric(
+        ["RecoveryPercent"],
+        requires=["RecoveredAmmount", "BalanceAtDefault"],
+        append="_append_recovery_percent",
+    )
     def add_recovery_percent(self):
         self.static_df["RecoveryPercent"] = (
             self.static_df["RecoveredAmmount"] / self.static_df["BalanceAtDefault"]
         )
-        return self.static_df
 
-    def add_exposure_at_default(self):
-        balance = self.data_df[self.data_df["Data"] == "Month End Balance"].drop(
-            ["Data", "loan_id"], axis=1
+    def _append_recovery_percent(self, month: datetime.date, columns: dict):
+        self.static_df["RecoveryPercent"] = (
+            self.static_df["RecoveredAmmount"] / self.static_df["BalanceAtDefault"]
         )
-        res = []
-        for i, row in self.static_df.iterrows():
-            loan_id = i + 1
-
-            exposure_at_default_for_monthly_data = []
-            exposure_at_default_for_monthly_data.append(loan_id)
-            exposure_at_default_for_monthly_data.append("BalanceAtDefault")
-
-            default_month = row["DefaultMonth"]
-
-            if default_month is not None:
-                balance_at_default = balance.iloc[loan_id - 1][default_month]
-                self.static_df.loc[i, "BalanceAtDefault"] = balance_at_default
-                exposure_at_default_for_monthly_data.extend(
-                    [balance_at_default] * len(self.get_date_cols())
-                )
-            else:
-                self.static_df.loc[i, "BalanceAtDefault"] = None
-                exposure_at_default_for_monthly_data.extend(
-                    [None] * len(self.get_date_cols())
-                )
-
-            res.append(exposure_at_default_for_monthly_data)
 
-        df = pd.DataFrame(res, columns=[self.key, "Data"] + self.get_date_cols())
-
-        self.data_df = pd.concat([self.data_df, df], ignore_index=True)
-
-        self.data_df.sort_values(by=[self.key, "Data"], inplace=True)
+    @derived_metric(
+        ["BalanceAtDefault"],
+        requires=["DefaultMonth", "Month End Balance"],
+        append="_append_exposure_at_default",
+    )
+    def add_exposure_at_default(self):
+        """Month End Balance in the DefaultMonth, NaN for loans which did not default"""
+        balance = self.get_values("Month End Balance")
+        default_idx = self.month_index(self.static_df["DefaultMonth"])
 
-        return self.static_df
+        self.static_df["BalanceAtDefault"] = kernels.take_at(balance, default_idx)
 
+    def _append_exposure_at_default(self, month: datetime.date, columns: dict):
+        new_defaults = self._defaulted_in(month)
+        balance_at_default = self.static_df["BalanceAtDefault"].to_numpy(
+            dtype=float, copy=True
+        )
+        balance_at_default[new_defaults] = columns["Month End Balance"][new_defaults]
+        self.static_df["BalanceAtDefault"] = balance_at_default
+
+    @derived_metric(
+        ["Is Post Seller Purchase"],
+        append="_append_is_post_seller_purchase_date",
+        kinds={"Is Post Seller Purchase": FLAG},
+    )
     def add_is_post_seller_purchase_date(self, dt=datetime.date(2020, 12, 31)):
-        n = len(self.static_df)
         row = [1 if col >= dt else 0 for col in self.get_date_cols()]
-        res = pd.DataFrame([row] * n, columns=self.get_date_cols())
-        res[self.key] = self.static_df[self.key]
-        res["Data"] = "Is Post Seller Purchase"
-        return self.add_data(res)
+        values = np.repeat([row], len(self.loan_index), axis=0)
+        self._add_values("Is Post Seller Purchase", values)
+
+    def _append_is_post_seller_purchase_date(
+        self, month: datetime.date, columns: dict, dt=datetime.date(2020, 12, 31)
+    ):
+        columns["Is Post Seller Purchase"] = np.full(
+            len(self.static_df), 1.0 if month >= dt else 0.0
+        )
 
+    @derived_metric(
+        [
+            "Is Recovery Payment",
+            "Cummulative Recovery",
+            "LastRecoveryMonth",
+            "RecoveredAmmount",
+        ],
+        requires=["DefaultMonth", "Payment Made"],
+        append="_append_is_recovery_payment",
+        kinds={"Is Recovery Payment": FLAG},
+    )
     def add_is_recovery_payment(self):
-        ir, rec_months, recovery_ammount = self.is_recovery_payment()
+        """Recovery flags and cumulative recoveries, with LastRecoveryMonth and
+        RecoveredAmmount per loan, from a single pass over Payment Made (see recovery)
+        """
+        flags, cum_rec, rec_months, recovery_ammount = self._recovery()
         self.static_df["LastRecoveryMonth"] = rec_months
         self.static_df["RecoveredAmmount"] = recovery_ammount
-        return self.add_data(ir)
+        self._add_values("Is Recovery Payment", flags)
+        self._add_values("Cummulative Recovery", cum_rec)
+
+    def _append_is_recovery_payment(self, month: datetime.date, columns: dict):
+        flags, payments = self._recovery_month(columns)
+        columns["Is Recovery Payment"] = flags.astype(float)
+        self._set_month("LastRecoveryMonth", flags, month)
+
+        recovered = self.static_df["RecoveredAmmount"].to_numpy(dtype=float)
+        self.static_df["RecoveredAmmount"] = np.where(
+            flags, np.nan_to_num(recovered) + payments, recovered
+        )
+        # (sum of) the last month, 0 if there is none
+        previous = self._previous_months("Cummulative Recovery", 1)
+        columns["Cummulative Recovery"] = previous.sum(axis=1) + np.where(
+            flags, payments, 0.0
+        )
+
+    def _recovery_month(self, columns: dict, threshold: float = 0.001):
+        """Recovery flags and Payment Made of the month being appended, see recovery"""
+        payments = columns["Payment Made"]
+        # DefaultMonth is up to date, so any default is in or before the month
+        defaulted = self.static_df["DefaultMonth"].notna().to_numpy()
+        return defaulted & (payments > threshold), payments
 
     def is_recovery_payment(self):
         """For each loan, mark if the payment occurs after default"""
+        flags, _, recovery_months, recovery_ammounts = self.recovery()
+        return flags, recovery_months, recovery_ammounts
 
-        res = []
-        payments = self.data_df[self.data_df["Data"] == "Payment Made"].drop(
-            ["Data", "loan_id"], axis=1
-        )
-        n_cols = len(payments.columns)
-        # save this usefult metrics for further use
-        recovery_months = []
-        recovery_ammounts = []
-
-        if "DefaultMonth" not in self.static_df.columns:
-            self.add_default_month()
-
-        # iterate ove loan_id-DefaultMonth pairs
-        for i, default_month in enumerate(
-            self.static_df["DefaultMonth"]
-        ):  # recall self.other contains DefaultMonth per loan
-            loan_id = i + 1
-            zeros = np.zeros(n_cols)
-            recovery_month = None  # not this is actually the last payment of recovery
-            recovered = None
-            if default_month is not None:
-                cols_post_default = [
-                    col for col in payments.columns if col >= default_month
-                ]
-                def_ix = payments.columns.to_list().index(default_month)
-
-                # we are only interestd in cashflows beyond default date
-                # TODO Again assuming ordered and consecutive loan_ids
-                relevant_cashflows = payments.iloc[loan_id - 1][cols_post_default]
-                for cf_i, cf in enumerate(
-                    relevant_cashflows
-                ):  # we know this frame has only one row
-                    if cf > 0.001:
-                        # sum indexes , because we filtered out not interesting payments. so relevant_cashflows indexes are missing
-                        # those where  col>=default_month
-                        zeros[def_ix + cf_i] = 1
-                        recovery_month = payments.columns[def_ix + cf_i]
-                        if recovered is None:
-                            recovered = cf
-                        else:
-                            recovered += cf
-
-            recovery_months.append(recovery_month)
-            recovery_ammounts.append(recovered)
-            payment_after_default = pd.Series(zeros, index=payments.columns)
-            res.append(payment_after_default)
-
-        df = pd.DataFrame(res)
-        df["Data"] = "Is Recovery Payment"
-        df["loan_id"] = self.static_df["loan_id"]
-        return df, recovery_months, recovery_ammounts
-
-    def add_default_month(self):
-        dm, default_months_per_loan = self.default_month()
-        self.static_df["DefaultMonth"] = default_months_per_loan
-        return self.add_data(dm)
-
-    def default_month(self):
-        """Finds the month of default"""
-        # TODO this function definitely can be vectorized
-        due_vs_made = self.get_or_compute(
-            "Payment Made vs Due", self.payment_due_vs_made
-        )
-
-        _result2 = []
-        results = []  # this is for df assignment
-        for _, row in due_vs_made.iterrows():
-            default_payment_idx = None
-            count_missed = 0
-            for i, payment_due_vs_made in enumerate(row):
-                if payment_due_vs_made < -0.0001:  # to avoid edge cases
-                    count_missed += 1
-                    if count_missed == 3:
-                        default_payment_idx = i
-                        break
-
-                else:
-                    # reset
-                    count_missed = 0
-            n_cols = len(due_vs_made.columns)
-            zeros = np.zeros(n_cols)
-            if default_payment_idx is not None:
-                zeros[default_payment_idx] = 1
-                _result2.append(due_vs_made.columns[default_payment_idx])
-            else:
-                _result2.append(None)
-            default_month = pd.Series(zeros, index=due_vs_made.columns)
-            results.append(default_month)
-
-        df = pd.DataFrame(results)
-        df["Data"] = "Is Default Month"
-        df["loan_id"] = self.static_df["loan_id"]
-        return df, _result2
+    def recovery(self, threshold: float = 0.001):
+        """Recovery payments (any payment above threshold on or after the default month)
 
-    def add_payment_made_vs_due(self):
-        pvd = self.payment_made_vs_due()
-        return self.add_data(pvd)
+        Computes everything we need about recoveries in a single pass over Payment Made
 
-    def payment_made_vs_due(self):
-        # Payment Due vs Payment Actually Made each month
-        res = self.payment_due_vs_made()
+        Returns:
+            tuple: "Is Recovery Payment" and "Cummulative Recovery" frames,
+                LastRecoveryMonth and RecoveredAmmount per loan
+        """
+        flags, cumulative, recovery_months, recovered = self._recovery(threshold)
+        return (
+            self._monthly_rows("Is Recovery Payment", flags),
+            self._monthly_rows("Cummulative Recovery", cumulative),
+            recovery_months,
+            recovered,
+        )
 
-        # if positive => Payment Made > Payment Due => Overpayment
-        res["Data"] = "Payment Made vs Due"
-        res["loan_id"] = self.static_df[
-            "loan_id"
-        ]  # TODO assuming static data is complete and sorted
-        return res
+    def _recovery(self, threshold: float = 0.001):
+        """Same as recovery, flags and cumulative recoveries as loans x months matrices"""
+        self.require("DefaultMonth")
 
-    def add_n_missing_payments(self):
-        nm = self.n_missing_payments()
-        return self.add_data(nm)
+        payments = self.get_values("Payment Made")
+        months = self.get_date_cols()
+        default_idx = self.month_index(self.static_df["DefaultMonth"])
 
-    def add_cummulative_recovery_payments(self):
-        """Sums recovery payments"""
-        # check if has already been calculated
-        pm = self.data_df[self.data_df["Data"] == "Payment Made"].drop(["Data"], axis=1)
-        irp = self.data_df[self.data_df["Data"] == "Is Recovery Payment"].drop(
-            ["Data"], axis=1
+        flags, cumulative, last_idx, recovered = kernels.recovery(
+            payments, default_idx, threshold
         )
+        # note this is actually the last payment of recovery
+        recovery_months = [months[i] if i >= 0 else None for i in last_idx]
+        return flags, cumulative, recovery_months, recovered
+
+    @derived_metric(
+        ["Is Default Month", "DefaultMonth"],
+        requires=["Payment Made vs Due"],
+        append="_append_default_month",
+        kinds={"Is Default Month": FLAG},
+    )
+    def add_default_month(self, n_missed: int = 3, tolerance: float = -0.0001):
+        months = self.get_date_cols()
+        default_idx = self._default_index(n_missed, tolerance)
+        self.static_df["DefaultMonth"] = [
+            months[i] if i >= 0 else None for i in default_idx
+        ]
+        self._add_values("Is Default Month", kernels.one_hot(default_idx, len(months)))
+
+    def _append_default_month(
+        self,
+        month: datetime.date,
+        columns: dict,
+        n_missed: int = 3,
+        tolerance: float = -0.0001,
+    ):
+        # a loan which has not defaulted yet defaults with its n_missed-th missed payment in a row
+        previous = self._previous_months("Payment Made vs Due", n_missed - 1)
+        missed_in_a_row = kernels.trailing_run(previous < tolerance)
+        missed = columns["Payment Made vs Due"] < tolerance
+        new_defaults = (
+            self.static_df["DefaultMonth"].isna().to_numpy()
+            & missed
+            & (missed_in_a_row + 1 >= n_missed)
+        )
+        columns["Is Default Month"] = new_defaults.astype(float)
+        self._set_month("DefaultMonth", new_defaults, month)
 
-        df = pd.concat([pm, irp], axis=0)
+    def default_month(self, n_missed: int = 3, tolerance: float = -0.0001):
+        """Finds the month of default: the n_missed-th consecutive missed payment
 
-        res = df.groupby(by="loan_id").agg("prod")
-        res.reset_index(inplace=True)
-        res.drop(["loan_id"], inplace=True, axis=1)
+        Args:
+            n_missed (int, optional): consecutive missed payments to default. Defaults to 3.
+            tolerance (float, optional): a payment is missed when Payment Made vs Due
+                is below tolerance (to avoid edge cases). Defaults to -0.0001.
+        """
+        months = self.get_date_cols()
+        default_idx = self._default_index(n_missed, tolerance)
+        default_months = [months[i] if i >= 0 else None for i in default_idx]
 
-        cum_rec = res.cumsum(axis=1)
+        df = self._monthly_rows(
+            "Is Default Month", kernels.one_hot(default_idx, len(months))
+        )
+        return df, default_months
+
+    def _default_index(self, n_missed: int, tolerance: float) -> np.ndarray:
+        """Month (position) of default of each loan, -1 if none, see default_month"""
+        self.require("Payment Made vs Due")
+        due_vs_made = self.get_values("Payment Made vs Due")
+        return kernels.default_index(due_vs_made, n_missed, tolerance)
+
+    @derived_metric(
+        ["Payment Made vs Due"],
+        requires=["Payment Made", "Payment Due"],
+        append="_append_payment_made_vs_due",
+    )
+    def add_payment_made_vs_due(self):
+        self._add_values("Payment Made vs Due", self._payment_made_vs_due())
 
-        cum_rec["loan_id"] = cum_rec.index + 1
+    def _append_payment_made_vs_due(self, month: datetime.date, columns: dict):
+        # a missing value counts as no payment
+        columns["Payment Made vs Due"] = np.nan_to_num(
+            columns["Payment Made"]
+        ) - np.nan_to_num(columns["Payment Due"])
 
-        cum_rec["Data"] = "Cummulative Recovery"
+    def payment_made_vs_due(self):
+        # Payment Due vs Payment Actually Made each month
+        # if positive => Payment Made > Payment Due => Overpayment
+        return self._monthly_rows("Payment Made vs Due", self._payment_made_vs_due())
+
+    @derived_metric(
+        ["N missing payments"],
+        requires=["Payment Made vs Due"],
+        append="_append_n_missing_payments",
+        kinds={"N missing payments": MONTHS},
+    )
+    def add_n_missing_payments(self):
+        self._add_values("N missing payments", self._n_missing_payments())
 
-        return self.add_data(cum_rec)
+    def _append_n_missing_payments(self, month: datetime.date, columns: dict):
+        # (sum of) the last month, 0 if there is none
+        previous = np.nan_to_num(self._previous_months("N missing payments", 1))
+        missed = columns["Payment Made vs Due"] < 0
+        columns["N missing payments"] = previous.sum(axis=1) + missed
+
+    def add_cummulative_recovery_payments(self):
+        """Sums recovery payments: Cummulative Recovery is an output of
+        add_is_recovery_payment, which is only run if it has not been already
+        """
+        self.require("Cummulative Recovery")
+        return self.data_df
 
     def n_missing_payments(self):
         """Computes total number of missed payments"""
-        # check if has already been calculated
-        res = self.get_or_compute("Payment Made vs Due", self.payment_due_vs_made)
-
-        # if positive => Payment Made > Payment Due , which is ok, as it is an overpayment
-        res[res >= 0] = 0
-        res[res < 0] = 1  # Due > Made => missed payment
+        return self._monthly_rows("N missing payments", self._n_missing_payments())
 
-        n_missing_payments = res.cumsum(axis=1)
+    def _n_missing_payments(self) -> np.ndarray:
+        self.require("Payment Made vs Due")
+        res = self.get_values("Payment Made vs Due")
 
-        n_missing_payments["Data"] = "N missing payments"
-        n_missing_payments["loan_id"] = self.static_df[
-            "loan_id"
-        ]  # TODO assuming static data is complete and sorted
-        return n_missing_payments
+        # if positive => Payment Made > Payment Due , which is ok, as it is an overpayment
+        # Due > Made => missed payment
+        return kernels.missed_payments(res)
 
     def payment_due_vs_made(self):
         """Find diff between Payment Made and Payment Due.
         Helps accessing missed payment or default
         """
-        df_filtered = self.data_df[
-            self.data_df["Data"].isin(["Payment Made", "Payment Due"])
-        ]
-        df_filtered.loc[df_filtered["Data"] == "Payment Due"] *= -1
-        # no need for this column any longer
-        df_filtered.drop("Data", axis=1, inplace=True)
-
-        df_filtered[self.key] = df_filtered[
-            self.key
-        ].abs()  # line above converts loan id too, so undo it
-        res = df_filtered.groupby(self.key, as_index=False).agg("sum")
-
-        # We need to drop str cols here, before comparisons and Before cumsum have to drop str cols
-        res.drop("loan_id", axis=1, inplace=True)
+        return pd.DataFrame(self._payment_made_vs_due(), columns=self.get_date_cols())
+
+    def _payment_made_vs_due(self) -> np.ndarray:
+        made = self.get_values("Payment Made")
+        due = self.get_values("Payment Due")
+
+        # a missing value counts as no payment
+        return np.nan_to_num(made) - np.nan_to_num(due)
+
+    @derived_metric(
+        ["Time Since Default"],
+        requires=["DefaultMonth"],
+        append="_append_time_since_default",
+        kinds={"Time Since Default": MONTHS},
+    )
+    def add_time_since_default(self, calendar: bool = False):
+        """Adds seasoning
+
+        Args:
+            calendar (bool, optional): see kernels.months_since. Defaults to False.
+        """
+        self._add_values(
+            "Time Since Default", self._months_since("DefaultMonth", calendar)
+        )
 
-        return res
+    def _append_time_since_default(
+        self, month: datetime.date, columns: dict, calendar: bool = False
+    ):
+        self._append_months_since(
+            "Time Since Default", "DefaultMonth", month, columns, calendar
+        )
 
-    def add_time_since_default(self):
-        """Adds seasoning"""
-        s = self.time_to_default()
-        return self.add_data(s)
+        # history of new defaults, NaN until now
+        new_defaults = self._defaulted_in(month)
+        default_month = self.static_df["DefaultMonth"].to_numpy(dtype="datetime64[D]")
+        months = np.array(self.get_date_cols(), dtype="datetime64[D]")
+        self._rewrite_history(
+            "Time Since Default",
+            kernels.months_since(months, default_month[new_defaults], calendar),
+            new_defaults,
+        )
 
-    def time_to_default(self):
+    def time_to_default(self, calendar: bool = False):
         """Computes Seasoning"""
-        res = self.months_since("DefaultMonth")
-        res["Data"] = "Time Since Default"
-        return res
+        return self._monthly_rows(
+            "Time Since Default", self._months_since("DefaultMonth", calendar)
+        )
 
-    def add_seasoning(self):
-        """Adds seasoning"""
-        s = self.seasoning()
-        return self.add_data(s)
+    @derived_metric(
+        ["Seasoning"],
+        requires=["origination_date"],
+        append="_append_seasoning",
+        kinds={"Seasoning": MONTHS},
+    )
+    def add_seasoning(self, calendar: bool = False):
+        """Adds seasoning
+
+        Args:
+            calendar (bool, optional): see kernels.months_since. Defaults to False.
+        """
+        self._add_values("Seasoning", self._months_since("origination_date", calendar))
 
-    def seasoning(self):
+    def _append_seasoning(
+        self, month: datetime.date, columns: dict, calendar: bool = False
+    ):
+        self._append_months_since(
+            "Seasoning", "origination_date", month, columns, calendar
+        )
+
+    def seasoning(self, calendar: bool = False):
         """Computes Seasoning"""
-        res = self.months_since("origination_date")
-        res["Data"] = "Seasoning"
-        return res
+        return self._monthly_rows(
+            "Seasoning", self._months_since("origination_date", calendar)
+        )
+
+    @derived_metric(
+        ["Time Since Reversion"],
+        requires=["reversion_date"],
+        append="_append_time_since_reversion",
+        kinds={"Time Since Reversion": MONTHS},
+    )
+    def add_time_since_reversion(self, calendar: bool = False):
+        """Adds seasoning
+
+        Args:
+            calendar (bool, optional): see kernels.months_since. Defaults to False.
+        """
+        self._add_values(
+            "Time Since Reversion", self._months_since("reversion_date", calendar)
+        )
 
-    def add_time_since_reversion(self):
-        """Adds seasoning"""
-        s = self.reversion()
-        return self.add_data(s)
+    def _append_time_since_reversion(
+        self, month: datetime.date, columns: dict, calendar: bool = False
+    ):
+        self._append_months_since(
+            "Time Since Reversion", "reversion_date", month, columns, calendar
+        )
 
-    def reversion(self):
+    def reversion(self, calendar: bool = False):
         """Computes Seasoning"""
-        res = self.months_since("reversion_date")
-        res["Data"] = "Time Since Reversion"
-        return res
+        return self._monthly_rows(
+            "Time Since Reversion", self._months_since("reversion_date", calendar)
+        )
 
     ### ####  ###
     ### UTILS ###
     ### ####  ###
 
-    def months_since(self, date_col_name: str):
-        # We want to vectorise the computation, so use polars
-        pl_stat = pl.from_pandas(self.static_df)  # static data
-        res = pd.DataFrame(self.static_df[self.key])  # loan_ids
-        # for each CF month
-        for d in self.get_date_cols():
-            # For simplicity assuming 30 days per month
-            # the CF month (auto projected) minus static months
-            sasoning_per_month = (d - pl_stat[date_col_name]).dt.total_days() / 30
-            sasoning_per_month_rounded = sasoning_per_month.round()
-            res[d] = sasoning_per_month_rounded.to_pandas()
+    def months_since(self, date_col_name: str, calendar: bool = False) -> pd.DataFrame:
+        """Loans x months frame of months from the static date column to each month,
+        all months at once, see kernels.months_since
+        """
+        return pd.DataFrame(
+            self._months_since(date_col_name, calendar), columns=self.get_date_cols()
+        )
+
+    def _months_since(self, date_col_name: str, calendar: bool = False) -> np.ndarray:
+        months = np.array(self.get_date_cols(), dtype="datetime64[D]")
+        anchor = self.static_df[date_col_name].to_numpy(dtype="datetime64[D]")
+        return kernels.months_since(months, anchor, calendar).astype(float)
+
+    def _rewrite_history(self, data_name: str, values: np.ndarray, loans: np.ndarray):
+        """Overwrites months before the one being appended of loans (boolean mask),
+        see append_month
+        """
+        loan_ids = self.loan_index.to_numpy()[loans]
+        self.storage.update_values(data_name, values, loan_ids)
+        self._rewritten.append(loan_ids)
+
+    def _append_months_since(
+        self,
+        data_name: str,
+        date_col_name: str,
+        month: datetime.date,
+        columns: dict,
+        calendar: bool = False,
+    ):
+        anchor = self.static_df[date_col_name].to_numpy(dtype="datetime64[D]")
+        columns[data_name] = kernels.months_since(
+            np.array([month], dtype="datetime64[D]"), anchor, calendar
+        )[:, 0]
+
+    def _previous_months(self, data_name: str, n: int) -> np.ndarray:
+        """Loans x (up to) n last months of a stored metric"""
+        months = self.get_date_cols()[-n:] if n > 0 else []
+        return self.storage.get_values(data_name, months, self.loan_index)
+
+    def _defaulted_in(self, month: datetime.date) -> np.ndarray:
+        return (self.static_df["DefaultMonth"] == month).to_numpy(dtype=bool)
+
+    def _set_month(self, col_name: str, loans: np.ndarray, month: datetime.date):
+        """Sets the static date column col_name to month for loans (boolean mask)"""
+        values = self.static_df[col_name].to_numpy(dtype=object, copy=True)
+        values[loans] = month
+        self.static_df[col_name] = values
+
+    def _monthly_rows(
+        self, data_name: str, values: np.ndarray, loans: np.ndarray | None = None
+    ) -> pd.DataFrame:
+        """Wide rows (key, "Data", months...) of values over every month, one row per loan
+        of static data, or per loan of the boolean mask loans
+        """
+        loan_ids = self.loan_index.to_numpy()
+        df = pd.DataFrame(values, columns=self.get_date_cols())
+        df.insert(0, "Data", data_name)
+        df.insert(0, self.key, loan_ids if loans is None else loan_ids[loans])
+        return df
+
+    def _loan_index(self, static_df: pd.DataFrame) -> pd.Index:
+        """key -> row of static_df"""
+        loan_index = pd.Index(static_df[self.key])
+        if not loan_index.is_unique:
+            raise ValueError(f"Duplicate {self.key} in static data")
+        return loan_index
+
+    def loan_rows(self, loan_ids) -> np.ndarray:
+        """Row of each loan id in static data (and in get_data), -1 for unknown loans"""
+        return self.loan_index.get_indexer(loan_ids)
+
+    def month_index(self, months: pd.Series) -> np.ndarray:
+        """Position of each month among the date columns, -1 for None"""
+        return pd.Index(self.get_date_cols()).get_indexer(months)
+
+    def get_data(self, data_name: str) -> pd.DataFrame:
+        """Loans x months frame of a single metric, one row per loan of static data
+        (in that order), NaN for loans without monthly data
+        """
+        return self.storage.get(data_name, loan_ids=self.loan_index)
+
+    def get_values(self, data_name: str) -> np.ndarray:
+        """Same as get_data, as a float64 matrix: no pandas frame is built"""
+        return self.storage.get_values(data_name, loan_ids=self.loan_index)
+
+    def has_metric(self, name: str) -> bool:
+        """Is name a stored "Data" label or static column"""
+        return name in self.storage or name in self.static_df.columns
+
+    def require(
+        self, *names: str, n_workers: int = 1, executor: Executor | None = None
+    ):
+        """Computes (and stores) whichever of names is missing, along with its missing inputs
+
+        Args:
+            n_workers (int, optional): when above 1, loans are split in n_workers shards
+                computed in parallel, in a process pool of that size unless executor is given.
+                Results are identical to computing in a single process. Defaults to 1.
+            executor (Executor, optional): runs the shards, eg a pool shared by several calls.
+                Defaults to None.
+        """
+        if n_workers > 1 or executor is not None:
+            missing = [name for name in names if not self.has_metric(name)]
+            if missing:
+                self._require_sharded(missing, n_workers, executor)
+            return
+
+        for name in names:
+            if self.has_metric(name):
+                continue
+            if name not in METRICS:
+                raise ValueError(
+                    f"{name!r} is neither in the portfolio nor a known derived metric"
+                )
+            metric: Metric = METRICS[name]
+            args, kwargs = self.metric_params.get(metric.method, ((), {}))
+            add_method = getattr(type(self), metric.method)
+            # add_* methods overridden without @derived_metric are simply called
+            compute = getattr(add_method, "compute", add_method)
+            compute(self, *args, **kwargs)
+
+    def append_month(self, data: pd.DataFrame):
+        """Adds the next month of monthly data (eg a new column of each data tab)
+        and extends every computed metric by that month, without recomputing history
+
+        What carries over from previous months (missed payments in a row, cumulative
+        missed payments and recoveries, loans already defaulted or repaid) is read from
+        the last month of the stored metrics and static data, so the cost is in loans,
+        not loans x months. Loans defaulting in the new month also get the history of
+        metrics which depend on their default month rewritten. Metrics without an
+        append step (see pola.metrics) are recomputed.
+
+        Args:
+            data (pd.DataFrame): key, "Data" and a single date column, after the last month.
+                Loans or "Data" labels which are not in data are NaN that month.
+
+        Returns:
+            np.ndarray: loans whose previous months were rewritten (eg those which default),
+                see curves.CurveAccumulator.add_month
+        """
+        new_months = [col for col in data.columns if isinstance(col, datetime.date)]
+        if len(new_months) != 1:
+            raise ValueError(f"Expected a single month, got {new_months}")
+        (month,) = new_months
+        months = self.get_date_cols()
+        if months and month <= months[-1]:
+            raise ValueError(f"{month} is not after the last month {months[-1]}")
+
+        unknown = set(data["Data"]) - set(self.storage.labels())
+        if unknown:
+            raise ValueError(f"Unknown monthly data {sorted(unknown)}")
+        unknown = data.loc[self.loan_rows(data[self.key]) < 0, self.key].unique()
+        if len(unknown):
+            raise ValueError(f"Unknown loans {sorted(unknown)[:10]}")
+
+        # new month of every stored metric, in the order of static data
+        loan_ids = self.loan_index.to_numpy()
+        columns = {
+            data_name: np.full(len(loan_ids), np.nan)
+            for data_name in self.storage.labels()
+            if data_name not in METRICS
+        }
+        for data_name, rows in data.groupby("Data", sort=False):
+            columns[data_name] = (
+                rows.set_index(self.key)[month].reindex(loan_ids).to_numpy(dtype=float)
+            )
+
+        computed = [
+            metric
+            for metric in dict.fromkeys(METRICS.values())
+            if any(self.has_metric(name) for name in metric.outputs)
+        ]
+        recompute = []
+        self._rewritten = [loan_ids[:0]]
+        for metric in in_dependency_order(computed):
+            recomputed = [name for other in recompute for name in other.outputs]
+            args, kwargs = self.metric_params.get(metric.method, ((), {}))
+            requires = metric.requires_of(args, kwargs)
+            if metric.append is None or set(requires) & set(recomputed):
+                recompute.append(metric)
+                continue
+            getattr(self, metric.append)(month, columns, *args, **kwargs)
+
+        for metric in recompute:
+            self.storage.remove([name for name in metric.outputs if name in self.storage])
+            self.static_df = self.static_df.drop(
+                columns=[name for name in metric.outputs if name in self.static_df]
+            )
+
+        labels = [data_name for data_name in columns if data_name in self.storage]
+        self.storage.append_month(
+            pd.DataFrame(
+                {
+                    self.key: np.tile(loan_ids, len(labels)),
+                    "Data": np.repeat(labels, len(loan_ids)),
+                    month: np.concatenate(
+                        [np.empty(0)] + [columns[data_name] for data_name in labels]
+                    ),
+                }
+            )
+        )
+        self.require(*[name for metric in recompute for name in metric.outputs])
+
+        rewritten = np.unique(np.concatenate(self._rewritten))
+        del self._rewritten
+        return rewritten
+
+    def _require_sharded(
+        self, names: list[str], n_workers: int, executor: Executor | None
+    ):
+        with self.profile.stage("require_sharded", self):
+            shards = self.partition(n_workers)
+            if executor is None:
+                # polars' thread pool does not survive a fork
+                context = multiprocessing.get_context("spawn")
+                with ProcessPoolExecutor(n_workers, mp_context=context) as executor:
+                    shards = list(executor.map(_require, shards, repeat(names)))
+            else:
+                # map keeps the order of the shards, so merging is deterministic
+                shards = list(executor.map(_require, shards, repeat(names)))
+            self.merge_shards(shards)
+
+    def partition(self, n: int) -> list["PortfolioOfOutstandingLoans"]:
+        """Splits the portfolio in (up to) n portfolios of consecutive loans of static data"""
+        loan_ids = self.static_df[self.key].to_numpy()
+        return [
+            self.subset(loan_ids[rows])
+            for rows in np.array_split(np.arange(len(loan_ids)), n)
+            if len(rows)
+        ]
+
+    def subset(self, loan_ids: np.ndarray) -> "PortfolioOfOutstandingLoans":
+        """Portfolio of loan_ids only, with every metric computed so far"""
+        res = copy.copy(self)
+        res.static_df = self.static_df[
+            self.static_df[self.key].isin(loan_ids)
+        ].reset_index(drop=True)
+        res.loan_index = self._loan_index(res.static_df)
+        res.storage = self.storage.subset(res.static_df[self.key].to_numpy())
+        res.metric_params = dict(self.metric_params)
+        # stages run on it are its own
+        res.profile = profiling.Profile()
+        return res
+
+    def copy(self) -> "PortfolioOfOutstandingLoans":
+        """Same portfolio, whose metrics can then be computed (eg with other arguments)
+        independently: data is shared until either changes it
+        """
+        res = copy.copy(self)
+        res.static_df = self.static_df.copy(deep=False)
+        res.storage = self.storage.copy()
+        res.metric_params = dict(self.metric_params)
+        res.profile = profiling.Profile()
         return res
 
+    def without_metrics(
+        self,
+        loan_ids: np.ndarray | None = None,
+        months: list[datetime.date] | None = None,
+    ) -> "PortfolioOfOutstandingLoans":
+        """Portfolio of the input data only, no derived metric, computing metrics with
+        the same arguments as this one
+
+        Args:
+            loan_ids (np.ndarray, optional): only these loans. Defaults to all.
+            months (list[datetime.date], optional): only these months. Defaults to all.
+        """
+        res = copy.copy(self) if loan_ids is None else self.subset(loan_ids)
+        months = res.get_date_cols() if months is None else list(months)
+        data_df = pd.concat(
+            [
+                res.storage.get_block(data_name)[[self.key, "Data", *months]]
+                for data_name in res.storage.labels()
+                if data_name not in METRICS
+            ],
+            ignore_index=True,
+        )
+        res.storage = make_storage(self.storage_type, data_df, self.key)
+        res.static_df = res.static_df.drop(
+            columns=[col for col in res.static_df.columns if col in METRICS]
+        )
+        res.metric_params = dict(self.metric_params)
+        res.profile = profiling.Profile()
+        return res
+
+    def merge_shards(self, shards: list["PortfolioOfOutstandingLoans"]):
+        """Takes over the data of shards (see partition) once they have been enriched"""
+        labels = shards[0].storage.labels()
+        self.storage.remove([name for name in self.storage.labels() if name not in labels])
+        # in the order the shards added them
+        for name in labels:
+            if name not in self.storage:
+                self.storage.add(
+                    pd.concat(
+                        [shard.storage.get_block(name) for shard in shards],
+                        ignore_index=True,
+                    )
+                )
+
+        static_df = pd.concat([shard.static_df for shard in shards], ignore_index=True)
+        static_df.index = self.static_df.index
+        self.static_df = static_df
+        self.metric_params = dict(shards[0].metric_params)
+        # stages of every shard, eg one add_* call per shard
+        self.profile.merge([shard.profile for shard in shards])
+
+    def profile_report(self) -> pd.DataFrame:
+        """Time, loans, memory and pandas/polars conversions of each stage run on this
+        portfolio so far: loading, add_* methods and curves, see pola.profiling
+        """
+        return self.profile.report()
+
+    def get_metric(self, data_name: str) -> pd.DataFrame:
+        """Loans x months frame of a metric, computed if missing"""
+        self.require(data_name)
+        return self.get_data(data_name)
+
+    def invalidate_dependents(self, names: list[str]):
+        """Drops stored metrics computed from names, they get recomputed when required"""
+        for metric in dependents(names, self.metric_params):
+            self.storage.remove(
+                [name for name in metric.outputs if name in self.storage]
+            )
+            self.static_df = self.static_df.drop(
+                columns=[name for name in metric.outputs if name in self.static_df]
+            )
+
     def get_or_compute(self, data_name: str, method):
-        if data_name not in self.data_df["Data"]:
+        if data_name not in self.storage:
             res = method()
         else:
-            res = self.data_df[self.data_df["Data"] == data_name].drop(
-                ["loan_id", "Data"]
-            )
+            res = self.get_data(data_name)
         return res
 
-    def add_data(self, data: pd.DataFrame):
-        self.data_df = pd.concat((self.data_df, data), axis=0).sort_values(by=self.key)
+    def add_data(self, data: pd.DataFrame) -> pd.DataFrame:
+        """Stores wide rows (key, "Data", months...) of one or more metrics"""
+        self.storage.add(data)
         return self.data_df
 
+    def _add_values(self, data_name: str, values: np.ndarray):
+        """Stores a metric from a loans x months matrix, one row per loan of static data"""
+        self.storage.add_values(data_name, values, self.loan_index)
+
     def get_date_cols(self) -> list[datetime.date]:
-        return [col for col in self.data_df.columns if isinstance(col, datetime.date)]
+        return self.storage.date_cols()
+
+    def to_pandas(self) -> tuple[pd.DataFrame, pd.DataFrame]:
+        """Monthly data in the wide layout (data_df) and static data, as pandas frames"""
+        return self.data_df, self.static_df
 
     def all_data(self):
         """returns static and monthly Data as one"""
         return pd.merge(self.data_df, self.static_df, how="outer", on=self.key)
 
+    def long_data(
+        self,
+        data_names: list[str],
+        static_columns: list[str] = [],
+        months: list[datetime.date] | None = None,
+    ) -> pl.DataFrame:
+        """Polars frame with one row per loan per month: key, month, data_names
+        and static_columns repeated over the months of each loan
+
+        Args:
+            data_names (list[str]): "Data" labels, static columns among them
+                (eg BalanceAtDefault) are repeated like static_columns
+            months (list[datetime.date], optional): only these. Defaults to all.
+        """
+        static_columns = list(
+            dict.fromkeys(
+                [*static_columns, *[name for name in data_names if name not in self.storage]]
+            )
+        )
+        data_names = [name for name in data_names if name in self.storage]
+        panel = self.storage.long(data_names, months)
+        if static_columns:
+            profiling.count_conversion()
+            static = pl.from_pandas(self.static_df[[self.key, *static_columns]])
+            panel = panel.join(static, on=self.key, how="left", maintain_order="left")
+        return panel
+
     @classmethod
     def from_excel(
         cls,
@@ -405,45 +939,241 @@ class PortfolioOfOutstandingLoans:
         static_tab: StaticTabInfo,
         key="loan_id",
         data_tabs: list[LoanDataTabInfo] = [],
+        storage: str = "wide",
+        engine: str | None = None,
+        cache: bool = False,
     ):
-        """reads tabs of a single excel file, concatenates into one"""
+        """reads tabs of a single excel file, concatenates into one
+
+        Args:
+            engine (str, optional): pandas excel engine. Defaults to calamine when
+                python-calamine is installed, openpyxl otherwise.
+            cache (bool, optional): keep the converted tabs as Arrow files next to the workbook
+                (see pola.io.excel_cache_dir) and read those, memory-mapped, as long as
+                the workbook does not change. Defaults to False.
+        """
+        profile = profiling.Profile()
+        with profile.stage("from_excel") as stage:
+            tabs = [static_tab, *data_tabs]
+
+            cached = None
+            if cache:
+                cache_dir = io.excel_cache_dir(path, tabs)
+                cached = io.read_cache(cache_dir, ["data", "static"])
+
+            if cached is not None:
+                data_df, static_df = cached["data"], cached["static"]
+            else:
+                static_df, *tab_dfs = io.read_excel_tabs(path, tabs, engine)
+                data_df = cls._concat_data_tabs(
+                    tab_dfs, [data_tab.long_name for data_tab in data_tabs], key
+                )
+                if cache:
+                    io.write_cache(cache_dir, {"data": data_df, "static": static_df})
+
+            res = cls(data_df, static_df, key, storage=storage)
+            stage.portfolio = res
+        res.profile = profile
+        return res
+
+    @classmethod
+    def from_parquet(cls, directory: str, **kwargs):
+        """Reads a portfolio saved with to_parquet, see from_files"""
+        return cls.from_files(directory, "parquet", **kwargs)
+
+    @classmethod
+    def from_ipc(cls, directory: str, **kwargs):
+        """Reads a portfolio saved with to_ipc (Arrow IPC/Feather), see from_files"""
+        return cls.from_files(directory, "ipc", **kwargs)
+
+    @classmethod
+    def from_csv(cls, directory: str, **kwargs):
+        """Reads a portfolio saved with to_csv, see from_files"""
+        return cls.from_files(directory, "csv", **kwargs)
+
+    @classmethod
+    def from_files(
+        cls,
+        directory: str,
+        fmt: str = "parquet",
+        static_name: str = "static",
+        key="loan_id",
+        data_tabs: list[LoanDataTabInfo] | None = None,
+        storage: str = "wide",
+        loan_range: tuple | None = None,
+    ):
+        """reads static data and monthly data from one file each, eg saved by to_files
+
+        Args:
+            directory (str): folder with the files
+            fmt (str, optional): "parquet", "ipc" or "csv". Defaults to "parquet".
+            static_name (str, optional): static data file name, without extension.
+                Defaults to "static".
+            data_tabs (list[LoanDataTabInfo], optional): monthly data to read, just like
+                for from_excel but tab_name is the file name (without extension).
+                Defaults to every other file of the directory, with the file name as "Data" label.
+            loan_range (tuple, optional): (first, end) only read loans with
+                first <= key < end, end None meaning no upper bound. Defaults to all loans.
+        """
+        profile = profiling.Profile()
+        with profile.stage("from_files") as stage:
+            static_df = io.read_frame(
+                io.file_path(directory, static_name, fmt),
+                fmt,
+                key=key,
+                loan_range=loan_range,
+            )
+
+            if data_tabs is None:
+                files = sorted(Path(directory).glob("*" + io.FILE_FORMATS[fmt]))
+                names = [file.stem for file in files if file.stem != static_name]
+                labels = names
+            else:
+                names = [data_tab.tab_name for data_tab in data_tabs]
+                labels = [data_tab.long_name for data_tab in data_tabs]
+
+            dfs = [
+                io.read_frame(
+                    io.file_path(directory, name, fmt),
+                    fmt,
+                    key=key,
+                    loan_range=loan_range,
+                )
+                for name in names
+            ]
+            data_df = cls._concat_data_tabs(dfs, labels, key)
+
+            res = cls(data_df, static_df, key, storage=storage)
+            stage.portfolio = res
+        res.profile = profile
+        return res
 
-        # 1) First deal with Data tabs
+    def to_parquet(self, directory: str, **kwargs):
+        """Saves the portfolio, with every computed metric, see to_files"""
+        return self.to_files(directory, "parquet", **kwargs)
+
+    def to_ipc(self, directory: str, **kwargs):
+        """Saves the portfolio in Arrow IPC (Feather) format, see to_files"""
+        return self.to_files(directory, "ipc", **kwargs)
+
+    def to_csv(self, directory: str, **kwargs):
+        """Saves the portfolio in CSV format, see to_files"""
+        return self.to_files(directory, "csv", **kwargs)
+
+    def to_files(
+        self,
+        directory: str,
+        fmt: str = "parquet",
+        static_name="static",
+        chunk_size: int = io.ROWS_PER_GROUP,
+    ):
+        """Writes static data to one file and each "Data" label to one file named after it
+
+        Monthly files have the layout of the Excel data tabs (key and one column per month)
+        plus the "Data" column, so from_files can read them back. Files are sorted by key,
+        in groups of chunk_size loans: a ChunkedPortfolio of the same (or a multiple)
+        chunk_size then only reads the groups of each chunk (except from CSV files).
+        """
+        Path(directory).mkdir(parents=True, exist_ok=True)
+        io.write_frame(
+            self.static_df,
+            io.file_path(directory, static_name, fmt),
+            fmt,
+            self.key,
+            chunk_size,
+        )
+        for data_name in self.storage.labels():
+            io.write_frame(
+                self.storage.get_block(data_name),
+                io.file_path(directory, data_name, fmt),
+                fmt,
+                self.key,
+                chunk_size,
+            )
+
+    def to_shared(self, directory: str):
+        """Saves the portfolio, with every computed metric, for attach
+
+        Monthly data is written as a single uncompressed Arrow IPC file of the long layout
+        (see storage.LongStorage), static data and metric arguments are pickled next to it.
+        """
+        directory = Path(directory)
+        directory.mkdir(parents=True, exist_ok=True)
+        if isinstance(self.storage, LongStorage):
+            storage, storage_type = self.storage, self.storage_type
+        else:
+            storage, storage_type = LongStorage(self.data_df, self.key), "long"
+
+        storage.write_ipc(directory / SHARED_PANEL)
+        with open(directory / SHARED_META, "wb") as f:
+            pickle.dump(
+                {
+                    "key": self.key,
+                    "storage": storage_type,
+                    "static_df": self.static_df,
+                    "metric_params": self.metric_params,
+                },
+                f,
+            )
+
+    @classmethod
+    def attach(cls, directory: str):
+        """Portfolio saved with to_shared, its monthly data memory-mapped rather than read
+
+        Every process attaching the same directory shares one copy of the monthly data
+        (the OS page cache), and the portfolio pickles without it, eg to send it to workers.
+        Anything computed afterwards is kept in memory, the files are never written.
+        """
+        directory = Path(directory)
+        with open(directory / SHARED_META, "rb") as f:
+            meta = pickle.load(f)
+
+        res = cls.__new__(cls)
+        res.key = meta["key"]
+        res.storage_type = meta["storage"]
+        res.storage = STORAGES[res.storage_type].read_ipc(
+            directory / SHARED_PANEL, res.key
+        )
+        res.static_df = meta["static_df"]
+        res.loan_index = res._loan_index(res.static_df)
+        res.metric_params = meta["metric_params"]
+        res.profile = profiling.Profile()
+        return res
+
+    @staticmethod
+    def _concat_data_tabs(
+        dfs: list[pd.DataFrame], labels: list[str], key: str
+    ) -> pd.DataFrame:
+        """Data tabs as one frame, with the "Data" label of each tab"""
         data_dfs = []
-        for data_tab in data_tabs:
-            df = pd.read_excel(path, sheet_name=data_tab.tab_name, index_col=None)
-            # lower every column name to make sure it matches
+        for df, label in zip(dfs, labels):
+            df = df.drop(columns="Data", errors="ignore")
+            # headers of the key vary in case (Loan_ID, loan_id), make sure it matches
             df.columns = [
-                col.lower() if isinstance(col, str) else col for col in df.columns
+                key if isinstance(col, str) and col.lower() == key.lower() else col
+                for col in df.columns
             ]
             # Date only, don't need time
             df.columns = [
                 col.date() if isinstance(col, datetime.datetime) else col
                 for col in df.columns
             ]
-            df.insert(1, "Data", data_tab.long_name)
+            df.insert(1, "Data", label)
             data_dfs.append(df)
 
-        # Just in case of discrepancies , lower all column names
-        # because it is very important columns names are in uniform format
-
         # join vertically, since data points are columns
-        data_df = pd.concat(data_dfs, axis=0)
-        data_df = data_df.sort_values(by="loan_id")
-
-        # 2) Now join with Static
-        # Pandas limitation: first read all columns column names(just names)
-        all_columns = pd.read_excel(
-            path, sheet_name=static_tab.tab_name, skiprows=static_tab.skip_rows, nrows=0
-        ).columns
-        # the filter out unwanted columns
-        columns_to_use = all_columns[static_tab.skip_columns :]
-        # now only read columns and rows we want
-        static_df = pd.read_excel(
-            path,
-            sheet_name=static_tab.tab_name,
-            skiprows=static_tab.skip_rows,
-            usecols=columns_to_use,
-        )
-
-        return cls(data_df, static_df, key)
+        # (no need to sort, rows are looked up by key)
+        return pd.concat(data_dfs, axis=0, ignore_index=True)
+
+
+# files written by PortfolioOfOutstandingLoans.to_shared
+SHARED_PANEL = "panel.arrow"
+SHARED_META = "portfolio.pkl"
+
+
+def _require(
+    portfolio: PortfolioOfOutstandingLoans, names: list[str]
+) -> PortfolioOfOutstandingLoans:
+    """Runs in worker processes, see PortfolioOfOutstandingLoans.require"""
+    portfolio.require(*names)
+    return portfolio
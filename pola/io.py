@@ -0,0 +1,239 @@
+import datetime
+import hashlib
+from pathlib import Path
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.feather as feather
+import pyarrow.parquet as pq
+
+from .tabs import LoanDataTabInfo
+
+# calamine (Rust) parses workbooks several times faster than openpyxl
+try:
+    import python_calamine  # noqa: F401
+
+    DEFAULT_EXCEL_ENGINE = "calamine"
+except ImportError:
+    DEFAULT_EXCEL_ENGINE = "openpyxl"
+
+
+def read_excel_tabs(
+    path: str, tabs: list[LoanDataTabInfo], engine: str | None = None
+) -> list[pd.DataFrame]:
+    """Reads every tab, skipping its skip_rows and skip_columns, opening the workbook once"""
+    with pd.ExcelFile(path, engine=engine or DEFAULT_EXCEL_ENGINE) as workbook:
+        return [
+            workbook.parse(tab.tab_name, skiprows=tab.skip_rows, index_col=None).iloc[
+                :, tab.skip_columns :
+            ]
+            for tab in tabs
+        ]
+
+
+### #####  ###
+### FILES  ###
+### #####  ###
+
+# Frames are stored one per file, in the same layout as the Excel tabs
+# (for monthly data: key, "Data" and one column per month)
+# Files are sorted by key and written in groups of rows (parquet row groups, IPC record
+# batches) which carry their key range: reading a range of loans only reads the groups
+# holding it. CSV has no groups, each read parses the whole file (in blocks).
+FILE_FORMATS = {"parquet": ".parquet", "ipc": ".arrow", "csv": ".csv"}
+
+# rows per group, when not given
+ROWS_PER_GROUP = 100_000
+
+# datetime64 columns are written with a time, datetime.date ones without,
+# that is how we tell them apart when reading CSV
+CSV_DATETIME_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+
+def file_path(directory: str, name: str, fmt: str) -> Path:
+    if fmt not in FILE_FORMATS:
+        raise ValueError(f"Unknown format {fmt!r}, expected one of {list(FILE_FORMATS)}")
+    return Path(directory) / f"{name}{FILE_FORMATS[fmt]}"
+
+
+def write_frame(
+    df: pd.DataFrame,
+    file: Path,
+    fmt: str,
+    key: str | None = None,
+    rows_per_group: int = ROWS_PER_GROUP,
+):
+    """Writes df, sorted by key if given, in groups of rows_per_group rows"""
+    if key is not None:
+        df = df.sort_values(key, kind="stable")
+    df = df.rename(columns=_date_to_str)
+    if fmt == "csv":
+        df.to_csv(file, index=False, date_format=CSV_DATETIME_FORMAT)
+        return
+
+    table = pa.Table.from_pandas(df, preserve_index=False)
+    if fmt == "parquet":
+        pq.write_table(table, file, row_group_size=rows_per_group)
+    else:
+        # uncompressed, so that batches are read straight from the mapped file
+        with pa.ipc.new_file(file, table.schema) as writer:
+            for batch in table.to_batches(max_chunksize=rows_per_group):
+                writer.write_batch(batch)
+
+
+def read_frame(
+    file: Path,
+    fmt: str,
+    columns: list[str] | None = None,
+    key: str | None = None,
+    loan_range: tuple | None = None,
+) -> pd.DataFrame:
+    """Reads a frame written by write_frame
+
+    Args:
+        columns (list[str], optional): only read these. Defaults to all.
+        key (str, optional): loan identifier column, required for loan_range.
+        loan_range (tuple, optional): (first, end) only read rows with
+            first <= key < end, end None meaning no upper bound. Defaults to all rows.
+            Only the groups of rows holding the range are read (see FILE_FORMATS),
+            except for CSV files which are parsed in full, a block at a time.
+    """
+    if fmt == "csv":
+        reader = pd.read_csv(
+            file, usecols=columns, float_precision="round_trip", chunksize=1 << 16
+        )
+        # filter as we go, so that we never hold more than the range
+        df = pd.concat(
+            [_in_range(chunk, key, loan_range) for chunk in reader], ignore_index=True
+        )
+        df = df.apply(_parse_dates)
+    else:
+        if fmt == "parquet":
+            table = pq.read_table(
+                file, columns=columns, filters=_loan_filter(key, loan_range)
+            )
+        else:
+            table = _read_ipc(file, columns, key, loan_range)
+        df = table.to_pandas()
+    return df.rename(columns=_str_to_date)
+
+
+def _read_ipc(
+    file: Path, columns: list[str] | None, key: str | None, loan_range: tuple | None
+) -> pa.Table:
+    """Rows of loan_range of an IPC file, a record batch at a time"""
+    # batches point into the mapped file, which stays open as long as they do
+    reader = pa.ipc.open_file(pa.memory_map(str(file)))
+    schema = reader.schema
+    if columns is not None:
+        schema = pa.schema([schema.field(column) for column in columns])
+    batches = []
+    for i in range(reader.num_record_batches):
+        batch = reader.get_batch(i)
+        if loan_range is not None:
+            keys = pc.min_max(batch.column(key))
+            if not _overlaps(keys["min"].as_py(), keys["max"].as_py(), loan_range):
+                continue
+            batch = batch.filter(_loan_filter(key, loan_range))
+        batches.append(batch.select(schema.names))
+    return pa.Table.from_batches(batches, schema)
+
+
+def _overlaps(low, high, loan_range: tuple) -> bool:
+    """Do keys from low to high include any of loan_range"""
+    if low is None:
+        return False
+    first, end = loan_range
+    return high >= first and (end is None or low < end)
+
+
+def _loan_filter(key: str, loan_range: tuple | None) -> pc.Expression | None:
+    if loan_range is None:
+        return None
+    first, end = loan_range
+    expr = pc.field(key) >= first
+    if end is not None:
+        expr &= pc.field(key) < end
+    return expr
+
+
+def _in_range(df: pd.DataFrame, key: str, loan_range: tuple | None) -> pd.DataFrame:
+    if loan_range is None:
+        return df
+    first, end = loan_range
+    mask = df[key] >= first
+    if end is not None:
+        mask &= df[key] < end
+    return df[mask]
+
+
+def _parse_dates(col: pd.Series) -> pd.Series:
+    """Restores date and datetime columns of a csv file"""
+    values = col.dropna()
+    if values.empty or not pd.api.types.is_string_dtype(values):
+        return col
+    if values.str.fullmatch(r"\d{4}-\d{2}-\d{2}").all():
+        return col.map(datetime.date.fromisoformat, na_action="ignore").astype(object)
+    if values.str.fullmatch(r"\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2}").all():
+        return pd.to_datetime(col, format=CSV_DATETIME_FORMAT).astype("datetime64[us]")
+    return col
+
+
+### ####  ###
+### CACHE ###
+### ####  ###
+
+# Converted tabs are cached as uncompressed Arrow IPC (Feather v2) files,
+# which are memory-mapped when read back
+
+
+def excel_cache_dir(path: str, tabs: list[LoanDataTabInfo]) -> Path:
+    """Cache location next to the workbook, keyed by its content and the tabs read"""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            digest.update(chunk)
+    for tab in tabs:
+        digest.update(
+            repr(
+                (type(tab).__name__, tab.tab_name, tab.skip_rows, tab.skip_columns)
+            ).encode()
+        )
+
+    path = Path(path)
+    return path.parent / ".pola_cache" / f"{path.stem}-{digest.hexdigest()[:16]}"
+
+
+def write_cache(cache_dir: Path, frames: dict[str, pd.DataFrame]):
+    cache_dir.mkdir(parents=True, exist_ok=True)
+    for name, df in frames.items():
+        table = pa.Table.from_pandas(df.rename(columns=_date_to_str))
+        # write then rename, so that a half written file is never picked up
+        tmp = cache_dir / f"{name}.arrow.tmp"
+        feather.write_feather(table, tmp, compression="uncompressed")
+        tmp.replace(cache_dir / f"{name}.arrow")
+
+
+def read_cache(cache_dir: Path, names: list[str]) -> dict[str, pd.DataFrame] | None:
+    """None if any of the frames is not cached"""
+    files = [cache_dir / f"{name}.arrow" for name in names]
+    if not all(file.exists() for file in files):
+        return None
+    return {
+        name: feather.read_table(file, memory_map=True)
+        .to_pandas()
+        .rename(columns=_str_to_date)
+        for name, file in zip(names, files)
+    }
+
+
+def _date_to_str(col):
+    return col.isoformat() if isinstance(col, datetime.date) else col
+
+
+def _str_to_date(col):
+    try:
+        return datetime.date.fromisoformat(col)
+    except (TypeError, ValueError):
+        return col
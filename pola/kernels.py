@@ -0,0 +1,171 @@
+import numpy as np
+
+# Vectorised building blocks for PortfolioOfOutstandingLoans
+# Every kernel works on a whole loans x months matrix at once:
+# rows are loans (ordered as static data), columns are months (ordered as date columns)
+
+
+def first_true(mask: np.ndarray) -> np.ndarray:
+    """Column index of the first True in each row, -1 if none"""
+    if mask.shape[1] == 0:
+        return np.full(mask.shape[0], -1)
+    idx = mask.argmax(axis=1)
+    return np.where(mask.any(axis=1), idx, -1)
+
+
+def first_run_end(mask: np.ndarray, run_length: int) -> np.ndarray:
+    """Column index where the first run of run_length consecutive Trues ends, -1 if none
+
+    eg run_length=3, [1, 1, 0, 1, 1, 1, 1] -> 5
+    """
+    n_cols = mask.shape[1]
+    if run_length > n_cols:
+        return np.full(mask.shape[0], -1)
+    # window[:, j] is True when mask[:, j : j + run_length] are all True
+    window = mask[:, run_length - 1 :].copy()
+    for shift in range(1, run_length):
+        window &= mask[:, run_length - 1 - shift : n_cols - shift]
+    idx = first_true(window)
+    return np.where(idx >= 0, idx + run_length - 1, -1)
+
+
+def first_run_start(mask: np.ndarray, run_length: int) -> np.ndarray:
+    """Column index where the first run of run_length consecutive Trues starts, -1 if none
+
+    eg run_length=3, [1, 1, 0, 1, 1, 1, 1] -> 3
+    """
+    end = first_run_end(mask, run_length)
+    return np.where(end >= 0, end - run_length + 1, -1)
+
+
+def default_index(
+    payment_made_vs_due: np.ndarray, n_missed: int = 3, tolerance: float = -0.0001
+) -> np.ndarray:
+    """Column index of the month where a loan misses n_missed payments in a row, -1 if never
+
+    Args:
+        payment_made_vs_due (np.ndarray): Payment Made - Payment Due
+        n_missed (int, optional): consecutive missed payments to default. Defaults to 3.
+        tolerance (float, optional): a payment is missed when made - due is below it.
+            Defaults to -0.0001.
+    """
+    missed = payment_made_vs_due < tolerance  # NaN is never a missed payment
+    return first_run_end(missed, n_missed)
+
+
+def prepayment_index(
+    balance: np.ndarray,
+    threshold: float = 0.00001,
+    n_zero_months: int = 1,
+    default_idx: np.ndarray | None = None,
+) -> np.ndarray:
+    """Column index of the month where a loan repays, -1 if never: the first of
+    n_zero_months months in a row with a balance below threshold
+
+    Args:
+        balance (np.ndarray): Month End Balance
+        default_idx (np.ndarray, optional): column index of the default month, -1 if no
+            default. Balances from the default month onwards are then not repayments.
+            Defaults to None.
+    """
+    repaid = balance < threshold  # NaN is never repaid
+    if default_idx is not None:
+        repaid &= ~since_index(default_idx, balance.shape[1])
+    return first_run_start(repaid, n_zero_months)
+
+
+def missed_payments(payment_made_vs_due: np.ndarray) -> np.ndarray:
+    """Running count of missed payments (made - due below 0), NaN months stay NaN"""
+    res = np.cumsum(payment_made_vs_due < 0, axis=1).astype(float)
+    res[np.isnan(payment_made_vs_due)] = np.nan
+    return res
+
+
+def one_hot(index: np.ndarray, n_cols: int) -> np.ndarray:
+    """Float matrix with 1 at (row, index[row]), rows with index -1 are all 0"""
+    res = np.zeros((len(index), n_cols))
+    rows = np.flatnonzero(index >= 0)
+    res[rows, index[rows]] = 1
+    return res
+
+
+def last_true(mask: np.ndarray) -> np.ndarray:
+    """Column index of the last True in each row, -1 if none"""
+    idx = first_true(mask[:, ::-1])
+    return np.where(idx >= 0, mask.shape[1] - 1 - idx, -1)
+
+
+def since_index(index: np.ndarray, n_cols: int) -> np.ndarray:
+    """True from column index[row] onwards, rows with index -1 are all False"""
+    cols = np.arange(n_cols)
+    return (index >= 0)[:, None] & (cols[None, :] >= index[:, None])
+
+
+def recovery(payments: np.ndarray, default_idx: np.ndarray, threshold: float = 0.001):
+    """Recoveries are payments above threshold made in or after the month of default
+
+    Returns:
+        tuple: recovery flags (float 0/1), cumulative recovery,
+            column index of the last recovery (-1 if none),
+            total recovered (NaN if none)
+    """
+    flags = since_index(default_idx, payments.shape[1]) & (payments > threshold)
+    cumulative = np.cumsum(np.where(flags, payments, 0.0), axis=1)
+    last_idx = last_true(flags)
+    recovered = np.where(last_idx >= 0, cumulative[:, -1], np.nan)
+    return flags.astype(float), cumulative, last_idx, recovered
+
+
+def until_index(index: np.ndarray, n_cols: int) -> np.ndarray:
+    """True up to and including column index[row], rows with index -1 are all False"""
+    cols = np.arange(n_cols)
+    return cols[None, :] <= index[:, None]
+
+
+def is_active(
+    months: np.ndarray, origination: np.ndarray, default_idx: np.ndarray
+) -> np.ndarray:
+    """Loan is active once originated, except up to and including its default month
+
+    Args:
+        months (np.ndarray): datetime64 date columns
+        origination (np.ndarray): datetime64 origination date per loan, NaT never originates
+        default_idx (np.ndarray): column index of the default month, -1 if no default
+    """
+    originated = months[None, :] >= origination[:, None]
+    return originated & ~until_index(default_idx, len(months))
+
+
+def take_at(values: np.ndarray, index: np.ndarray) -> np.ndarray:
+    """values[row, index[row]] for every row, NaN where index is -1"""
+    rows = np.arange(len(index))
+    res = values[rows, np.maximum(index, 0)].astype(float)
+    res[index < 0] = np.nan
+    return res
+
+
+def trailing_run(mask: np.ndarray) -> np.ndarray:
+    """Number of consecutive Trues at the end of each row"""
+    last_false = last_true(~mask)
+    return mask.shape[1] - 1 - last_false
+
+
+def months_since(
+    months: np.ndarray, anchor: np.ndarray, calendar: bool = False
+) -> np.ndarray:
+    """Months from anchor to each month, NaN where anchor is NaT
+
+    Args:
+        months (np.ndarray): datetime64[D] date columns
+        anchor (np.ndarray): datetime64[D] date per loan
+        calendar (bool, optional): calendar months between the two (year * 12 + month,
+            ignoring days) rather than days / 30, rounded. Defaults to False.
+    """
+    unit = "datetime64[M]" if calendar else "datetime64[D]"
+    delta = months.astype(unit)[None, :] - anchor.astype(unit)[:, None]
+    res = delta.astype(float)
+    if not calendar:
+        # For simplicity assuming 30 days per month
+        res = np.round(res / 30)
+    res[np.isnat(delta)] = np.nan
+    return res
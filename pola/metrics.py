@@ -0,0 +1,202 @@
+import functools
+import inspect
+
+# Extendable!
+# Every derived metric of PortfolioOfOutstandingLoans is produced by one add_* method.
+# Decorating the method with @derived_metric declares what it produces and what it needs,
+# so that asking for a metric computes only its missing ancestors, in the right order, once.
+# Users who subclass PortfolioOfOutstandingLoans can register their own add_* methods the same way.
+# A metric may also name an append method, which extends it by one month from the new month of
+# its inputs (see PortfolioOfOutstandingLoans.append_month), others are recomputed on append.
+# Monthly outputs which are not amounts declare their kind, so that storage can keep them compact.
+# What a method only reads for some of its arguments (eg exclude_defaulted) is declared apart,
+# so that recomputing it does not drop metrics computed without it.
+
+# kinds of monthly data, see storage.LongStorage
+AMOUNT = "amount"  # any number, the default
+FLAG = "flag"  # 0 or 1
+MONTHS = "months"  # a whole number of months
+
+
+class Metric:
+    """Metric(s) produced by one add_* method of PortfolioOfOutstandingLoans
+
+    Args:
+        method (str): name of the add_* method
+        outputs (list[str]): "Data" labels and/or static columns the method adds
+        requires (list[str]): "Data" labels and/or static columns the method reads
+        append (str, optional): name of the method extending outputs by one month,
+            see PortfolioOfOutstandingLoans.append_month. Defaults to None: outputs are
+            recomputed over every month.
+        kinds (dict[str, str], optional): FLAG or MONTHS for monthly outputs which are
+            not amounts. Defaults to None: every monthly output is an AMOUNT.
+        requires_if (dict[str, list[str]], optional): argument of the method -> what the
+            method also reads when it is true, eg {"exclude_defaulted": ["DefaultMonth"]}.
+            Defaults to None.
+        signature (inspect.Signature, optional): of the method, to read the arguments of
+            requires_if. Defaults to None.
+    """
+
+    def __init__(
+        self,
+        method: str,
+        outputs: list[str],
+        requires: list[str],
+        append: str | None = None,
+        kinds: dict[str, str] | None = None,
+        requires_if: dict[str, list[str]] | None = None,
+        signature: inspect.Signature | None = None,
+    ):
+        self.method = method
+        self.outputs = outputs
+        self.requires = requires
+        self.append = append
+        self.kinds = kinds or {}
+        self.requires_if = requires_if or {}
+        self.signature = signature
+
+    @property
+    def all_requires(self) -> list[str]:
+        """What the method reads for some arguments or other"""
+        optional = [name for names in self.requires_if.values() for name in names]
+        return list(dict.fromkeys([*self.requires, *optional]))
+
+    def requires_of(self, args: tuple = (), kwargs: dict = {}) -> list[str]:
+        """What the method reads when called with args and kwargs"""
+        if not self.requires_if:
+            return self.requires
+        arguments = self.signature.bind(None, *args, **kwargs)
+        arguments.apply_defaults()
+        return list(
+            dict.fromkeys(
+                [
+                    *self.requires,
+                    *(
+                        name
+                        for argument, names in self.requires_if.items()
+                        if arguments.arguments[argument]
+                        for name in names
+                    ),
+                ]
+            )
+        )
+
+    def __repr__(self):
+        return f"Metric({self.method}: {self.requires} -> {self.outputs})"
+
+
+# output name -> Metric producing it
+METRICS: dict[str, Metric] = {}
+
+
+def register_metric(metric: Metric):
+    for output in metric.outputs:
+        METRICS[output] = metric
+
+
+def kind_of(data_name: str) -> str:
+    """Kind of a "Data" label: AMOUNT unless its metric says otherwise"""
+    if data_name not in METRICS:
+        return AMOUNT
+    return METRICS[data_name].kinds.get(data_name, AMOUNT)
+
+
+def dependents(
+    names: list[str], params: dict[str, tuple] | None = None
+) -> list[Metric]:
+    """Metrics which (directly or not) require any of names
+
+    Args:
+        params (dict[str, tuple], optional): method -> (args, kwargs) the metrics are
+            computed with, see PortfolioOfOutstandingLoans.metric_params. Defaults to
+            None: whatever the metrics read for any arguments.
+    """
+    res = []
+    stack = list(names)
+    while stack:
+        name = stack.pop()
+        for metric in dict.fromkeys(METRICS.values()):
+            if params is None:
+                requires = metric.all_requires
+            else:
+                requires = metric.requires_of(*params.get(metric.method, ((), {})))
+            if name in requires and metric not in res:
+                res.append(metric)
+                stack.extend(metric.outputs)
+    return res
+
+
+def in_dependency_order(metrics: list[Metric]) -> list[Metric]:
+    """metrics, each one after the metrics (among them) it requires"""
+    res = []
+
+    def visit(metric: Metric):
+        if metric in res:
+            return
+        for name in metric.all_requires:
+            if name in METRICS and METRICS[name] in metrics:
+                visit(METRICS[name])
+        res.append(metric)
+
+    for metric in metrics:
+        visit(metric)
+    return res
+
+
+def derived_metric(
+    outputs: list[str],
+    requires: list[str] = [],
+    append: str | None = None,
+    kinds: dict[str, str] | None = None,
+    requires_if: dict[str, list[str]] | None = None,
+):
+    """Registers an add_* method as the producer of outputs
+
+    Calling the method then
+        1) computes whichever of requires (and requires_if, for its arguments) is missing
+        2) drops metrics computed from a previous version of outputs
+        3) remembers the arguments, so that dropped metrics are recomputed the same way
+        4) records itself as a stage of portfolio.profile (see pola.profiling)
+        5) returns data_df, or static_df when the first output is a static column
+
+    The method itself only stores its outputs. portfolio.require computes metrics
+    through wrapper.compute, steps 1) to 4), so that data_df is only built
+    (converted to pandas, with the polars backed storages) when asked for.
+    """
+
+    def decorator(add_method):
+        metric = Metric(
+            add_method.__name__,
+            list(outputs),
+            list(requires),
+            append,
+            kinds,
+            requires_if,
+            inspect.signature(add_method),
+        )
+        register_metric(metric)
+
+        def run(portfolio, args, kwargs, result: bool):
+            with portfolio.profile.stage(metric.method, portfolio):
+                portfolio.require(*metric.requires_of(args, kwargs))
+                portfolio.invalidate_dependents(metric.outputs)
+                portfolio.metric_params[metric.method] = (args, kwargs)
+                add_method(portfolio, *args, **kwargs)
+                if not result:
+                    return None
+                if metric.outputs[0] in portfolio.static_df.columns:
+                    return portfolio.static_df
+                return portfolio.data_df
+
+        def compute(portfolio, *args, **kwargs):
+            run(portfolio, args, kwargs, result=False)
+
+        @functools.wraps(add_method)
+        def wrapper(portfolio, *args, **kwargs):
+            return run(portfolio, args, kwargs, result=True)
+
+        wrapper.metric = metric
+        wrapper.compute = compute
+        return wrapper
+
+    return decorator
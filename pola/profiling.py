@@ -0,0 +1,195 @@
+import os
+import resource
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable
+
+import pandas as pd
+
+# Every PortfolioOfOutstandingLoans records a Stage for loading (from_excel, from_files),
+# each add_* method and each curve built from it, see PortfolioOfOutstandingLoans.profile_report.
+# Extendable!
+# Functions added with add_hook receive every Stage as it ends, eg to forward it to a
+# metrics system. Memory is the resident memory of the process, sampled while the stage
+# runs (see PeakMemory): polars and Arrow allocate outside of Python, where tracemalloc
+# does not see them.
+
+
+class Stage:
+    """One timed step of the pipeline
+
+    Attributes:
+        name (str): eg "add_default_month" or "CPR"
+        depth (int): number of stages it ran within, eg a metric computed for another
+        seconds (float): wall time, including the stages it ran
+        loans (int): loans of the portfolio when it ended, None if not known
+        loan_months (int): loans x months of the portfolio when it ended, None if not known
+        peak_memory (int): bytes of resident memory at the peak above the start,
+            stages it ran included
+        conversions (int): frames converted between pandas and polars
+    """
+
+    def __init__(self, name: str, depth: int = 0):
+        self.name = name
+        self.depth = depth
+        self.seconds = 0.0
+        self.loans = None
+        self.loan_months = None
+        self.peak_memory = None
+        self.conversions = 0
+        # portfolio whose size is recorded when the stage ends
+        self.portfolio = None
+
+    def __repr__(self):
+        return f"Stage({self.name}: {self.seconds:.3f}s)"
+
+
+# receive every Stage as it ends
+HOOKS: list[Callable[[Stage], None]] = []
+
+
+def add_hook(hook: Callable[[Stage], None]):
+    HOOKS.append(hook)
+
+
+def remove_hook(hook: Callable[[Stage], None]):
+    HOOKS.remove(hook)
+
+
+# pandas <-> polars conversions so far, see count_conversion
+_conversions = 0
+
+
+def count_conversion(n: int = 1):
+    """Called wherever pola converts a frame between pandas and polars"""
+    global _conversions
+    _conversions += n
+
+
+class Profile:
+    """Stages recorded for a portfolio, in the order they ended"""
+
+    def __init__(self):
+        self.stages: list[Stage] = []
+        # stages running, outermost first
+        self._running: list[Stage] = []
+
+    @contextmanager
+    def stage(self, name: str, portfolio=None):
+        """Records the block as a Stage, the size of portfolio (if it has one)
+        is recorded when the block ends, or of stage.portfolio if set meanwhile
+        """
+        stage = Stage(name, len(self._running))
+        stage.portfolio = portfolio
+        conversions = _conversions
+        self._running.append(stage)
+        start = time.perf_counter()
+        try:
+            with PeakMemory() as memory:
+                yield stage
+        finally:
+            stage.seconds = time.perf_counter() - start
+            stage.peak_memory = round((memory.peak - memory.start) * 2**20)
+            self._running.pop()
+            stage.conversions = _conversions - conversions
+            _record_size(stage)
+            self.stages.append(stage)
+            for hook in HOOKS:
+                hook(stage)
+
+    def report(self) -> pd.DataFrame:
+        """One row per stage name, in the order they first ended: calls, total seconds
+        (including the stages they ran), loans and loan months of the last call,
+        highest peak memory (MB) and total conversions
+        """
+        columns = [
+            "calls",
+            "seconds",
+            "loans",
+            "loan_months",
+            "peak_memory_mb",
+            "conversions",
+        ]
+        rows = {}
+        for stage in self.stages:
+            row = rows.setdefault(stage.name, dict.fromkeys(columns))
+            row["calls"] = (row["calls"] or 0) + 1
+            row["seconds"] = (row["seconds"] or 0.0) + stage.seconds
+            row["loans"] = stage.loans
+            row["loan_months"] = stage.loan_months
+            if stage.peak_memory is not None:
+                row["peak_memory_mb"] = max(
+                    row["peak_memory_mb"] or 0.0, stage.peak_memory / 2**20
+                )
+            row["conversions"] = (row["conversions"] or 0) + stage.conversions
+        return pd.DataFrame.from_dict(rows, orient="index", columns=columns).rename_axis(
+            "stage"
+        )
+
+    def merge(self, profiles: list["Profile"]):
+        """Takes in the stages of profiles, eg of shards enriched in other processes,
+        as stages run within the stages running here (hooks do not receive them again)
+        """
+        depth = len(self._running)
+        for profile in profiles:
+            for stage in profile.stages:
+                stage.depth += depth
+                self.stages.append(stage)
+
+    def clear(self):
+        self.stages = []
+
+    def __getstate__(self) -> dict:
+        # never pickled half way through a stage
+        return {"stages": self.stages, "_running": []}
+
+
+class PeakMemory:
+    """Highest resident memory of the process while in the with block, in MB
+
+    Sampled, since polars allocates outside of Python (tracemalloc does not see it).
+    Where /proc is not available, the high water mark of the process: a block which
+    does not go above an earlier peak then shows none.
+    """
+
+    def __init__(self, interval: float = 0.005):
+        self.interval = interval
+        self.start = 0.0
+        self.peak = 0.0
+
+    def __enter__(self):
+        self._done = threading.Event()
+        self.start = self.peak = _rss_mb()
+        self._thread = threading.Thread(target=self._sample, daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._done.set()
+        self._thread.join()
+        self.peak = max(self.peak, _rss_mb())
+
+    def _sample(self):
+        while not self._done.wait(self.interval):
+            self.peak = max(self.peak, _rss_mb())
+
+
+def _rss_mb() -> float:
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2**20
+    except OSError:
+        # high water mark only, KB on Linux, bytes on macOS
+        maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return maxrss / (2**20 if sys.platform == "darwin" else 2**10)
+
+
+def _record_size(stage: Stage):
+    portfolio, stage.portfolio = stage.portfolio, None
+    static_df = getattr(portfolio, "static_df", None)
+    if static_df is None:
+        return
+    stage.loans = len(static_df)
+    stage.loan_months = stage.loans * len(portfolio.get_date_cols())
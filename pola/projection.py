@@ -0,0 +1,365 @@
+import datetime
+import multiprocessing
+from concurrent.futures import Executor, ProcessPoolExecutor
+from itertools import repeat
+
+import numpy as np
+import pandas as pd
+
+from .curves import Curve, curve_name
+from .dataset import PortfolioOfOutstandingLoans
+
+# Projects the loans of a portfolio forward from its last month with curves (eg built from
+# its own history): every month a performing loan defaults with the probability given by
+# CDR at its seasoning, otherwise repays in full with the one given by CPR, and a defaulted
+# loan recovers its balance at default along RecoveryCurve (by Time Since Default).
+# Balances are otherwise flat, as for the interest only mortgages of the case study.
+# A scenario is one random draw of these events for every loan and month, drawn as a
+# scenarios x loans x months array, a batch of scenarios at a time to bound memory.
+
+# flows of ProjectionResult
+BALANCE = "Balance"
+PREPAYMENT = "Prepayment"
+DEFAULT = "Default"
+RECOVERY = "Recovery"
+FLOWS = [BALANCE, PREPAYMENT, DEFAULT, RECOVERY]
+
+# bytes per loan month of a scenario: a float32 draw and a bool event
+BYTES_PER_DRAW = 5
+
+
+class Projection:
+    """Monte Carlo projection of the cashflows of a portfolio after its last month
+
+    Performing loans (positive Month End Balance and no DefaultMonth) default, prepay or
+    carry on each month at random, see the module doc. Loans which defaulted but have not
+    recovered yet recover along the recovery curve, the same in every scenario.
+
+    Args:
+        portfolio (PortfolioOfOutstandingLoans): snapshot, projected from its last month
+        cpr (Curve): CPR with index "Seasoning", pivoted by pivot if given
+        cdr (Curve): CDR with index "Seasoning", pivoted by pivot if given
+        recovery (Curve, optional): RecoveryCurve with index "Time Since Default", pivoted
+            by pivot if given. Defaults to None, no recoveries.
+        pivot (str, optional): static column the curves are pivoted by (eg "product"),
+            each loan follows the curves of its group. Defaults to None.
+
+    eg
+        cpr = CPR(portfolio, pivots=["product"])
+        cdr = CDR(portfolio, pivots=["product"])
+        recovery = RecoveryCurve(portfolio, index="Time Since Default", pivots=["product"])
+        res = Projection(portfolio, cpr, cdr, recovery, pivot="product").run(10_000, 120)
+        res.mean()
+    """
+
+    def __init__(
+        self,
+        portfolio: PortfolioOfOutstandingLoans,
+        cpr: Curve,
+        cdr: Curve,
+        recovery: Curve | None = None,
+        pivot: str | None = None,
+    ):
+        self.pivot = pivot
+        self.key = portfolio.key
+        self.profile = portfolio.profile
+        with self.profile.stage("Projection", portfolio):
+            names = ["Seasoning", "Month End Balance", "DefaultMonth"]
+            if recovery is not None:
+                names += ["Time Since Default", "BalanceAtDefault", "RecoveredAmmount"]
+            portfolio.require(*names)
+            self.start = portfolio.get_date_cols()[-1]
+
+            def last_month(data_name):
+                return portfolio.get_values(data_name)[:, -1]
+
+            static_df = portfolio.static_df
+            balance = np.nan_to_num(last_month("Month End Balance"))
+            defaulted = static_df["DefaultMonth"].notna().to_numpy()
+            performing = ~defaulted & (balance > 0)
+            if recovery is None:
+                recovering = np.zeros(len(static_df), dtype=bool)
+            else:
+                balance_at_default = np.nan_to_num(
+                    static_df["BalanceAtDefault"].to_numpy(dtype=float)
+                )
+                recovering = (
+                    defaulted
+                    & (balance_at_default > 0)
+                    & static_df["RecoveredAmmount"].isna().to_numpy()
+                )
+
+            if pivot is None:
+                group = np.zeros(len(static_df), dtype=int)
+                values = [()]
+            else:
+                group, uniques = pd.factorize(static_df[pivot])
+                values = [(value,) for value in uniques]
+                no_group = (performing | recovering) & (group < 0)
+                if no_group.any():
+                    loans = static_df.loc[no_group, portfolio.key].tolist()[:10]
+                    raise ValueError(f"Loans {loans} have no {pivot}")
+
+            pivots = [] if pivot is None else [pivot]
+            self.cpr = _curve_table(cpr, pivots, values, "Seasoning")
+            self.cdr = _curve_table(cdr, pivots, values, "Seasoning")
+            self.recovery = (
+                None
+                if recovery is None
+                else _curve_table(recovery, pivots, values, "Time Since Default")
+            )
+
+            keys = static_df[portfolio.key].to_numpy()
+            self.loan_ids = keys[performing]
+            self.balance = balance[performing]
+            self.seasoning = np.nan_to_num(last_month("Seasoning")[performing]).astype(int)
+            self.group = group[performing]
+            if recovery is not None:
+                self.recovering_balance = balance_at_default[recovering]
+                self.time_since_default = np.nan_to_num(
+                    last_month("Time Since Default")[recovering]
+                ).astype(int)
+                self.recovering_group = group[recovering]
+
+    def months(self, n_months: int) -> list[datetime.date]:
+        """n_months month ends after the last month of the portfolio"""
+        month_starts = np.datetime64(self.start, "M") + np.arange(2, n_months + 2)
+        return (month_starts.astype("datetime64[D]") - 1).tolist()
+
+    def run(
+        self,
+        n_scenarios: int = 1_000,
+        n_months: int = 120,
+        seed: int = 0,
+        batch_size: int | None = None,
+        max_batch_bytes: int = 2**28,
+        n_workers: int = 1,
+        executor: Executor | None = None,
+    ) -> "ProjectionResult":
+        """Projects n_scenarios scenarios of n_months
+
+        Args:
+            seed (int, optional): same seed and batch_size, same scenarios, whatever
+                n_workers. Defaults to 0.
+            batch_size (int, optional): scenarios drawn at a time. Defaults to as many as
+                fit in max_batch_bytes.
+            max_batch_bytes (int, optional): bounds the scenarios x loans x months arrays
+                of a batch. Defaults to 256MB.
+            n_workers (int, optional): when above 1, batches run in a process pool of
+                that size unless executor is given. Defaults to 1.
+            executor (Executor, optional): runs the batches, eg a pool shared by several
+                runs. Defaults to None.
+        """
+        if n_months < 1:
+            raise ValueError(f"n_months must be positive, got {n_months}")
+        with self.profile.stage("Projection.run"):
+            inputs = self._inputs(n_months)
+            if batch_size is None:
+                draws = max(1, BYTES_PER_DRAW * len(self.balance) * n_months)
+                batch_size = max(1, max_batch_bytes // draws)
+            sizes = [
+                min(batch_size, n_scenarios - first)
+                for first in range(0, n_scenarios, batch_size)
+            ]
+            seeds = np.random.SeedSequence(seed).spawn(len(sizes))
+
+            if n_workers > 1 or executor is not None:
+                if executor is None:
+                    # polars' thread pool does not survive a fork
+                    context = multiprocessing.get_context("spawn")
+                    with ProcessPoolExecutor(n_workers, mp_context=context) as executor:
+                        parts = list(
+                            executor.map(_project_batch, repeat(inputs), seeds, sizes)
+                        )
+                else:
+                    parts = list(executor.map(_project_batch, repeat(inputs), seeds, sizes))
+            else:
+                parts = list(map(_project_batch, repeat(inputs), seeds, sizes))
+
+            flows = {
+                name: np.concatenate(
+                    [np.empty((0, n_months))] + [flows[name] for flows, _ in parts]
+                )
+                for name in FLOWS
+            }
+            flows[RECOVERY] += self._pending_recoveries(n_months)
+
+            # scenarios in which each loan is still performing at each month end
+            removed = sum(
+                (counts for _, counts in parts), np.zeros((len(self.balance), n_months + 1))
+            )
+            performing = n_scenarios - np.cumsum(removed, axis=1)[:, :n_months]
+            loan_balance = pd.DataFrame(
+                self.balance[:, None] * performing / max(n_scenarios, 1),
+                index=pd.Index(self.loan_ids, name=self.key),
+                columns=self.months(n_months),
+            )
+            return ProjectionResult(self.months(n_months), flows, loan_balance)
+
+    def _inputs(self, n_months: int) -> dict:
+        """Everything a batch needs, see _project_batch"""
+        # seasoning of each loan in each projected month
+        seasoning = self.seasoning[:, None] + np.arange(1, n_months + 1)
+        seasoning = np.maximum(seasoning, 0)
+        n_seasonings = int(seasoning.max(initial=0)) + 1
+        default_hazard = _extend(self.cdr, n_seasonings)[self.group[:, None], seasoning]
+        prepayment_hazard = _extend(self.cpr, n_seasonings)[self.group[:, None], seasoning]
+        default_hazard = np.clip(default_hazard, 0, 1)
+        prepayment_hazard = np.clip(prepayment_hazard, 0, 1 - default_hazard)
+        return {
+            "balance": self.balance,
+            "group": self.group,
+            "default_hazard": default_hazard.astype(np.float32),
+            "event_hazard": (default_hazard + prepayment_hazard).astype(np.float32),
+            "recovery": None
+            if self.recovery is None
+            else _increments(_extend(self.recovery, n_months)),
+        }
+
+    def _pending_recoveries(self, n_months: int) -> np.ndarray:
+        """Recoveries of loans defaulted before the projection, per month"""
+        if self.recovery is None or not len(self.recovering_balance):
+            return np.zeros(n_months)
+        time_since_default = self.time_since_default[:, None] + np.arange(1, n_months + 1)
+        time_since_default = np.maximum(time_since_default, 0)
+        increments = _increments(
+            _extend(self.recovery, int(time_since_default.max()) + 1)
+        )
+        return (
+            self.recovering_balance[:, None]
+            * increments[self.recovering_group[:, None], time_since_default]
+        ).sum(axis=0)
+
+
+class ProjectionResult:
+    """Cashflows of each scenario of a Projection
+
+    Attributes:
+        months (list[datetime.date]): month ends projected
+        flows (dict[str, np.ndarray]): scenarios x months of each of FLOWS: performing
+            BALANCE at month end, PREPAYMENT and DEFAULT (balance of the loans which
+            prepay / default in the month) and RECOVERY
+        loan_balance (pd.DataFrame): expected month end balance of each performing loan
+            (by key), over the scenarios
+    """
+
+    def __init__(
+        self,
+        months: list[datetime.date],
+        flows: dict[str, np.ndarray],
+        loan_balance: pd.DataFrame,
+    ):
+        self.months = months
+        self.flows = flows
+        self.loan_balance = loan_balance
+
+    def scenarios(self, flow: str) -> pd.DataFrame:
+        """Scenarios x months of flow"""
+        return pd.DataFrame(self.flows[flow], columns=self.months)
+
+    def mean(self) -> pd.DataFrame:
+        """Months x FLOWS, averaged over the scenarios"""
+        return pd.DataFrame(
+            {name: self.flows[name].mean(axis=0) for name in FLOWS}, index=self.months
+        )
+
+    def quantile(self, q: float) -> pd.DataFrame:
+        """Months x FLOWS, q quantile over the scenarios of each month"""
+        return pd.DataFrame(
+            {name: np.quantile(self.flows[name], q, axis=0) for name in FLOWS},
+            index=self.months,
+        )
+
+
+def _project_batch(
+    inputs: dict, seed: np.random.SeedSequence, n_scenarios: int
+) -> tuple[dict[str, np.ndarray], np.ndarray]:
+    """Runs in worker processes, see Projection.run
+
+    Returns:
+        tuple: scenarios x months of each of FLOWS, and for each loan the number of
+            scenarios in which it defaults or prepays each month (last column: neither)
+    """
+    balance = inputs["balance"]
+    default_hazard = inputs["default_hazard"]
+    event_hazard = inputs["event_hazard"]
+    n_loans, n_months = event_hazard.shape
+
+    rng = np.random.default_rng(seed)
+    draws = rng.random((n_scenarios, n_loans, n_months), dtype=np.float32)
+    events = draws < event_hazard
+    happened = events.any(axis=2)
+    # month of the default or prepayment, n_months if neither
+    event_month = np.where(happened, events.argmax(axis=2), n_months)
+    del events
+    month = np.minimum(event_month, n_months - 1)
+    draw = np.take_along_axis(draws, month[..., None], axis=2)[..., 0]
+    del draws
+    # the lower end of the draw is a default, the rest of the event a prepayment
+    is_default = happened & (draw < default_hazard[np.arange(n_loans), month])
+
+    amount = np.broadcast_to(balance, (n_scenarios, n_loans))
+    flat_month = (np.arange(n_scenarios)[:, None] * (n_months + 1) + event_month).ravel()
+
+    def by_month(weights: np.ndarray) -> np.ndarray:
+        """Sum of weights per scenario and event month"""
+        sums = np.bincount(flat_month, weights.ravel(), n_scenarios * (n_months + 1))
+        return sums.reshape(n_scenarios, n_months + 1)[:, :n_months]
+
+    defaults = by_month(np.where(is_default, amount, 0.0))
+    prepayments = by_month(np.where(is_default, 0.0, amount))
+    recoveries = np.zeros((n_scenarios, n_months))
+    if inputs["recovery"] is not None:
+        for group, increments in enumerate(inputs["recovery"]):
+            in_group = is_default & (inputs["group"] == group)
+            if not in_group.any():
+                continue
+            group_defaults = by_month(np.where(in_group, amount, 0.0))
+            # recovered k months after the default month
+            for k in np.flatnonzero(increments[:n_months]):
+                recoveries[:, k:] += group_defaults[:, : n_months - k] * increments[k]
+
+    flows = {
+        BALANCE: balance.sum() - np.cumsum(defaults + prepayments, axis=1),
+        PREPAYMENT: prepayments,
+        DEFAULT: defaults,
+        RECOVERY: recoveries,
+    }
+    counts = np.bincount(
+        (np.arange(n_loans) * (n_months + 1) + event_month).ravel(),
+        minlength=n_loans * (n_months + 1),
+    ).reshape(n_loans, n_months + 1)
+    return flows, counts
+
+
+def _curve_table(
+    curve: Curve, pivots: list[str], values: list[tuple], index: str
+) -> np.ndarray:
+    """Groups (values of pivots) x index 0, 1, ... of curve, carrying the last value
+    forward over gaps, 0 before the first one
+    """
+    curves = curve.curves
+    if curves.index.name != index:
+        raise ValueError(
+            f"{type(curve).__name__} is by {curves.index.name}, expected {index}"
+        )
+    columns = [curve_name(pivots, value, curve.alias, index) for value in values]
+    missing = [column for column in columns if column not in curves.columns]
+    if missing:
+        raise ValueError(f"No {type(curve).__name__} curves {missing}")
+
+    table = curves[columns].replace([np.inf, -np.inf], np.nan)
+    table = table[table.index >= 0]
+    table.index = table.index.astype(int)
+    end = int(table.index.max()) + 1 if len(table) else 1
+    return table.reindex(range(end)).ffill().fillna(0).to_numpy(dtype=float).T
+
+
+def _extend(table: np.ndarray, n: int) -> np.ndarray:
+    """First n columns of table, repeating its last column beyond it"""
+    return np.pad(table, ((0, 0), (0, max(0, n - table.shape[1]))), mode="edge")[:, :n]
+
+
+def _increments(cumulative: np.ndarray) -> np.ndarray:
+    """Monthly recovery rates of cumulative recovery curves, never negative"""
+    return np.clip(np.diff(cumulative, axis=1, prepend=0), 0, None)
@@ -0,0 +1,277 @@
+import inspect
+import itertools
+import multiprocessing
+from concurrent.futures import Executor, ProcessPoolExecutor
+from itertools import repeat
+
+import pandas as pd
+
+from .curves import CDR, CPR, Curve, RecoveryCurve, build_all_sums, curves_from_sums
+from .dataset import PortfolioOfOutstandingLoans
+from .metrics import dependents, in_dependency_order
+
+# A scenario is one combination of arguments of add_* methods (eg n_missed of
+# add_default_month) with one index, pivots and filter_gt_0 of the curves.
+# Metrics are computed once for every combination of the arguments they depend on:
+# those which depend on none once for the whole grid, those which depend only on
+# n_missed once per n_missed, and so on. Curves of the same arguments share their sums
+# across indexes and filter_gt_0.
+
+# columns of ScenarioGrid.run besides the varied arguments
+SCENARIO = "scenario"
+INDEX = "index"
+PIVOTS = "pivots"
+FILTER_GT_0 = "filter_gt_0"
+CURVE = "curve"
+GROUP = "group"
+INDEX_VALUE = "index_value"
+VALUE = "value"
+
+
+class ScenarioGrid:
+    """Curves of a portfolio under every combination of parameters
+
+    Args:
+        params (dict[str, dict[str, list]]): add_* method -> argument -> values, eg
+            {"add_default_month": {"n_missed": [3, 6]},
+             "add_is_post_seller_purchase_date": {"dt": [date(2020, 12, 31)]}}
+            Arguments which are not given are those the portfolio was computed with.
+        curves (list[type[Curve]], optional): Defaults to [CPR, CDR, RecoveryCurve].
+        indexes (list[str], optional): x axes. Defaults to ["Seasoning"].
+        pivots (list[list[str]], optional): static columns, each list is one variant.
+            Defaults to [[]].
+        filter_gt_0 (list[bool], optional): Defaults to [True].
+
+    eg
+        grid = ScenarioGrid(
+            {"add_default_month": {"n_missed": [3, 4, 6]}},
+            indexes=["Seasoning", "Time Since Reversion"],
+            pivots=[[], ["product"]],
+        )
+        grid.run(portfolio, n_workers=3)
+    """
+
+    def __init__(
+        self,
+        params: dict[str, dict[str, list]],
+        curves: list[type[Curve]] = [CPR, CDR, RecoveryCurve],
+        indexes: list[str] = ["Seasoning"],
+        pivots: list[list[str]] = [[]],
+        filter_gt_0: list[bool] = [True],
+    ):
+        metrics = []
+        for method in params:
+            add_method = getattr(PortfolioOfOutstandingLoans, method, None)
+            metric = getattr(add_method, "metric", None)
+            if metric is None:
+                raise ValueError(f"{method!r} is not a derived metric of the portfolio")
+            metrics.append(metric)
+
+        # upstream methods first, so that a branch never recomputes what it builds on
+        self.levels = [
+            (
+                metric.method,
+                [
+                    dict(zip(params[metric.method], values))
+                    for values in itertools.product(*params[metric.method].values())
+                ],
+            )
+            for metric in in_dependency_order(metrics)
+        ]
+        self.curves = list(curves)
+        self.indexes = list(indexes)
+        self.pivots = [list(variant) for variant in pivots]
+        self.filter_gt_0 = list(filter_gt_0)
+        # "Data" labels and static columns the curves are built from
+        self.names = list(
+            dict.fromkeys(
+                [
+                    *self.indexes,
+                    *(name for curve in self.curves for name in curve.metrics),
+                ]
+            )
+        )
+
+    def scenarios(self) -> pd.DataFrame:
+        """One row per scenario: its number and what it is made of"""
+        rows = []
+        for options in itertools.product(*(range(len(opts)) for _, opts in self.levels)):
+            for pivots, index, filter_gt_0 in itertools.product(
+                self.pivots, self.indexes, self.filter_gt_0
+            ):
+                rows.append(
+                    {
+                        SCENARIO: len(rows),
+                        **self._arguments(options),
+                        INDEX: index,
+                        PIVOTS: ", ".join(pivots),
+                        FILTER_GT_0: filter_gt_0,
+                    }
+                )
+        return pd.DataFrame(rows)
+
+    def run(
+        self,
+        portfolio: PortfolioOfOutstandingLoans,
+        n_workers: int = 1,
+        executor: Executor | None = None,
+    ) -> pd.DataFrame:
+        """Every curve of every scenario, one row per curve value
+
+        Args:
+            portfolio (PortfolioOfOutstandingLoans): left as it is, scenarios are
+                computed on copies of it
+            n_workers (int, optional): when above 1, the values of the first (most
+                upstream) method run in a process pool of that size unless executor
+                is given. Defaults to 1.
+            executor (Executor, optional): runs them, eg a pool shared by several calls.
+                Defaults to None.
+
+        Returns:
+            pd.DataFrame: SCENARIO, the varied arguments (as "method.argument"), INDEX,
+                PIVOTS, FILTER_GT_0, CURVE (alias), GROUP (column of Curve.curves),
+                INDEX_VALUE and VALUE
+        """
+        with portfolio.profile.stage("ScenarioGrid", portfolio):
+            base = portfolio.copy()
+            # whatever no scenario changes, once for all of them
+            varied = [output for method, _ in self.levels for output in _outputs(method)]
+            affected = _affected(varied, base.metric_params)
+            base.require(*[name for name in self.names if name not in affected])
+
+            if not self.levels:
+                tables = self._leaf(base, ())
+            elif n_workers > 1 or executor is not None:
+                first = range(len(self.levels[0][1]))
+                if executor is None:
+                    # polars' thread pool does not survive a fork
+                    context = multiprocessing.get_context("spawn")
+                    with ProcessPoolExecutor(n_workers, mp_context=context) as executor:
+                        parts = list(
+                            executor.map(_run_option, repeat(self), repeat(base), first)
+                        )
+                else:
+                    parts = list(
+                        executor.map(_run_option, repeat(self), repeat(base), first)
+                    )
+                tables = [table for part in parts for table in part]
+            else:
+                tables = self._branch(base, 0, ())
+
+            res = pd.concat(tables, ignore_index=True)
+            # in the order of scenarios
+            return res.sort_values(SCENARIO, kind="stable", ignore_index=True)
+
+    def _branch(
+        self, portfolio: PortfolioOfOutstandingLoans, level: int, options: tuple
+    ) -> list[pd.DataFrame]:
+        """Tidy curves of every scenario starting with options (value numbers of the
+        first levels), portfolio being computed with them
+        """
+        if level == len(self.levels):
+            return self._leaf(portfolio, options)
+
+        res = []
+        for option in range(len(self.levels[level][1])):
+            res += self._option(portfolio, level, options, option)
+        return res
+
+    def _option(
+        self,
+        portfolio: PortfolioOfOutstandingLoans,
+        level: int,
+        options: tuple,
+        option: int,
+    ) -> list[pd.DataFrame]:
+        """Tidy curves of the scenarios starting with options then option of level"""
+        method, values = self.levels[level]
+        variant = portfolio.copy()
+        add_method = getattr(type(variant), method)
+        signature = inspect.signature(add_method)
+        # the arguments the portfolio was computed with, but the varied ones
+        args, kwargs = variant.metric_params.get(method, ((), {}))
+        arguments = signature.bind(variant, *args, **kwargs).arguments
+        call = signature.bind(**{**arguments, **values[option]})
+        add_method.compute(*call.args, **call.kwargs)
+        # except what the next levels would change again
+        later = [
+            output
+            for method, _ in self.levels[level + 1 :]
+            for output in _outputs(method)
+        ]
+        affected = _affected(later, variant.metric_params)
+        variant.require(*[name for name in self.names if name not in affected])
+        return self._branch(variant, level + 1, (*options, option))
+
+    def _leaf(
+        self, portfolio: PortfolioOfOutstandingLoans, options: tuple
+    ) -> list[pd.DataFrame]:
+        """Tidy curves of the scenarios of options: every pivots, index and filter_gt_0"""
+        portfolio.require(*self.names)
+        # scenarios are numbered in the order of scenarios()
+        scenario = 0
+        for level, option in enumerate(options):
+            scenario = scenario * len(self.levels[level][1]) + option
+        scenario *= len(self.pivots) * len(self.indexes) * len(self.filter_gt_0)
+
+        arguments = self._arguments(options)
+        res = []
+        for pivots in self.pivots:
+            # one reshape for every curve and index
+            sums = build_all_sums(portfolio, self.curves, self.indexes, pivots)
+            for index, filter_gt_0 in itertools.product(self.indexes, self.filter_gt_0):
+                columns = {
+                    SCENARIO: scenario,
+                    **arguments,
+                    INDEX: index,
+                    PIVOTS: ", ".join(pivots),
+                    FILTER_GT_0: filter_gt_0,
+                }
+                for curve in self.curves:
+                    curves = curves_from_sums(
+                        sums[(curve.alias, index)],
+                        index,
+                        pivots,
+                        curve.alias,
+                        filter_gt_0,
+                    )
+                    res.append(_tidy(curves, {**columns, CURVE: curve.alias}))
+                scenario += 1
+        return res
+
+    def _arguments(self, options: tuple) -> dict:
+        """"method.argument" -> value of the varied arguments of options"""
+        return {
+            f"{method}.{name}": value
+            for (method, values), option in zip(self.levels, options)
+            for name, value in values[option].items()
+        }
+
+
+def _outputs(method: str) -> list[str]:
+    return getattr(PortfolioOfOutstandingLoans, method).metric.outputs
+
+
+def _affected(names: list[str], params: dict[str, tuple]) -> set[str]:
+    """names and whatever is computed from them, with params (see metrics.dependents)"""
+    return set(names) | {
+        output for metric in dependents(names, params) for output in metric.outputs
+    }
+
+
+def _tidy(curves: pd.DataFrame, columns: dict) -> pd.DataFrame:
+    """Curve.curves as GROUP, INDEX_VALUE, VALUE rows, after columns of constant values"""
+    values = (
+        curves.rename_axis(index=INDEX_VALUE, columns=GROUP)
+        .stack()
+        .rename(VALUE)
+        .reset_index()
+    )
+    return values.assign(**columns)[[*columns, GROUP, INDEX_VALUE, VALUE]]
+
+
+def _run_option(
+    grid: ScenarioGrid, portfolio: PortfolioOfOutstandingLoans, option: int
+) -> list[pd.DataFrame]:
+    """Runs in worker processes: scenarios of one value of the first level"""
+    return grid._option(portfolio, 0, (), option)
@@ -0,0 +1,567 @@
+import copy
+import datetime
+from abc import ABC, abstractmethod
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import polars as pl
+import pyarrow as pa
+
+from . import profiling
+from .metrics import AMOUNT, FLAG, MONTHS, kind_of
+
+# Name of the month column in long storage
+MONTH = "month"
+
+# Extendable!
+# Amounts CompactStorage keeps as float32. Only balances: payments are compared
+# to each other against a tolerance (see add_default_month), which float32 rounding
+# of amounts in the thousands (about 0.0001 apart) would swamp.
+FLOAT32_AMOUNTS = {"Month End Balance"}
+
+
+# Backing stores for the monthly data of PortfolioOfOutstandingLoans
+# Every store speaks in terms of "wide" frames on the way in and out:
+# one row per (loan, "Data" label) and one datetime.date column per month,
+# which is the layout of the Excel Data tabs.
+# Metrics also go in and out as loans x months float64 matrices (get_values,
+# add_values, update_values), which the polars backed stores read and write
+# without building any pandas frame.
+class MonthlyDataStorage(ABC):
+    def __init__(self, key: str):
+        self.key = key
+
+    @abstractmethod
+    def get(
+        self,
+        data_name: str,
+        months: list[datetime.date] | None = None,
+        loan_ids: np.ndarray | pd.Index | None = None,
+    ) -> pd.DataFrame:
+        """Loans x months frame of a single metric
+
+        Args:
+            months (list[datetime.date], optional): only these. Defaults to all.
+            loan_ids (np.ndarray | pd.Index, optional): one row per loan id, in this order,
+                NaN for loans without data. Defaults to the stored loans, ordered by key.
+        """
+
+    @abstractmethod
+    def get_values(
+        self,
+        data_name: str,
+        months: list[datetime.date] | None = None,
+        loan_ids: np.ndarray | pd.Index | None = None,
+    ) -> np.ndarray:
+        """Same as get, as a float64 matrix"""
+
+    @abstractmethod
+    def get_block(self, data_name: str) -> pd.DataFrame:
+        """Wide rows (key, "Data", months...) of a single metric, ordered by key"""
+
+    @abstractmethod
+    def add(self, data: pd.DataFrame):
+        """Stores wide rows (key, "Data", months...) of one or more metrics"""
+
+    @abstractmethod
+    def add_values(self, data_name: str, values: np.ndarray, loan_ids: pd.Index):
+        """Stores a metric from a loans x months matrix over every stored month,
+        one row per loan id, in this order
+        """
+
+    @abstractmethod
+    def append_month(self, data: pd.DataFrame):
+        """Adds a month after the last one from wide rows (key, "Data", month)
+        of stored metrics, metrics or loans not in data are NaN that month
+        """
+
+    @abstractmethod
+    def update(self, data: pd.DataFrame):
+        """Overwrites stored values with wide rows (key, "Data", months...),
+        every (key, "Data") row and month of data must be stored already
+        """
+
+    @abstractmethod
+    def update_values(self, data_name: str, values: np.ndarray, loan_ids: np.ndarray):
+        """Overwrites every month of a stored metric for loan_ids, one row of values
+        per loan id
+        """
+
+    @abstractmethod
+    def remove(self, data_names: list[str]):
+        pass
+
+    @abstractmethod
+    def subset(self, loan_ids: np.ndarray) -> "MonthlyDataStorage":
+        """Same store with only loan_ids"""
+
+    @abstractmethod
+    def copy(self) -> "MonthlyDataStorage":
+        """Same store, which then changes independently"""
+
+    @abstractmethod
+    def labels(self) -> list[str]:
+        """Names of the stored metrics"""
+
+    @abstractmethod
+    def date_cols(self) -> list[datetime.date]:
+        pass
+
+    @abstractmethod
+    def wide(self) -> pd.DataFrame:
+        """All metrics in the wide layout"""
+
+    @abstractmethod
+    def long(
+        self, data_names: list[str], months: list[datetime.date] | None = None
+    ) -> pl.DataFrame:
+        """Polars frame of (key, month, data_names...), one row per loan per month
+        sorted by (month, key), missing values are null
+
+        Args:
+            months (list[datetime.date], optional): only these. Defaults to all.
+        """
+
+    @abstractmethod
+    def nbytes(self) -> int:
+        """Size of the stored metrics"""
+
+    def __contains__(self, data_name: str) -> bool:
+        return data_name in self.labels()
+
+
+class WideStorage(MonthlyDataStorage):
+    """Original layout: one pandas frame, every metric is a block of rows"""
+
+    def __init__(self, data_df: pd.DataFrame, key: str, grouped: bool = False):
+        super().__init__(key)
+        self.data_df = data_df
+        # are the rows of each loan together, see wide
+        self.grouped = grouped
+
+    def get(
+        self,
+        data_name: str,
+        months: list[datetime.date] | None = None,
+        loan_ids: np.ndarray | pd.Index | None = None,
+    ) -> pd.DataFrame:
+        months = self.date_cols() if months is None else list(months)
+        rows = self.data_df.loc[self.data_df["Data"] == data_name, [self.key, *months]]
+        if loan_ids is None:
+            rows = rows.sort_values(by=self.key, kind="stable")
+        else:
+            rows = rows.set_index(self.key).reindex(loan_ids)
+        return rows[months].reset_index(drop=True)
+
+    def get_values(
+        self,
+        data_name: str,
+        months: list[datetime.date] | None = None,
+        loan_ids: np.ndarray | pd.Index | None = None,
+    ) -> np.ndarray:
+        return self.get(data_name, months, loan_ids).to_numpy(dtype=float)
+
+    def get_block(self, data_name: str) -> pd.DataFrame:
+        rows = self.data_df[self.data_df["Data"] == data_name]
+        return rows.sort_values(by=self.key, kind="stable").reset_index(drop=True)
+
+    def add(self, data: pd.DataFrame):
+        # replace, rather than duplicate, metrics which are already there
+        self.remove(data["Data"].unique().tolist())
+        # rows are looked up by key, they are only grouped by loan again by wide
+        self.data_df = pd.concat((self.data_df, data), axis=0, ignore_index=True)
+        self.grouped = False
+
+    def add_values(self, data_name: str, values: np.ndarray, loan_ids: pd.Index):
+        self.add(self._rows(data_name, values, loan_ids))
+
+    def append_month(self, data: pd.DataFrame):
+        (month,) = _date_cols(data)
+        months = self.date_cols()
+        if months and month <= months[-1]:
+            raise ValueError(f"{month} is not after the last month {months[-1]}")
+
+        values = np.full(len(self.data_df), np.nan)
+        values[self._positions(data)] = data[month].to_numpy(dtype=float)
+        # shallow: never write into a frame we were given
+        self.data_df = self.data_df.copy(deep=False)
+        self.data_df[month] = values
+
+    def update(self, data: pd.DataFrame):
+        months = _date_cols(data)
+        if data.empty or not months:
+            return
+        rows = self._positions(data)
+        cols = self.data_df.columns.get_indexer(months)
+        if (cols < 0).any():
+            raise ValueError("Can only update stored months")
+
+        self.data_df.iloc[rows, cols] = data[months].to_numpy(dtype=float)
+
+    def update_values(self, data_name: str, values: np.ndarray, loan_ids: np.ndarray):
+        self.update(self._rows(data_name, values, loan_ids))
+
+    def _rows(self, data_name: str, values: np.ndarray, loan_ids) -> pd.DataFrame:
+        """Wide rows of values over every month, one per loan id"""
+        rows = pd.DataFrame(values, columns=self.date_cols())
+        rows.insert(0, "Data", data_name)
+        rows.insert(0, self.key, np.asarray(loan_ids))
+        return rows
+
+    def _positions(self, data: pd.DataFrame) -> np.ndarray:
+        """Row number of each (key, "Data") row of data in data_df"""
+        stored = pd.MultiIndex.from_frame(self.data_df[[self.key, "Data"]])
+        rows = stored.get_indexer(pd.MultiIndex.from_frame(data[[self.key, "Data"]]))
+        if (rows < 0).any():
+            raise ValueError("Can only write (loan, Data) rows which are stored")
+        return rows
+
+    def remove(self, data_names: list[str]):
+        if data_names:
+            self.data_df = self.data_df[~self.data_df["Data"].isin(data_names)]
+
+    def subset(self, loan_ids: np.ndarray) -> "WideStorage":
+        return WideStorage(
+            self.data_df[self.data_df[self.key].isin(loan_ids)], self.key, self.grouped
+        )
+
+    def copy(self) -> "WideStorage":
+        # copy on write: values are only copied if either changes them
+        return WideStorage(self.data_df.copy(deep=False), self.key, self.grouped)
+
+    def labels(self) -> list[str]:
+        return self.data_df["Data"].unique().tolist()
+
+    def date_cols(self) -> list[datetime.date]:
+        return _date_cols(self.data_df)
+
+    def wide(self) -> pd.DataFrame:
+        # rows of each loan together, its labels in the order they were added
+        if not self.grouped:
+            self.data_df = self.data_df.sort_values(
+                by=self.key, kind="stable", ignore_index=True
+            )
+            self.grouped = True
+        return self.data_df
+
+    def nbytes(self) -> int:
+        return int(
+            self.data_df[self.date_cols()].memory_usage(index=False, deep=True).sum()
+        )
+
+    def long(
+        self, data_names: list[str], months: list[datetime.date] | None = None
+    ) -> pl.DataFrame:
+        loan_ids = np.sort(self.data_df[self.key].unique())
+        months = self.date_cols() if months is None else list(months)
+
+        profiling.count_conversion()
+        columns = []
+        for data_name in data_names:
+            # align rows, a loan might not have every metric
+            block = self.get_block(data_name).set_index(self.key).reindex(loan_ids)
+            values = block[months].to_numpy(dtype=float)
+            columns.append(pl.Series(data_name, values.T.ravel(), nan_to_null=True))
+        return _grid(self.key, loan_ids, months).with_columns(columns)
+
+
+class LongStorage(MonthlyDataStorage):
+    """Tidy polars table keyed by (key, month), one typed column per metric.
+
+    Rows are kept sorted by (month, key) over the full loans x months grid,
+    so a metric is just a column: looking it up is a column selection, adding
+    one is a column append and adding a month is appending rows - no concat, no re-sort.
+
+    Columns are typed by the kind of their metric (see pola.metrics.kind_of): flags are
+    bit-packed booleans and month counts int16, missing values null. Values go in and
+    come out as float64, so this is invisible outside the store.
+
+    The table can be written to an Arrow IPC file and memory-mapped back (see write_ipc
+    and read_ipc), any number of processes then share the same pages. A mapped store
+    pickles as its file, changing it only changes the in-process copy.
+    """
+
+    # polars type of each kind of metric
+    dtypes = {AMOUNT: pl.Float64, FLAG: pl.Boolean, MONTHS: pl.Int16}
+
+    def __init__(self, data_df: pd.DataFrame, key: str):
+        super().__init__(key)
+        months = _date_cols(data_df)
+
+        self.months = months
+        # position of each loan in a month of the table
+        self.loan_index = pd.Index(np.sort(data_df[key].unique()))
+        self.panel = _grid(key, self.loan_ids, months)
+        self.add(data_df)
+
+    @property
+    def loan_ids(self) -> np.ndarray:
+        return self.loan_index.to_numpy()
+
+    @property
+    def panel(self) -> pl.DataFrame:
+        return self._panel
+
+    @panel.setter
+    def panel(self, panel: pl.DataFrame):
+        self._panel = panel
+        # no longer what is in the file, if it was mapped
+        self.path = None
+
+    def write_ipc(self, path: str | Path):
+        """Writes the table as an uncompressed, single chunk Arrow IPC file, see read_ipc"""
+        path = Path(path)
+        # write then rename, so that a half written file is never mapped
+        tmp = path.with_name(path.name + ".tmp")
+        self.panel.rechunk().write_ipc(tmp, compression="uncompressed")
+        tmp.replace(path)
+
+    @classmethod
+    def read_ipc(cls, path: str | Path, key: str) -> "LongStorage":
+        """Store memory-mapping a file written by write_ipc, without copying it"""
+        res = cls.__new__(cls)
+        MonthlyDataStorage.__init__(res, key)
+        res.panel = _map_ipc(path)
+        res.path = Path(path)
+        res.months = res.panel[MONTH].unique(maintain_order=True).to_list()
+        n_loans = len(res.panel) // len(res.months) if res.months else 0
+        res.loan_index = pd.Index(res.panel[key].head(n_loans).to_numpy())
+        return res
+
+    def __getstate__(self) -> dict:
+        state = dict(self.__dict__)
+        if self.path is not None:
+            # mapped again by whoever unpickles it
+            del state["_panel"]
+        return state
+
+    def __setstate__(self, state: dict):
+        self.__dict__.update(state)
+        if "_panel" not in state:
+            self._panel = _map_ipc(self.path)
+
+    def get(
+        self,
+        data_name: str,
+        months: list[datetime.date] | None = None,
+        loan_ids: np.ndarray | pd.Index | None = None,
+    ) -> pd.DataFrame:
+        profiling.count_conversion()
+        months = self.months if months is None else list(months)
+        return pd.DataFrame(self.get_values(data_name, months, loan_ids), columns=months)
+
+    def get_values(
+        self,
+        data_name: str,
+        months: list[datetime.date] | None = None,
+        loan_ids: np.ndarray | pd.Index | None = None,
+    ) -> np.ndarray:
+        column = self.panel[data_name].cast(pl.Float64)
+        n_loans = len(self.loan_ids)
+        if months is None:
+            months = self.months
+            values = column.to_numpy()
+        else:
+            months = list(months)
+            # every month is a contiguous slice
+            values = np.concatenate(
+                [np.empty(0)]
+                + [
+                    column.slice(i * n_loans, n_loans).to_numpy()
+                    for i in self._month_positions(months)
+                ]
+            )
+        values = values.reshape(len(months), n_loans).T
+        if loan_ids is not None and not self.loan_index.equals(pd.Index(loan_ids)):
+            rows = self.loan_index.get_indexer(loan_ids)
+            values = np.where((rows >= 0)[:, None], values[rows], np.nan)
+        return values
+
+    def get_block(self, data_name: str) -> pd.DataFrame:
+        block = self.get(data_name)
+        block.insert(0, "Data", data_name)
+        block.insert(0, self.key, self.loan_ids)
+        return block
+
+    def add(self, data: pd.DataFrame):
+        profiling.count_conversion()
+        new_columns = []
+        for data_name, rows in data.groupby("Data", sort=False):
+            # align rows to the stored loan order
+            rows = rows.set_index(self.key).reindex(self.loan_index)
+            values = rows[self.months].to_numpy(dtype=float)
+            new_columns.append(self._column(data_name, values.T.ravel()))
+        self.panel = self.panel.with_columns(new_columns)
+
+    def add_values(self, data_name: str, values: np.ndarray, loan_ids: pd.Index):
+        if not self.loan_index.equals(loan_ids):
+            # align rows to the stored loan order
+            rows = pd.Index(loan_ids).get_indexer(self.loan_index)
+            values = np.where((rows >= 0)[:, None], values[rows], np.nan)
+        self.panel = self.panel.with_columns(
+            self._column(data_name, np.asarray(values, dtype=float).T.ravel())
+        )
+
+    def append_month(self, data: pd.DataFrame):
+        (month,) = _date_cols(data)
+        if self.months and month <= self.months[-1]:
+            raise ValueError(f"{month} is not after the last month {self.months[-1]}")
+        unknown = set(data["Data"]) - set(self.labels())
+        if unknown:
+            raise ValueError(f"Can only append stored metrics, not {sorted(unknown)}")
+
+        profiling.count_conversion()
+        values = {
+            data_name: rows.set_index(self.key)[month]
+            .reindex(self.loan_index)
+            .to_numpy(dtype=float)
+            for data_name, rows in data.groupby("Data", sort=False)
+        }
+        nan = np.full(len(self.loan_ids), np.nan)
+        rows = _grid(self.key, self.loan_ids, [month]).with_columns(
+            self._column(data_name, values.get(data_name, nan))
+            for data_name in self.labels()
+        )
+        self.panel = pl.concat([self.panel, rows])
+        self.months = [*self.months, month]
+
+    def update(self, data: pd.DataFrame):
+        months = _date_cols(data)
+        if data.empty or not months:
+            return
+        month_pos = self._month_positions(months)
+        n_loans = len(self.loan_ids)
+
+        profiling.count_conversion()
+        columns = []
+        for data_name, rows in data.groupby("Data", sort=False):
+            loan_pos = self.loan_index.get_indexer(rows[self.key])
+            if (loan_pos < 0).any():
+                raise ValueError("Can only write (loan, Data) rows which are stored")
+            positions = month_pos[None, :] * n_loans + loan_pos[:, None]
+            values = rows[months].to_numpy(dtype=float).ravel()
+            columns.append(
+                self.panel[data_name].scatter(
+                    positions.ravel(), self._column(data_name, values)
+                )
+            )
+        self.panel = self.panel.with_columns(columns)
+
+    def update_values(self, data_name: str, values: np.ndarray, loan_ids: np.ndarray):
+        if not len(loan_ids) or not self.months:
+            return
+        loan_pos = self.loan_index.get_indexer(loan_ids)
+        if (loan_pos < 0).any():
+            raise ValueError("Can only write (loan, Data) rows which are stored")
+        month_pos = np.arange(len(self.months))
+        positions = month_pos[None, :] * len(self.loan_ids) + loan_pos[:, None]
+        values = np.asarray(values, dtype=float).ravel()
+        self.panel = self.panel.with_columns(
+            self.panel[data_name].scatter(
+                positions.ravel(), self._column(data_name, values)
+            )
+        )
+
+    def _column(self, data_name: str, values: np.ndarray) -> pl.Series:
+        """values (float) as a column of the type of data_name"""
+        dtype = self._dtype(data_name)
+        if dtype.is_float():
+            return pl.Series(data_name, values, dtype=dtype)
+        return pl.Series(data_name, values, nan_to_null=True).cast(dtype)
+
+    def _dtype(self, data_name: str) -> pl.DataType:
+        return self.dtypes[kind_of(data_name)]
+
+    def _month_positions(self, months: list[datetime.date]) -> np.ndarray:
+        positions = pd.Index(self.months).get_indexer(months)
+        if (positions < 0).any():
+            raise KeyError(f"Months not stored: {np.asarray(months)[positions < 0]}")
+        return positions
+
+    def remove(self, data_names: list[str]):
+        self.panel = self.panel.drop(data_names)
+
+    def subset(self, loan_ids: np.ndarray) -> "LongStorage":
+        res = copy.copy(self)
+        res.loan_index = self.loan_index[self.loan_index.isin(loan_ids)]
+        res.panel = self.panel.filter(pl.col(self.key).is_in(res.loan_ids))
+        return res
+
+    def copy(self) -> "LongStorage":
+        # polars frames never change, every change replaces the panel
+        return copy.copy(self)
+
+    def labels(self) -> list[str]:
+        return [col for col in self.panel.columns if col not in (self.key, MONTH)]
+
+    def date_cols(self) -> list[datetime.date]:
+        return list(self.months)
+
+    def wide(self) -> pd.DataFrame:
+        blocks = [self.get_block(data_name) for data_name in self.labels()]
+        data_df = pd.concat(blocks, axis=0, ignore_index=True)
+        return data_df.sort_values(by=self.key, kind="stable", ignore_index=True)
+
+    def long(
+        self, data_names: list[str], months: list[datetime.date] | None = None
+    ) -> pl.DataFrame:
+        panel = self.panel
+        if months is not None:
+            n_loans = len(self.loan_ids)
+            panel = pl.concat(
+                [panel.clear()]
+                + [
+                    panel.slice(i * n_loans, n_loans)
+                    for i in self._month_positions(list(months))
+                ]
+            )
+        return panel.select(
+            self.key, MONTH, pl.col(data_names).cast(pl.Float64).fill_nan(None)
+        )
+
+    def nbytes(self) -> int:
+        return self.panel.select(self.labels()).estimated_size()
+
+
+class CompactStorage(LongStorage):
+    """LongStorage with the amounts of FLOAT32_AMOUNTS (balances) as float32, half the
+    size of float64 but only about 7 significant digits. Other amounts stay float64.
+    """
+
+    def _dtype(self, data_name: str) -> pl.DataType:
+        if data_name in FLOAT32_AMOUNTS:
+            return pl.Float32
+        return super()._dtype(data_name)
+
+
+def _date_cols(df: pd.DataFrame) -> list[datetime.date]:
+    return [col for col in df.columns if isinstance(col, datetime.date)]
+
+
+def _map_ipc(path: Path) -> pl.DataFrame:
+    """Frame over the buffers of an uncompressed Arrow IPC file, not a copy of them"""
+    with pa.memory_map(str(path)) as source:
+        table = pa.ipc.open_file(source).read_all()
+    return pl.from_arrow(table, rechunk=False)
+
+
+def _grid(key: str, loan_ids: np.ndarray, months: list[datetime.date]) -> pl.DataFrame:
+    """(key, month) of every loan and month, sorted by (month, key)"""
+    return pl.DataFrame(
+        {
+            key: np.tile(loan_ids, len(months)),
+            MONTH: np.repeat(np.array(months, dtype="datetime64[D]"), len(loan_ids)),
+        }
+    )
+
+
+STORAGES = {"wide": WideStorage, "long": LongStorage, "compact": CompactStorage}
+
+
+def make_storage(storage: str, data_df: pd.DataFrame, key: str) -> MonthlyDataStorage:
+    if storage not in STORAGES:
+        raise ValueError(
+            f"Unknown storage {storage!r}, expected one of {list(STORAGES)}"
+        )
+    return STORAGES[storage](data_df, key)
@@ -0,0 +1,198 @@
+import datetime
+
+import numpy as np
+import pandas as pd
+
+from .dataset import PortfolioOfOutstandingLoans
+from .tabs import (
+    MonthEndBalanceTabInfo,
+    PaymentDueTabInfo,
+    PaymentMadeTabInfo,
+    StaticTabInfo,
+)
+
+# Synthetic portfolios in the layout of the case study workbook, eg for benchmarks:
+# interest only mortgages which pay interest every month until they either repay in full
+# (prepayment) or stop paying (default), in which case a recovery comes some months later.
+
+STATIC_TAB = StaticTabInfo("DATA-Static")
+DATA_TABS = [
+    MonthEndBalanceTabInfo("DATA-Month End Balances"),
+    PaymentDueTabInfo("DATA-Payment Due"),
+    PaymentMadeTabInfo("DATA-Payment Made"),
+]
+
+# product -> margin over BASE_RATE after reversion, other products get DEFAULT_MARGIN
+MARGINS = {1: 0.0375, 2: 0.02}
+DEFAULT_MARGIN = 0.03
+BASE_RATE = 0.04
+SELLER_PURCHASE_DATE = datetime.date(2020, 12, 31)
+
+# loans generated at a time, bounds the size of temporary loans x months matrices
+CHUNK_SIZE = 100_000
+
+
+def generate(
+    n_loans: int = 1_000,
+    n_months: int = 84,
+    start: datetime.date = datetime.date(2016, 1, 31),
+    default_rate: float = 0.02,
+    prepayment_rate: float = 0.10,
+    product_mix: dict[int, float] = {1: 0.75, 2: 0.25},
+    fixed_months: int = 24,
+    seed: int = 0,
+) -> tuple[pd.DataFrame, dict[str, pd.DataFrame]]:
+    """Static data and data tabs of a random portfolio, as read from the Excel tabs
+    (see STATIC_TAB and DATA_TABS)
+
+    Args:
+        n_loans (int, optional): loan_id runs from 1 to n_loans. Defaults to 1_000.
+        n_months (int, optional): month ends from start. Defaults to 84.
+        default_rate (float, optional): annual probability that a performing loan
+            stops paying. Defaults to 0.02.
+        prepayment_rate (float, optional): annual probability that a performing loan
+            repays in full (CPR). Defaults to 0.10.
+        product_mix (dict[int, float], optional): product -> weight. Defaults to 75% of 1
+            and 25% of 2.
+        fixed_months (int, optional): months from origination to reversion. Defaults to 24.
+        seed (int, optional): same seed, same portfolio. Defaults to 0.
+
+    Returns:
+        tuple: static data and {tab_name: tab} of each data tab
+    """
+    rng = np.random.default_rng(seed)
+    months = pd.date_range(start, periods=n_months, freq="ME")
+
+    products = np.array(list(product_mix))
+    weights = np.array(list(product_mix.values()), dtype=float)
+    loans = pd.DataFrame(
+        {
+            "loan_id": np.arange(1, n_loans + 1),
+            "origination": rng.integers(0, n_months, n_loans),
+            "original_balance": rng.integers(50_000, 250_000, n_loans),
+            "product": rng.choice(products, n_loans, p=weights / weights.sum()),
+            "pre_reversion_fixed_rate": rng.uniform(0.017, 0.079, n_loans),
+            # months after origination of the first missed payment and the prepayment
+            "default": _months_to_event(rng, default_rate, n_loans),
+            "prepayment": _months_to_event(rng, prepayment_rate, n_loans),
+            "recovery_lag": rng.integers(6, 13, n_loans),
+            "recovery_rate": rng.uniform(0.6, 1.0, n_loans),
+        }
+    )
+    loans["reversion"] = loans["origination"] + fixed_months
+    loans["post_reversion_boe_margin"] = (
+        loans["product"].map(MARGINS).fillna(DEFAULT_MARGIN).to_numpy()
+    )
+
+    static_df = pd.DataFrame(
+        {
+            "loan_id": loans["loan_id"],
+            "origination_date": _month_ends(start, loans["origination"]),
+            "investor_1_acquisition_date": np.maximum(
+                _month_ends(start, loans["origination"]),
+                np.datetime64(SELLER_PURCHASE_DATE, "us"),
+            ),
+            "reversion_date": _month_ends(start, loans["reversion"]),
+            "original_balance": loans["original_balance"],
+            "product": loans["product"],
+            "pre_reversion_fixed_rate": loans["pre_reversion_fixed_rate"],
+            "post_reversion_boe_margin": loans["post_reversion_boe_margin"],
+        }
+    )
+
+    chunks = [
+        _monthly(loans.iloc[first : first + CHUNK_SIZE], n_months)
+        for first in range(0, n_loans, CHUNK_SIZE)
+    ]
+    tabs = {}
+    for i, tab in enumerate(DATA_TABS):
+        values = np.concatenate([np.empty((0, n_months))] + [c[i] for c in chunks])
+        df = pd.DataFrame(values, columns=months)
+        df.insert(0, "loan_id", loans["loan_id"].to_numpy())
+        tabs[tab.tab_name] = df
+    return static_df, tabs
+
+
+def portfolio(
+    static_df: pd.DataFrame, tabs: dict[str, pd.DataFrame], storage: str = "wide"
+) -> PortfolioOfOutstandingLoans:
+    """Portfolio of generated data, as PortfolioOfOutstandingLoans.from_excel would read it"""
+    data_df = PortfolioOfOutstandingLoans._concat_data_tabs(
+        [tabs[tab.tab_name] for tab in DATA_TABS],
+        [tab.long_name for tab in DATA_TABS],
+        "loan_id",
+    )
+    return PortfolioOfOutstandingLoans(data_df, static_df, "loan_id", storage=storage)
+
+
+def to_excel(path: str, static_df: pd.DataFrame, tabs: dict[str, pd.DataFrame]):
+    """Writes generated data as a workbook which from_excel reads with STATIC_TAB and DATA_TABS"""
+    with pd.ExcelWriter(path) as writer:
+        # below a title, right of an empty column, as skipped by StaticTabInfo
+        static_df.to_excel(
+            writer,
+            sheet_name=STATIC_TAB.tab_name,
+            startrow=STATIC_TAB.skip_rows,
+            startcol=STATIC_TAB.skip_columns,
+            index=False,
+        )
+        writer.sheets[STATIC_TAB.tab_name].cell(row=2, column=2, value="Static Data")
+        for tab_name, df in tabs.items():
+            df.to_excel(writer, sheet_name=tab_name, index=False)
+
+
+def _months_to_event(rng: np.random.Generator, annual_rate: float, n: int) -> np.ndarray:
+    """Months until an event of annual_rate probability, int max if it never happens"""
+    if annual_rate <= 0:
+        return np.full(n, np.iinfo(np.int64).max // 2)
+    monthly = 1 - (1 - annual_rate) ** (1 / 12)
+    return rng.geometric(monthly, n)
+
+
+def _month_ends(start: datetime.date, index: pd.Series) -> np.ndarray:
+    """index-th month end from start, as datetime64[us]"""
+    first = np.datetime64(start, "M")
+    month_starts = (first + index.to_numpy() + 1).astype("datetime64[D]")
+    return (month_starts - np.timedelta64(1, "D")).astype("datetime64[us]")
+
+
+def _monthly(loans: pd.DataFrame, n_months: int) -> list[np.ndarray]:
+    """Month End Balance, Payment Due and Payment Made of loans, each loans x months"""
+    t = np.arange(n_months)[None, :]
+
+    def col(name):
+        return loans[name].to_numpy()[:, None]
+
+    origination = col("origination")
+    balance = col("original_balance").astype(float)
+    defaults = col("default") < col("prepayment")
+    # month of the first missed payment or of the repayment
+    event = origination + np.where(defaults, col("default"), col("prepayment"))
+    recovery = np.where(defaults, event + col("recovery_lag"), np.iinfo(np.int64).max)
+
+    rate = np.where(
+        t < col("reversion"),
+        col("pre_reversion_fixed_rate"),
+        BASE_RATE + col("post_reversion_boe_margin"),
+    )
+    interest = balance * rate / 12
+
+    started = t >= origination
+    paying = (t > origination) & (t <= event)
+    repaid = ~defaults & (t >= event)
+
+    month_end_balance = np.where(
+        started, np.where(repaid | (t >= recovery), 0.0, balance), np.nan
+    )
+    payment_due = np.where(
+        paying | (defaults & (t > origination) & (t < recovery)), interest, np.nan
+    )
+    payment_due = np.where(defaults & (t >= recovery), 0.0, payment_due)
+
+    payment_made = np.where(paying, interest, np.nan)
+    payment_made = np.where(repaid & (t == event), interest + balance, payment_made)
+    payment_made = np.where(defaults & (t >= event), 0.0, payment_made)
+    payment_made = np.where(
+        defaults & (t == recovery), balance * col("recovery_rate"), payment_made
+    )
+    return [month_end_balance, payment_due, payment_made]
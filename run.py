@@ -63,7 +63,7 @@ print(loans_data.add_time_since_reversion().head(15))
 # Post Default Recoveries, Date of Default and Date of last Recovery Payment
 print(loans_data.static_df.head(15))
 
-# And BalanceAtDefault, useful for Recovery curves
+# And BalanceAtDefault (static data), useful for Recovery curves
 print(loans_data.add_exposure_at_default().head(15))
 
 # And Recovery Percent
@@ -88,7 +88,8 @@ print(loans_data.add_time_since_default().head(15))
 # and have different uses. That's why we provide
 # pola.curves.Curve as an abstract class which takes care of distribution
 # of pivots and other common tasks
-# But each (new) curve MUST implement build_from_portfolio (in the future this method should take **kwargs as arg to allow for maximum flexibility)
+# But each (new) curve MUST declare its numerator and denominator as polars expressions over "Data" labels
+# (or override components, the index, numerator and denominator of each loan month)
 # Curves can override __init__ and other methods depending on the usecase, data etc
 
 
@@ -0,0 +1,41 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from pola import synthetic
+from pola.metrics import METRICS
+
+STORAGES = ["wide", "long", "compact"]
+
+
+@pytest.fixture(scope="session")
+def generated():
+    """Static data and data tabs of a small portfolio with plenty of defaults"""
+    return synthetic.generate(300, 48, default_rate=0.15, prepayment_rate=0.15, seed=1)
+
+
+@pytest.fixture
+def make_portfolio(generated):
+    """Fresh portfolio of the generated data in the given storage"""
+    static_df, tabs = generated
+
+    def make(storage="wide"):
+        return synthetic.portfolio(static_df.copy(), tabs, storage)
+
+    return make
+
+
+def enrich(portfolio):
+    """Every derived metric, some with non default arguments"""
+    portfolio.add_default_month(n_missed=2)
+    portfolio.add_prepayment_date(n_zero_months=2)
+    portfolio.require(*METRICS)
+    return portfolio
+
+
+def assert_same_curves(actual: pd.DataFrame, expected: pd.DataFrame):
+    assert list(actual.columns) == list(expected.columns)
+    np.testing.assert_allclose(actual.index.to_numpy(float), expected.index.to_numpy(float))
+    np.testing.assert_allclose(
+        actual.to_numpy(float), expected.to_numpy(float), rtol=1e-9, equal_nan=True
+    )
@@ -0,0 +1,79 @@
+import numpy as np
+import pandas as pd
+import pytest
+from conftest import STORAGES, assert_same_curves, enrich
+
+from pola import PortfolioOfOutstandingLoans
+from pola.curves import CDR, CPR, CurveAccumulator, RecoveryCurve
+
+# months appended one at a time, after building the rest from scratch
+N_APPENDED = 12
+
+CURVES = [
+    (CPR, "Seasoning", ["product"], True),
+    (CDR, "Time Since Reversion", ["product"], False),
+    (RecoveryCurve, "Time Since Default", [], True),
+    (CDR, "Seasoning", [], True),
+]
+
+
+def appended(full: PortfolioOfOutstandingLoans, storage: str):
+    """full built from its first months, then its last N_APPENDED months appended,
+    with accumulators of CURVES kept up to date along the way
+    """
+    data_df = full.data_df
+    months = full.get_date_cols()
+    portfolio = enrich(
+        PortfolioOfOutstandingLoans(
+            data_df.drop(columns=months[-N_APPENDED:]),
+            full.static_df.copy(),
+            full.key,
+            storage=storage,
+        )
+    )
+    accumulators = [CurveAccumulator(*spec) for spec in CURVES]
+    for acc in accumulators:
+        acc.add(portfolio)
+
+    for month in months[-N_APPENDED:]:
+        rewritten = portfolio.append_month(data_df[[full.key, "Data", month]])
+        for acc in accumulators:
+            acc.add_month(portfolio, rewritten)
+    return portfolio, accumulators
+
+
+@pytest.mark.parametrize("storage", STORAGES)
+def test_append_month_same_as_from_scratch(make_portfolio, storage):
+    expected = enrich(make_portfolio(storage))
+    portfolio, accumulators = appended(make_portfolio(storage), storage)
+
+    assert portfolio.get_date_cols() == expected.get_date_cols()
+    assert sorted(portfolio.storage.labels()) == sorted(expected.storage.labels())
+    for data_name in expected.storage.labels():
+        np.testing.assert_allclose(
+            portfolio.get_values(data_name),
+            expected.get_values(data_name),
+            rtol=1e-12,
+            equal_nan=True,
+            err_msg=data_name,
+        )
+    pd.testing.assert_frame_equal(
+        portfolio.static_df[expected.static_df.columns],
+        expected.static_df,
+        check_dtype=False,
+    )
+
+    for (curve, index, pivots, filter_gt_0), acc in zip(CURVES, accumulators):
+        curves = curve(expected, index=index, pivots=pivots, filter_gt_0=filter_gt_0)
+        assert_same_curves(acc.curves, curves.curves)
+        assert_same_curves(
+            curve(portfolio, index=index, pivots=pivots, filter_gt_0=filter_gt_0).curves,
+            curves.curves,
+        )
+
+
+def test_append_month_rejects_past_months(make_portfolio):
+    portfolio = make_portfolio()
+    month = portfolio.get_date_cols()[-1]
+    with pytest.raises(ValueError, match="is not after the last month"):
+        portfolio.append_month(portfolio.data_df[[portfolio.key, "Data", month]])
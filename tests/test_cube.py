@@ -0,0 +1,47 @@
+import pytest
+from conftest import assert_same_curves
+
+from pola.cube import CurveCube
+from pola.curves import CDR, CPR, RecoveryCurve
+
+
+@pytest.fixture
+def portfolio_and_cube(make_portfolio):
+    portfolio = make_portfolio("long")
+    cube = CurveCube.build(
+        portfolio,
+        ["vintage_year", "product"],
+        indexes=["Seasoning", "Time Since Default"],
+    )
+    return portfolio, cube
+
+
+def test_roll_ups_same_as_curves(portfolio_and_cube):
+    portfolio, cube = portfolio_and_cube
+    assert_same_curves(cube.curves(CPR), CPR(portfolio).curves)
+    assert_same_curves(
+        cube.curves(CDR, by=["product"]), CDR(portfolio, pivots=["product"]).curves
+    )
+    assert_same_curves(
+        cube.curves(RecoveryCurve, "Time Since Default", by=["product"]),
+        RecoveryCurve(portfolio, index="Time Since Default", pivots=["product"]).curves,
+    )
+
+
+def test_drill_down_same_as_subset(portfolio_and_cube):
+    portfolio, cube = portfolio_and_cube
+    static_df = portfolio.static_df
+    loan_ids = static_df.loc[static_df["origination_date"].dt.year == 2017, "loan_id"]
+    assert_same_curves(
+        cube.curves(CDR, by=["product"], where={"vintage_year": [2017]}),
+        CDR(portfolio.subset(loan_ids.to_numpy()), pivots=["product"]).curves,
+    )
+
+
+def test_save_and_load(portfolio_and_cube, tmp_path):
+    _, cube = portfolio_and_cube
+    path = tmp_path / "cube.parquet"
+    cube.save(path)
+    res = CurveCube.load(path)
+    assert res.cube.equals(cube.cube)
+    assert res.curve_types == cube.curve_types
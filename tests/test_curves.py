@@ -0,0 +1,158 @@
+import polars as pl
+import pytest
+from conftest import assert_same_curves, enrich
+
+from pola import ChunkedPortfolio
+from pola.curves import (
+    CDR,
+    CPR,
+    Curve,
+    CurveAccumulator,
+    RecoveryCurve,
+    build_all,
+    curve_components,
+    groupby_and_ratio,
+)
+
+INDEXES = ["Seasoning", "Time Since Reversion", "Time Since Default"]
+
+
+def test_curve_names(make_portfolio):
+    portfolio = make_portfolio()
+    assert list(CPR(portfolio).curves.columns) == ["CPR"]
+    assert list(CPR(portfolio, pivots=["product"]).curves.columns) == [
+        "product_1 CPR per Seasoning",
+        "product_2 CPR per Seasoning",
+    ]
+
+
+@pytest.mark.parametrize("storage", ["wide", "long"])
+def test_build_all_same_as_each_curve(make_portfolio, storage):
+    portfolio = make_portfolio(storage)
+    res = build_all(
+        portfolio, [CPR, CDR, RecoveryCurve], INDEXES, ["product"], filter_gt_0=False
+    )
+    for curve in [CPR, CDR, RecoveryCurve]:
+        for index in INDEXES:
+            expected = curve(portfolio, index=index, pivots=["product"], filter_gt_0=False)
+            assert_same_curves(res[(curve.alias, index)], expected.curves)
+
+
+@pytest.mark.parametrize("fmt", ["parquet", "ipc", "csv"])
+def test_chunked_same_as_in_memory(make_portfolio, tmp_path, fmt):
+    portfolio = make_portfolio()
+    portfolio.to_files(tmp_path, fmt, chunk_size=70)
+    chunked = ChunkedPortfolio(
+        tmp_path,
+        fmt,
+        chunk_size=70,
+        prepare=lambda chunk: chunk.add_default_month(n_missed=2),
+    )
+    portfolio.add_default_month(n_missed=2)
+    for curve, index in [(CPR, "Seasoning"), (RecoveryCurve, "Time Since Default")]:
+        assert_same_curves(
+            curve(chunked, index=index, pivots=["product"]).curves,
+            curve(portfolio, index=index, pivots=["product"]).curves,
+        )
+
+
+class Paid(Curve):
+    alias = "Paid"
+    numerator = pl.col("Payment Made")
+    denominator = pl.col("Month End Balance")
+
+
+def test_bases_declare_nothing(make_portfolio):
+    class Base(Curve):
+        """Curves of balances"""
+
+        denominator = pl.col("Month End Balance")
+
+    class Made(Base):
+        alias = "Made"
+        numerator = pl.col("Payment Made")
+
+    assert Made.metrics == ["Payment Made", "Month End Balance"]
+    portfolio = make_portfolio()
+    expected = Paid(portfolio).curves.rename(columns={"Paid": "Made"})
+    assert_same_curves(Made(portfolio).curves, expected)
+    with pytest.raises(TypeError, match="must declare numerator and denominator"):
+        Base(portfolio)
+
+
+@pytest.mark.parametrize("pivots", [[], ["product"]])
+def test_legacy_build_from_portfolio(make_portfolio, pivots):
+    with pytest.warns(DeprecationWarning, match="build_from_portfolio is deprecated"):
+
+        class Legacy(Curve):
+            alias = "Paid"
+
+            def build_from_portfolio(
+                self, data_df, cashflow_columns, index="Seasoning", filter_gt_0=True
+            ):
+                rows = data_df.sort_values("loan_id")
+
+                def values(data_name):
+                    block = rows.loc[rows["Data"] == data_name, cashflow_columns]
+                    return block.to_numpy(float).ravel()
+
+                df = pl.DataFrame(
+                    {
+                        index: values(index),
+                        "made": values("Payment Made"),
+                        "balance": values("Month End Balance"),
+                    },
+                    nan_to_null=True,
+                )
+                return groupby_and_ratio(
+                    df, index, "made", "balance", self.alias, filter_gt_0
+                )
+
+    portfolio = make_portfolio()
+    portfolio.add_seasoning()
+    assert_same_curves(
+        Legacy(portfolio, pivots=pivots).curves, Paid(portfolio, pivots=pivots).curves
+    )
+
+
+def test_python_expressions_are_rejected():
+    with pytest.raises(ValueError, match="calls Python"):
+
+        class Slow(Curve):
+            alias = "Slow"
+            numerator = pl.col("Month End Balance") + pl.col("Payment Made").map_elements(
+                lambda x: x, return_dtype=pl.Float64
+            )
+            denominator = pl.col("Month End Balance")
+
+
+def test_components_override_is_checked(make_portfolio):
+    class Broken(Curve):
+        alias = "Broken"
+        metrics = ["Payment Made"]
+
+        @classmethod
+        def components(cls, panel, index="Seasoning"):
+            return panel.select(pl.col(index), pl.col("Payment Made").alias("numerator"))
+
+    portfolio = enrich(make_portfolio("long"))
+    panel = portfolio.long_data(["Seasoning", "Payment Made"])
+    with pytest.raises(ValueError, match="denominator"):
+        curve_components(Broken, panel, "Seasoning")
+
+
+def test_accumulator_save_load_and_remove(make_portfolio, tmp_path):
+    portfolio = make_portfolio()
+    loan_ids = portfolio.loan_index.to_numpy()
+    first, second = portfolio.subset(loan_ids[:150]), portfolio.subset(loan_ids[150:])
+    acc = CurveAccumulator(CPR, pivots=["product"])
+    acc.add(first)
+    acc.add(second)
+    assert_same_curves(acc.curves, CPR(portfolio, pivots=["product"]).curves)
+
+    path = tmp_path / "cpr.parquet"
+    acc.save(path)
+    res = CurveAccumulator.load(path)
+    assert (res.curve, res.index, res.pivots) == (CPR, "Seasoning", ["product"])
+    res.remove(second)
+    assert_same_curves(res.curves, CPR(first, pivots=["product"]).curves)
@@ -0,0 +1,101 @@
+import numpy as np
+import pandas as pd
+import pyarrow.parquet as pq
+import pytest
+
+from pola import ChunkedPortfolio, PortfolioOfOutstandingLoans, io, synthetic
+from pola.curves import CPR
+
+
+@pytest.mark.parametrize("fmt", ["parquet", "ipc", "csv"])
+def test_files_round_trip(make_portfolio, tmp_path, fmt):
+    portfolio = make_portfolio()
+    portfolio.add_default_month()
+    portfolio.to_files(tmp_path, fmt)
+    res = PortfolioOfOutstandingLoans.from_files(tmp_path, fmt)
+
+    assert res.get_date_cols() == portfolio.get_date_cols()
+    for data_name in portfolio.storage.labels():
+        np.testing.assert_allclose(
+            res.get_values(data_name), portfolio.get_values(data_name), equal_nan=True
+        )
+
+
+@pytest.mark.parametrize("fmt", ["parquet", "ipc", "csv"])
+def test_loan_range(make_portfolio, tmp_path, fmt):
+    portfolio = make_portfolio()
+    portfolio.to_files(tmp_path, fmt, chunk_size=50)
+    res = PortfolioOfOutstandingLoans.from_files(tmp_path, fmt, loan_range=(101, 151))
+
+    assert res.static_df["loan_id"].tolist() == list(range(101, 151))
+    expected = portfolio.subset(np.arange(101, 151))
+    np.testing.assert_allclose(
+        res.get_values("Month End Balance"),
+        expected.get_values("Month End Balance"),
+        equal_nan=True,
+    )
+
+
+def test_parquet_is_written_in_row_groups(tmp_path):
+    df = pd.DataFrame({"loan_id": np.arange(1000)[::-1], "x": np.arange(1000.0)})
+    path = tmp_path / "frame.parquet"
+    io.write_frame(df, path, "parquet", key="loan_id", rows_per_group=100)
+
+    meta = pq.ParquetFile(path).metadata
+    assert meta.num_row_groups == 10
+    # sorted by key, so that a range of loans is a few row groups
+    assert io.read_frame(path, "parquet")["loan_id"].is_monotonic_increasing
+
+
+def test_other_key(generated, tmp_path):
+    static_df, tabs = generated
+    static_df = static_df.rename(columns={"loan_id": "id"})
+    tabs = {name: df.rename(columns={"loan_id": "ID"}) for name, df in tabs.items()}
+    data_df = PortfolioOfOutstandingLoans._concat_data_tabs(
+        [tabs[tab.tab_name] for tab in synthetic.DATA_TABS],
+        [tab.long_name for tab in synthetic.DATA_TABS],
+        "id",
+    )
+    portfolio = PortfolioOfOutstandingLoans(data_df, static_df, "id")
+    portfolio.to_parquet(tmp_path, chunk_size=100)
+
+    res = PortfolioOfOutstandingLoans.from_parquet(tmp_path, key="id", storage="long")
+    np.testing.assert_array_equal(
+        res.get_values("Payment Made"), portfolio.get_values("Payment Made")
+    )
+    chunked = ChunkedPortfolio(tmp_path, key="id", chunk_size=100)
+    assert CPR(chunked).curves.equals(CPR(portfolio).curves)
+
+
+def test_excel_cache(tmp_path, monkeypatch):
+    path = tmp_path / "portfolio.xlsx"
+    synthetic.to_excel(path, *synthetic.generate(30, 12, seed=1))
+
+    def read():
+        return PortfolioOfOutstandingLoans.from_excel(
+            path, synthetic.STATIC_TAB, data_tabs=synthetic.DATA_TABS, cache=True
+        )
+
+    # miss: read from the workbook, then cached
+    expected = read()
+    tabs = [synthetic.STATIC_TAB, *synthetic.DATA_TABS]
+    assert io.read_cache(io.excel_cache_dir(path, tabs), ["data", "static"]) is not None
+
+    # hit: the workbook is not read again
+    def fail(*args, **kwargs):
+        raise AssertionError("read the workbook")
+
+    with monkeypatch.context() as m:
+        m.setattr(io, "read_excel_tabs", fail)
+        res = read()
+    pd.testing.assert_frame_equal(res.static_df, expected.static_df)
+    np.testing.assert_array_equal(
+        res.get_values("Payment Made"), expected.get_values("Payment Made")
+    )
+
+    # miss: a changed workbook is read again
+    synthetic.to_excel(path, *synthetic.generate(30, 12, seed=2))
+    res = read()
+    assert not np.allclose(
+        res.get_values("Payment Made"), expected.get_values("Payment Made"), equal_nan=True
+    )
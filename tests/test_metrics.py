@@ -0,0 +1,276 @@
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pandas as pd
+import polars as pl
+import pytest
+from conftest import STORAGES, enrich
+
+from pola import kernels, profiling
+
+
+def default_months_loop(portfolio, n_missed, tolerance=-0.0001):
+    """DefaultMonth the way the original loop found it"""
+    made = np.nan_to_num(portfolio.get_values("Payment Made"))
+    due = np.nan_to_num(portfolio.get_values("Payment Due"))
+    months = portfolio.get_date_cols()
+    res = []
+    for row in made - due:
+        missed, found = 0, None
+        for i, value in enumerate(row):
+            missed = missed + 1 if value < tolerance else 0
+            if missed == n_missed:
+                found = months[i]
+                break
+        res.append(found)
+    return res
+
+
+@pytest.mark.parametrize("n_missed", [1, 3, 5])
+def test_default_month_as_loop(make_portfolio, n_missed):
+    portfolio = make_portfolio()
+    portfolio.add_default_month(n_missed=n_missed)
+    expected = default_months_loop(portfolio, n_missed)
+    assert portfolio.static_df["DefaultMonth"].tolist() == expected
+    assert any(month is not None for month in expected)
+
+
+@pytest.mark.parametrize("storage", STORAGES)
+def test_same_metrics_in_every_storage(make_portfolio, storage):
+    expected = enrich(make_portfolio("wide"))
+    portfolio = enrich(make_portfolio(storage))
+    for data_name in expected.storage.labels():
+        np.testing.assert_allclose(
+            portfolio.get_values(data_name),
+            expected.get_values(data_name),
+            # compact storage keeps balances as float32
+            rtol=1e-6 if storage == "compact" else 1e-12,
+            equal_nan=True,
+            err_msg=data_name,
+        )
+    for col in ["DefaultMonth", "LastRecoveryMonth", "PrepaymentDate"]:
+        assert portfolio.static_df[col].tolist() == expected.static_df[col].tolist()
+
+
+def test_recovery_kernel_runs_once(make_portfolio, monkeypatch):
+    calls = []
+    recovery = kernels.recovery
+
+    def counted(*args, **kwargs):
+        calls.append(args)
+        return recovery(*args, **kwargs)
+
+    monkeypatch.setattr(kernels, "recovery", counted)
+    portfolio = make_portfolio()
+    portfolio.require(
+        "Is Recovery Payment",
+        "Cummulative Recovery",
+        "LastRecoveryMonth",
+        "RecoveredAmmount",
+    )
+    portfolio.add_cummulative_recovery_payments()
+    assert len(calls) == 1
+
+
+def test_cummulative_recovery_alias_keeps_dependents(make_portfolio):
+    portfolio = make_portfolio()
+    portfolio.add_is_recovery_payment()
+    portfolio.add_recovery_percent()
+    portfolio.add_cummulative_recovery_payments()
+    assert "RecoveryPercent" in portfolio.static_df
+
+
+@pytest.mark.parametrize("storage", STORAGES)
+def test_add_methods_return_wide_frames(make_portfolio, storage):
+    portfolio = make_portfolio(storage)
+    data_df = portfolio.add_seasoning()
+    assert isinstance(data_df, pd.DataFrame)
+    assert "Seasoning" in set(data_df["Data"])
+    static_df = portfolio.add_exposure_at_default()
+    assert static_df is portfolio.static_df
+
+
+@pytest.mark.parametrize("storage", ["long", "compact"])
+def test_required_metrics_are_not_converted(make_portfolio, storage):
+    portfolio = enrich(make_portfolio(storage))
+    report = portfolio.profile_report()
+    stages = [name for name in report.index if name.startswith("add_")]
+    assert stages
+    # the two add_* calls of enrich return data_df, built from the store
+    called = ["add_default_month", "add_prepayment_date"]
+    required = report.loc[[name for name in stages if name not in called]]
+    assert (required["conversions"] == 0).all()
+
+
+def test_profile_records_memory_without_tracemalloc(make_portfolio):
+    portfolio = make_portfolio("long")
+    portfolio.require("Seasoning")
+    report = portfolio.profile_report()
+    assert report.loc["add_seasoning", "peak_memory_mb"] >= 0
+
+
+def test_sharded_require_same_as_single_process(make_portfolio):
+    expected = make_portfolio()
+    expected.require("Cummulative Recovery", "N missing payments")
+    portfolio = make_portfolio()
+    portfolio.require("Cummulative Recovery", "N missing payments", n_workers=2)
+    for data_name in ["Cummulative Recovery", "N missing payments", "Is Default Month"]:
+        np.testing.assert_array_equal(
+            portfolio.get_values(data_name), expected.get_values(data_name)
+        )
+    pd.testing.assert_frame_equal(portfolio.static_df, expected.static_df)
+
+
+def test_long_data_is_one_row_per_loan_month(make_portfolio):
+    portfolio = make_portfolio("long")
+    portfolio.require("Seasoning")
+    panel = portfolio.long_data(["Seasoning"], ["product"])
+    n_loans, n_months = len(portfolio.static_df), len(portfolio.get_date_cols())
+    assert panel.height == n_loans * n_months
+    assert panel.schema["Seasoning"] == pl.Float64
+
+
+def test_is_active_and_exposure_as_loop(make_portfolio):
+    portfolio = make_portfolio()
+    portfolio.add_default_month(n_missed=2)
+    portfolio.require("Is Active", "BalanceAtDefault")
+    months = portfolio.get_date_cols()
+    balances = portfolio.get_values("Month End Balance")
+    is_active = portfolio.get_values("Is Active")
+
+    for row, (_, loan) in enumerate(portfolio.static_df.iterrows()):
+        default_month = loan["DefaultMonth"]
+        for i, month in enumerate(months):
+            originated = month >= loan["origination_date"].date()
+            in_default = default_month is not None and month <= default_month
+            assert is_active[row, i] == (originated and not in_default)
+        if default_month is None:
+            assert np.isnan(loan["BalanceAtDefault"])
+        else:
+            assert loan["BalanceAtDefault"] == balances[row, months.index(default_month)]
+
+
+def test_require_computes_inputs_and_recomputes_dependents(make_portfolio):
+    portfolio = make_portfolio()
+    portfolio.require("Is Active")
+    assert "DefaultMonth" in portfolio.static_df
+
+    # dependents of the new DefaultMonth are dropped, then computed from it
+    portfolio.add_default_month(n_missed=1)
+    assert "Is Active" not in portfolio.storage
+    portfolio.require("Is Active")
+
+    expected = make_portfolio()
+    expected.add_default_month(n_missed=1)
+    expected.add_is_active()
+    np.testing.assert_array_equal(
+        portfolio.get_values("Is Active"), expected.get_values("Is Active")
+    )
+
+
+def prepayment_dates_loop(portfolio, n_zero_months, exclude_defaulted):
+    """PrepaymentDate one loan and one month at a time"""
+    balances = portfolio.get_values("Month End Balance")
+    months = portfolio.get_date_cols()
+    res = []
+    for row, default_month in zip(balances, portfolio.static_df["DefaultMonth"]):
+        found, zeros = None, 0
+        for i, balance in enumerate(row):
+            defaulted = (
+                exclude_defaulted
+                and default_month is not None
+                and months[i] >= default_month
+            )
+            zeros = zeros + 1 if balance < 0.00001 and not defaulted else 0
+            if zeros == n_zero_months:
+                found = months[i + 1 - n_zero_months]
+                break
+        res.append(found)
+    return res
+
+
+@pytest.mark.parametrize("n_zero_months, exclude_defaulted", [(1, False), (3, True)])
+def test_prepayment_date_as_loop(make_portfolio, n_zero_months, exclude_defaulted):
+    portfolio = make_portfolio()
+    portfolio.add_default_month(n_missed=2)
+    portfolio.add_prepayment_date(
+        n_zero_months=n_zero_months, exclude_defaulted=exclude_defaulted
+    )
+    expected = prepayment_dates_loop(portfolio, n_zero_months, exclude_defaulted)
+    assert portfolio.static_df["PrepaymentDate"].tolist() == expected
+    assert any(month is not None for month in expected)
+
+
+@pytest.mark.parametrize("exclude_defaulted", [False, True])
+def test_prepayment_date_only_depends_on_defaults_if_excluded(
+    make_portfolio, exclude_defaulted
+):
+    portfolio = make_portfolio()
+    portfolio.add_prepayment_date(exclude_defaulted=exclude_defaulted)
+    assert ("DefaultMonth" in portfolio.static_df) == exclude_defaulted
+
+    portfolio.add_default_month(n_missed=1)
+    assert ("PrepaymentDate" in portfolio.static_df) != exclude_defaulted
+    portfolio.require("PrepaymentDate")
+    expected = prepayment_dates_loop(portfolio, 1, exclude_defaulted)
+    assert portfolio.static_df["PrepaymentDate"].tolist() == expected
+
+
+@pytest.mark.parametrize("calendar", [False, True])
+def test_months_since_as_loop(make_portfolio, calendar):
+    portfolio = make_portfolio()
+    months = portfolio.get_date_cols()
+    res = portfolio.months_since("origination_date", calendar).to_numpy()
+
+    for row, origination in enumerate(portfolio.static_df["origination_date"]):
+        origination = origination.date()
+        if calendar:
+            expected = [
+                (month.year - origination.year) * 12 + month.month - origination.month
+                for month in months
+            ]
+        else:
+            # the original 30 days per month
+            expected = [round((month - origination).days / 30) for month in months]
+        np.testing.assert_array_equal(res[row], expected)
+
+
+def test_profiling_hooks_receive_every_stage(make_portfolio):
+    stages = []
+    profiling.add_hook(stages.append)
+    try:
+        portfolio = make_portfolio("long")
+        portfolio.require("Is Active")
+    finally:
+        profiling.remove_hook(stages.append)
+    portfolio.add_seasoning()
+
+    # each stage as it ends, inputs within the stage which required them
+    assert [(stage.name, stage.depth) for stage in stages] == [
+        ("add_payment_made_vs_due", 2),
+        ("add_default_month", 1),
+        ("add_is_active", 0),
+    ]
+    assert stages[-1].loans == len(portfolio.static_df)
+    report = portfolio.profile_report()
+    assert report.loc["add_is_active", "calls"] == 1
+    assert "add_seasoning" in report.index
+
+
+def test_copies_have_their_own_profile(make_portfolio):
+    portfolio = make_portfolio()
+    portfolio.subset(portfolio.loan_index[:10]).require("Seasoning")
+    portfolio.copy().require("Seasoning")
+    portfolio.without_metrics().require("Seasoning")
+    assert portfolio.profile.stages == []
+
+
+def test_profile_has_the_stages_of_shards(make_portfolio):
+    portfolio = make_portfolio()
+    with ThreadPoolExecutor(2) as executor:
+        portfolio.require("Seasoning", n_workers=2, executor=executor)
+    report = portfolio.profile_report()
+    assert report.loc["add_seasoning", "calls"] == 2
+    assert report.loc["add_seasoning", "loans"] == len(portfolio.static_df) // 2
+    stages = {stage.name: stage.depth for stage in portfolio.profile.stages}
+    assert stages == {"add_seasoning": 1, "require_sharded": 0}
@@ -0,0 +1,34 @@
+import numpy as np
+import pytest
+
+from pola.curves import CDR, CPR, RecoveryCurve
+from pola.projection import Projection
+
+
+@pytest.fixture
+def projection(make_portfolio):
+    portfolio = make_portfolio("long")
+    pivots = ["product"]
+    return Projection(
+        portfolio,
+        CPR(portfolio, pivots=pivots),
+        CDR(portfolio, pivots=pivots),
+        RecoveryCurve(portfolio, index="Time Since Default", pivots=pivots),
+        pivot="product",
+    )
+
+
+def test_same_seed_same_scenarios(projection):
+    res = projection.run(200, 24, seed=3, batch_size=64)
+    again = projection.run(200, 24, seed=3, batch_size=64)
+    for name, flows in res.flows.items():
+        np.testing.assert_array_equal(flows, again.flows[name])
+
+
+def test_mean_balance_is_expected_loan_balance(projection):
+    res = projection.run(200, 24, seed=3)
+    mean = res.mean()
+    assert len(mean) == 24
+    np.testing.assert_allclose(res.loan_balance.sum().to_numpy(), mean["Balance"])
+    # balances only ever run down
+    assert (np.diff(mean["Balance"].to_numpy()) <= 1e-9).all()
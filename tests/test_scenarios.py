@@ -0,0 +1,51 @@
+import numpy as np
+
+from pola.curves import CDR, build_all
+from pola.scenarios import CURVE, GROUP, INDEX_VALUE, SCENARIO, VALUE, ScenarioGrid
+
+
+def test_scenarios_same_as_from_scratch(make_portfolio):
+    grid = ScenarioGrid(
+        {
+            "add_default_month": {"n_missed": [2, 4]},
+            "add_prepayment_date": {"n_zero_months": [1, 2]},
+        },
+        indexes=["Seasoning", "Time Since Reversion"],
+        pivots=[[], ["product"]],
+    )
+    portfolio = make_portfolio()
+    res = grid.run(portfolio)
+    assert "DefaultMonth" not in portfolio.static_df
+
+    scenarios = grid.scenarios()
+    assert sorted(res[SCENARIO].unique()) == scenarios[SCENARIO].tolist()
+    for _, scenario in scenarios.iloc[::3].iterrows():
+        expected = make_portfolio()
+        expected.add_default_month(n_missed=scenario["add_default_month.n_missed"])
+        expected.add_prepayment_date(
+            n_zero_months=scenario["add_prepayment_date.n_zero_months"]
+        )
+        pivots = [name for name in scenario["pivots"].split(", ") if name]
+        curves = build_all(expected, indexes=[scenario["index"]], pivots=pivots)
+
+        rows = res[res[SCENARIO] == scenario[SCENARIO]]
+        for (alias, _), df in curves.items():
+            got = rows[rows[CURVE] == alias].pivot(
+                index=INDEX_VALUE, columns=GROUP, values=VALUE
+            )
+            np.testing.assert_allclose(
+                got.reindex(index=df.index, columns=df.columns).to_numpy(float),
+                df.to_numpy(float),
+                equal_nan=True,
+            )
+
+
+def test_arguments_not_varied_are_kept(make_portfolio):
+    portfolio = make_portfolio()
+    # no payment is that far below due
+    portfolio.add_default_month(tolerance=-1e9)
+    assert portfolio.static_df["DefaultMonth"].isna().all()
+
+    grid = ScenarioGrid({"add_default_month": {"n_missed": [3]}}, curves=[CDR])
+    res = grid.run(portfolio)
+    assert len(res) and (res[VALUE].fillna(0) == 0).all()
@@ -0,0 +1,95 @@
+import multiprocessing
+import pickle
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import polars as pl
+import pytest
+from conftest import STORAGES
+
+from pola import PortfolioOfOutstandingLoans
+from pola.storage import LongStorage
+
+
+@pytest.mark.parametrize("storage", STORAGES)
+def test_values_round_trip(make_portfolio, storage):
+    portfolio = make_portfolio(storage)
+    values = portfolio.get_values("Payment Made") * 2
+    portfolio.storage.add_values("Doubled", values, portfolio.loan_index)
+    np.testing.assert_allclose(
+        portfolio.get_values("Doubled"), values, rtol=1e-12, equal_nan=True
+    )
+    np.testing.assert_allclose(
+        portfolio.get_data("Doubled").to_numpy(float), values, equal_nan=True
+    )
+
+
+@pytest.mark.parametrize("storage", STORAGES)
+def test_update_values(make_portfolio, storage):
+    portfolio = make_portfolio(storage)
+    loan_ids = portfolio.loan_index.to_numpy()[[0, 5]]
+    values = np.arange(2 * len(portfolio.get_date_cols()), dtype=float).reshape(2, -1)
+    portfolio.storage.update_values("Payment Due", values, loan_ids)
+    np.testing.assert_array_equal(portfolio.get_values("Payment Due")[[0, 5]], values)
+
+
+@pytest.mark.parametrize("storage", STORAGES)
+def test_copy_is_independent(make_portfolio, storage):
+    portfolio = make_portfolio(storage)
+    copy = portfolio.copy()
+    copy.add_default_month(n_missed=1)
+    assert "DefaultMonth" not in portfolio.static_df
+    assert "Is Default Month" not in portfolio.storage
+
+
+def test_compact_only_downcasts_balances(make_portfolio):
+    portfolio = make_portfolio("compact")
+    portfolio.require("Payment Made vs Due", "Is Default Month", "Seasoning")
+    schema = portfolio.storage.panel.schema
+    assert schema["Month End Balance"] == pl.Float32
+    assert schema["Payment Made"] == pl.Float64
+    assert schema["Payment Made vs Due"] == pl.Float64
+    assert schema["Is Default Month"] == pl.Boolean
+    assert schema["Seasoning"] == pl.Int16
+
+
+def test_mapped_store_round_trip(make_portfolio, tmp_path):
+    portfolio = make_portfolio("long")
+    portfolio.require("Seasoning")
+    path = tmp_path / "panel.arrow"
+    portfolio.storage.write_ipc(path)
+    mapped = LongStorage.read_ipc(path, portfolio.key)
+    assert mapped.panel.equals(portfolio.storage.panel)
+    assert mapped.date_cols() == portfolio.get_date_cols()
+
+
+@pytest.mark.parametrize("storage", STORAGES)
+def test_data_df_grouped_by_loan(make_portfolio, storage):
+    portfolio = make_portfolio(storage)
+    data_df = portfolio.add_seasoning()
+    first = data_df[data_df["loan_id"] == data_df["loan_id"].iloc[0]]
+    # the rows of the first loan come first, with the added metric
+    assert first.index.tolist() == list(range(len(first)))
+    assert "Seasoning" in set(first["Data"])
+    assert data_df["loan_id"].is_monotonic_increasing
+
+
+def recovered(portfolio) -> np.ndarray:
+    """Runs in a worker process"""
+    portfolio.require("Cummulative Recovery")
+    return portfolio.get_values("Cummulative Recovery")
+
+
+def test_attach_in_spawned_worker(make_portfolio, tmp_path):
+    portfolio = make_portfolio("long")
+    portfolio.add_default_month(n_missed=2)
+    portfolio.to_shared(tmp_path)
+    attached = PortfolioOfOutstandingLoans.attach(tmp_path)
+    # monthly data is mapped again by the worker, not pickled
+    assert len(pickle.dumps(attached)) < attached.storage.nbytes()
+
+    context = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(1, mp_context=context) as executor:
+        res = executor.submit(recovered, attached).result()
+    np.testing.assert_array_equal(res, recovered(portfolio))
+    assert "Cummulative Recovery" not in attached.storage